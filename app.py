@@ -13,19 +13,53 @@
 #  You should have received a copy of the GNU Affero General Public License
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-from chalice import Chalice
+import os
 
-from chalicelib.modules import bp as modules_bp
+from chalice import NotFoundError, Response
 
-app = Chalice(app_name="terraform-registry")
+from chalicelib.config import ZTR_HTTP_DISCOVERY_MAX_AGE
+from chalicelib.metrics import instrument, metrics
+from chalicelib.modules import DISCOVERY, bp as modules_bp
+from chalicelib.server import ThreadLocalChalice
+from chalicelib.stamps import cache_headers, etag, not_modified, not_modified_response
+
+# Also served by threaded WSGI servers, c.f. wsgi.py
+app = ThreadLocalChalice(app_name="terraform-registry")
 app.experimental_feature_flags.update(["BLUEPRINTS"])
 app.register_blueprint(modules_bp, url_prefix="/modules")
 
 
+DISCOVERY_ETAG = etag(DISCOVERY)
+
+
 @app.route("/.well-known/terraform.json")
+@instrument
 def discovery():
     """The Terraform Registry Service Discovery Protocol
 
        ref: https://www.terraform.io/docs/internals/remote-service-discovery.html#discovery-process
     """
-    return {"modules.v1": f"/modules/"}
+    if not_modified(app.current_request, DISCOVERY_ETAG):
+        return not_modified_response(DISCOVERY_ETAG, ZTR_HTTP_DISCOVERY_MAX_AGE)
+    return Response(
+        body=DISCOVERY,
+        headers={
+            "Content-Type": "application/json",
+            **cache_headers(DISCOVERY_ETAG, ZTR_HTTP_DISCOVERY_MAX_AGE),
+        },
+    )
+
+
+@app.route("/metrics")
+def prometheus_metrics():
+    """The metrics of the process, in the Prometheus text format
+
+    Only served outside Lambda, e.g. by `chalice local` or wsgi.py, Lambda functions
+    report them as EMF log lines.
+    """
+    if "AWS_LAMBDA_FUNCTION_NAME" in os.environ:
+        raise NotFoundError("/metrics")
+    return Response(
+        body=metrics.prometheus(),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+    )
@@ -0,0 +1,197 @@
+#  Copyright (c) 2020 Zero A.E., LLC
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import gzip
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from queue import Full, Queue
+from threading import Event
+from typing import Dict, Iterator, List, Optional
+
+from .db import SerializedItem
+from .models import ModuleModel
+
+FORMAT = "ztr-ndjson-gzip/1"
+
+# The number of scanned pages buffered between the scanners and the writer
+_QUEUE_PAGES = 8
+
+_GZIP_MAGIC = b"\x1f\x8b"
+_CHUNK_SIZE = 1 << 20
+
+
+def manifest_filename(filename: str) -> str:
+    """Return the name of the manifest of a backup file"""
+    return f"{filename}.manifest.json"
+
+
+def _put(queue: Queue, stop: Event, page) -> bool:
+    """Put a page on the queue, unless stop is set first. Return True if it was put"""
+    while not stop.is_set():
+        try:
+            queue.put(page, timeout=0.1)
+            return True
+        except Full:
+            pass
+    return False
+
+
+def _scan_segment(
+    model, segment: int, total_segments: int, queue: Queue, stop: Event
+) -> None:
+    """
+    Scan one segment of a table, putting each page of raw items on the queue
+
+    A None page marks the end of the segment, even if the scan fails. The scan
+    is abandoned once stop is set, e.g. because the writer failed.
+    """
+    connection = model._get_connection()
+    try:
+        last_evaluated_key = None
+        while not stop.is_set():
+            data = connection.scan(
+                segment=segment,
+                total_segments=total_segments,
+                exclusive_start_key=last_evaluated_key,
+            )
+            if not _put(queue, stop, (segment, data.get("Items", []))):
+                return
+            last_evaluated_key = data.get("LastEvaluatedKey")
+            if last_evaluated_key is None:
+                return
+    finally:
+        _put(queue, stop, (segment, None))
+
+
+def sha256(filename: str) -> str:
+    """Return the SHA-256 checksum of a file"""
+    digest = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def backup(filename: str, segments: int = 4, model=ModuleModel) -> Dict:
+    """
+    Back up a table as gzip-compressed NDJSON, one DynamoDB JSON item per line.
+
+    The table is scanned with `segments` parallel segments, whose pages are
+    streamed through a bounded queue to a single writer. A manifest with the item
+    counts and checksums is written next to the backup, c.f. `manifest_filename`.
+
+    :param filename: The backup file
+    :param segments: The number of parallel scan segments
+    :param model: The model whose table is backed up
+    :return: The manifest
+    """
+    queue: Queue = Queue(maxsize=_QUEUE_PAGES)
+    stop = Event()
+    segment_items: List[int] = [0] * segments
+    content = hashlib.sha256()
+
+    with ThreadPoolExecutor(max_workers=segments) as executor:
+        futures = [
+            executor.submit(_scan_segment, model, segment, segments, queue, stop)
+            for segment in range(segments)
+        ]
+
+        try:
+            with gzip.open(filename, "wb") as f:
+                running = segments
+                while running:
+                    segment, items = queue.get()
+                    if items is None:
+                        running -= 1
+                        continue
+                    for item in items:
+                        line = json.dumps(item, sort_keys=True).encode() + b"\n"
+                        content.update(line)
+                        f.write(line)
+                    segment_items[segment] += len(items)
+        except BaseException:
+            # Release the scanners blocked on the full queue
+            stop.set()
+            raise
+
+        for future in futures:
+            future.result()
+
+    manifest = {
+        "format": FORMAT,
+        "table": model.Meta.table_name,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "segments": segment_items,
+        "items": sum(segment_items),
+        "content_sha256": content.hexdigest(),
+        "sha256": sha256(filename),
+    }
+    with open(manifest_filename(filename), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    return manifest
+
+
+def _read_legacy(filename: str, model) -> Iterator[SerializedItem]:
+    """Read a backup written by PynamoDB's `Model.dump`"""
+    hash_keyname = model._hash_key_attribute().attr_name
+    range_keyname = model._range_key_attribute().attr_name
+    with open(filename) as f:
+        for hash_key, item in json.load(f):
+            attributes = dict(item["attributes"])
+            attributes[hash_keyname] = {"S": hash_key}
+            attributes[range_keyname] = {"S": item["range_key"]}
+            yield attributes
+
+
+def read_backup(filename: str, model=ModuleModel) -> Iterator[SerializedItem]:
+    """
+    Stream the items of a backup, in either the NDJSON format written by `backup`
+    or the JSON format written by PynamoDB's `Model.dump`.
+
+    :param filename: The backup file
+    :param model: The model whose table was backed up
+    """
+    with open(filename, "rb") as f:
+        is_gzip = f.read(len(_GZIP_MAGIC)) == _GZIP_MAGIC
+
+    if not is_gzip:
+        yield from _read_legacy(filename, model)
+        return
+
+    with gzip.open(filename, "rb") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def verify_backup(filename: str) -> Optional[Dict]:
+    """
+    Check a backup against its manifest, if it has one
+
+    :param filename: The backup file
+    :return: The manifest, or None if the backup has none
+    :raises ValueError: If the backup does not match its manifest
+    """
+    try:
+        with open(manifest_filename(filename)) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return None
+
+    if sha256(filename) != manifest["sha256"]:
+        raise ValueError(f"{filename} does not match the checksum of its manifest")
+    return manifest
@@ -0,0 +1,387 @@
+#  Copyright (c) 2020 Zero A.E., LLC
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import json
+import os
+import platform
+import subprocess
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from http import HTTPStatus
+from statistics import mean, median
+from time import perf_counter_ns
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from .models import ModuleModel, ModuleName, ModuleSummaryModel
+from .synthetic import CatalogShape, generate
+
+# The version of the results file format
+FORMAT = "ztr-bench/1"
+
+# Spreads the requests of a case over the catalog, deterministically
+_STRIDE = 7_919
+
+Case = Callable[[int], None]
+
+
+@dataclass
+class Timing(object):
+    """
+    The timing of one benchmark case, on one catalog size, in microseconds per call
+    """
+
+    name: str
+    size: str
+    calls: int
+    min_us: float
+    median_us: float
+    p95_us: float
+    mean_us: float
+
+    @property
+    def key(self) -> str:
+        """The name of the case on its catalog size, as compared across runs"""
+        return f"{self.size}/{self.name}"
+
+    def __str__(self) -> str:
+        return (
+            f"{self.key:<42} {self.median_us:>10.1f} µs median "
+            f"{self.p95_us:>10.1f} µs p95 {self.min_us:>10.1f} µs min"
+        )
+
+
+def measure(
+    name: str,
+    size: str,
+    case: Case,
+    calls: int,
+    warmup: int = 10,
+    setup: Optional[Callable[[], None]] = None,
+) -> Timing:
+    """
+    Time the calls of a benchmark case, one call at a time
+
+    :param name: The name of the case
+    :param size: The name of the catalog size
+    :param case: Makes the i-th call of the case
+    :param calls: The number of timed calls
+    :param warmup: The number of calls made before the timed ones
+    :param setup: Called before every call, outside of its timing, e.g. to clear
+        the caches
+    """
+    for i in range(warmup):
+        if setup is not None:
+            setup()
+        case(i)
+    samples = []
+    for i in range(calls):
+        if setup is not None:
+            setup()
+        start = perf_counter_ns()
+        case(warmup + i)
+        samples.append((perf_counter_ns() - start) / 1_000)
+    samples.sort()
+    return Timing(
+        name=name,
+        size=size,
+        calls=calls,
+        min_us=samples[0],
+        median_us=median(samples),
+        p95_us=samples[min(calls - 1, int(calls * 0.95))],
+        mean_us=mean(samples),
+    )
+
+
+class RouteClient(object):
+    """
+    Call the routes of the app in-process, through Chalice's local API Gateway
+    """
+
+    def __init__(self):
+        from chalice.config import Config
+        from chalice.local import LocalGateway
+
+        from app import app
+
+        self._gateway = LocalGateway(app, Config())
+
+    def request(
+        self,
+        method: str,
+        path: str,
+        body: Optional[Dict] = None,
+        status: int = HTTPStatus.OK,
+    ) -> Dict:
+        """
+        Make a request, and check its status
+
+        :param method: The HTTP method
+        :param path: The path and query string
+        :param body: The JSON body, if any
+        :param status: The expected status
+        :raises RuntimeError: If the response has another status
+        """
+        data = json.dumps(body).encode() if body is not None else b""
+        headers = {"host": "localhost"}
+        if body is not None:
+            headers["content-type"] = "application/json"
+        response = self._gateway.handle_request(method, path, headers, data)
+        if response["statusCode"] != status:
+            raise RuntimeError(
+                f"{method} {path}: {response['statusCode']} instead of {status}"
+            )
+        return response
+
+
+def route_cases(
+    client: RouteClient, catalog: Dict[ModuleName, List[str]]
+) -> Dict[str, Case]:
+    """
+    Return a case per route of the app, named after its view function
+
+    Each call requests another module of the catalog, or another version.
+
+    :param client: The client of the routes
+    :param catalog: The versions of every module, in semantic version order
+    """
+    names = sorted(catalog, key=str)
+    namespaces = sorted({m.namespace for m in names})
+
+    def module(i: int) -> ModuleName:
+        return names[i * _STRIDE % len(names)]
+
+    def version(i: int) -> Tuple[ModuleName, str]:
+        module_name = module(i)
+        versions = catalog[module_name]
+        return module_name, versions[i * _STRIDE % len(versions)]
+
+    def get(path: str, status: int = HTTPStatus.OK) -> None:
+        client.request("GET", path, status=status)
+
+    def resolve(i: int) -> None:
+        body = {
+            "modules": [
+                {"source": str(module(i + j)), "version": ">= 0.1.0"}
+                for j in range(10)
+            ]
+        }
+        client.request("POST", "/modules/resolve", body=body)
+
+    return {
+        "discovery": lambda i: get("/.well-known/terraform.json"),
+        "list_all": lambda i: get("/modules/"),
+        "list_namespace": lambda i: get(
+            f"/modules/{namespaces[i % len(namespaces)]}"
+        ),
+        "search": lambda i: get(f"/modules/search?q={module(i).name.split('-')[0]}"),
+        "list_latest_all_providers": lambda i: get(
+            f"/modules/{module(i).namespace}/{module(i).name}"
+        ),
+        "list_latest": lambda i: get(f"/modules/{module(i)}"),
+        "list_versions": lambda i: get(f"/modules/{module(i)}/versions"),
+        "resolve": resolve,
+        "get_module": lambda i: get("/modules/{}/{}".format(*version(i))),
+        "download_latest": lambda i: get(
+            f"/modules/{module(i)}/download", HTTPStatus.FOUND
+        ),
+        "download": lambda i: get(
+            "/modules/{}/{}/download".format(*version(i)), HTTPStatus.NO_CONTENT
+        ),
+    }
+
+
+def model_cases(catalog: Dict[ModuleName, List[str]]) -> Dict[str, Case]:
+    """
+    Return the cases of the model and version paths the routes are built on
+
+    :param catalog: The versions of every module, in semantic version order
+    """
+    from .dynamodb import latest_versions
+    from .versions import version_key, version_order
+
+    names = sorted(catalog, key=str)
+    attribute = ModuleModel.module_name
+    serialized = [attribute.serialize(m) for m in names]
+    modules = {
+        m: [ModuleModel(m, v, getter_url="./m") for v in catalog[m]] for m in names
+    }
+    items = [modules[m][-1].serialize() for m in names]
+    versions = [v for m in names for v in catalog[m]]
+    # The versions of each module, in the (string) order of the range key
+    unordered = [sorted(catalog[m]) for m in names]
+    # The versions of each namespace, grouped by module, as listed by its index
+    namespaces: Dict[str, List[ModuleModel]] = {}
+    for module_name in names:
+        namespaces.setdefault(module_name.namespace, []).extend(modules[module_name])
+    grouped = list(namespaces.values())
+
+    def pick(items: List, i: int):
+        return items[i * _STRIDE % len(items)]
+
+    def summarize(i: int) -> None:
+        module_name = pick(names, i)
+        ModuleSummaryModel.summarize(module_name, modules[module_name], "stamp")
+
+    return {
+        "ModuleNameAttribute.serialize": lambda i: attribute.serialize(pick(names, i)),
+        "ModuleNameAttribute.deserialize": lambda i: attribute.deserialize(
+            pick(serialized, i)
+        ),
+        "ModuleModel.serialize": lambda i: pick(modules[pick(names, i)], i).serialize(),
+        "ModuleModel.from_raw_data": lambda i: ModuleModel.from_raw_data(
+            pick(items, i)
+        ),
+        "version_key": lambda i: version_key(pick(versions, i)),
+        "latest_version": lambda i: max(pick(unordered, i), key=version_order),
+        "latest_versions": lambda i: sum(1 for _ in latest_versions(pick(grouped, i))),
+        "ModuleSummaryModel.summarize": summarize,
+    }
+
+
+def _clear_caches() -> None:
+    from .modules import getter_urls, module_versions
+    from .stamps import stamps
+
+    getter_urls.clear()
+    module_versions.clear()
+    stamps.clear()
+
+
+def run(
+    sizes: Dict[str, CatalogShape],
+    directory: str,
+    calls: int = 200,
+    cache: bool = False,
+    cases: Optional[Iterable[str]] = None,
+    progress: Callable[[Timing], None] = lambda timing: None,
+) -> Dict:
+    """
+    Run the benchmarks on synthetic catalogs of every size
+
+    Each catalog is written to an SQLite database in directory, and the routes are
+    served from it in-process, so the benchmarks run offline.
+
+    :param sizes: The shape of each catalog size, by name, c.f. `SIZES`
+    :param directory: The directory of the SQLite databases
+    :param calls: The number of timed calls of each case
+    :param cache: Keep the route caches between calls, instead of measuring the
+        backend lookups of every call
+    :param cases: The names of the cases to run, all of them by default
+    :param progress: Called with the timing of each case, once it has run
+    :return: The results, c.f. `save`
+    """
+    from .downloads import get_counter
+    from .repository import set_repository
+    from .sqlite import SQLiteRepository
+
+    selected = set(cases) if cases is not None else None
+    client = RouteClient()
+    timings = []
+    try:
+        for size, shape in sizes.items():
+            path = os.path.join(directory, f"bench-{size}.sqlite3")
+            if os.path.exists(path):
+                os.remove(path)
+            repository = SQLiteRepository(path)
+            repository.init()
+            catalog: Dict[ModuleName, List[str]] = {}
+            for module in generate(shape):
+                catalog.setdefault(module.module_name, []).append(module.version)
+            repository.save_many(generate(shape))
+            set_repository(repository)
+
+            setup = None if cache else _clear_caches
+            for group in (route_cases(client, catalog), model_cases(catalog)):
+                for name, case in group.items():
+                    if selected is not None and name not in selected:
+                        continue
+                    timing = measure(name, size, case, calls, setup=setup)
+                    timings.append(timing)
+                    progress(timing)
+            get_counter().flush()
+    finally:
+        set_repository(None)
+
+    return {
+        "format": FORMAT,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "commit": _commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "calls": calls,
+        "cache": cache,
+        "sizes": {size: asdict(shape) for size, shape in sizes.items()},
+        "timings": [asdict(timing) for timing in timings],
+    }
+
+
+def _commit() -> Optional[str]:
+    """Return the git commit of the working tree, or None outside a git checkout"""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save(results: Dict, filename: str) -> None:
+    """
+    Save benchmark results as JSON
+
+    :param results: The results of `run`
+    :param filename: The results file
+    """
+    with open(filename, "w") as f:
+        json.dump(results, f, indent=2)
+        f.write("\n")
+
+
+def load(filename: str) -> Dict:
+    """
+    Load benchmark results saved by `save`
+
+    :param filename: The results file
+    :raises ValueError: If the file is not a results file
+    """
+    with open(filename) as f:
+        results = json.load(f)
+    if not isinstance(results, dict) or results.get("format") != FORMAT:
+        raise ValueError(f"{filename} is not a {FORMAT} results file")
+    return results
+
+
+def compare(baseline: Dict, current: Dict) -> List[Tuple[str, float, float, float]]:
+    """
+    Compare the median timings of two runs, case by case
+
+    :param baseline: The results of the reference run, e.g. of the main branch
+    :param current: The results of the run to compare
+    :return: The key, baseline and current medians and their ratio of every case
+        of both runs, a ratio above 1 is a slowdown
+    """
+    medians = {
+        f"{t['size']}/{t['name']}": t["median_us"] for t in baseline["timings"]
+    }
+    changes = []
+    for t in current["timings"]:
+        key = f"{t['size']}/{t['name']}"
+        if key in medians and medians[key] > 0:
+            changes.append(
+                (key, medians[key], t["median_us"], t["median_us"] / medians[key])
+            )
+    return changes
@@ -0,0 +1,175 @@
+#  Copyright (c) 2020 Zero A.E., LLC
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import os
+from abc import ABC, abstractmethod
+from typing import Optional
+from urllib.parse import urlparse
+from uuid import uuid4
+
+from .config import ZTR_S3_URL
+
+
+class BlobStore(ABC):
+    """
+    A flat key/value store of binary objects, e.g. a directory or an S3 bucket
+
+    Keys are `/`-separated relative paths.
+    """
+
+    @abstractmethod
+    def put(self, key: str, data: bytes, content_type: str = None) -> None:
+        """
+        Store an object, replacing it if it exists
+
+        :param key: The object key
+        :param data: The object content
+        :param content_type: The media type to serve the object with, if supported
+        """
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[bytes]:
+        """
+        Return the content of an object, or None if it does not exist
+
+        :param key: The object key
+        """
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        """
+        Delete an object, if it exists
+
+        :param key: The object key
+        """
+
+    @abstractmethod
+    def url(self, key: str) -> str:
+        """
+        Return the URL of an object
+
+        :param key: The object key
+        """
+
+    def exists(self, key: str) -> bool:
+        """
+        Return True if an object exists
+
+        :param key: The object key
+        """
+        return self.get(key) is not None
+
+
+class LocalBlobStore(BlobStore):
+    """
+    A directory tree, e.g. the document root of a web server
+
+    Objects are written atomically, readers never see a partial object.
+    """
+
+    def __init__(self, root: str):
+        """
+        :param root: The root directory, created if needed
+        """
+        self.root = os.path.abspath(root)
+
+    def _path(self, key: str) -> str:
+        path = os.path.normpath(os.path.join(self.root, key))
+        if not path.startswith(self.root + os.sep):
+            raise ValueError(f"{key} is outside of {self.root}")
+        return path
+
+    def put(self, key: str, data: bytes, content_type: str = None) -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{uuid4().hex}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            with open(self._path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def delete(self, key: str) -> None:
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def exists(self, key: str) -> bool:
+        return os.path.isfile(self._path(key))
+
+    def url(self, key: str) -> str:
+        return f"file://{self._path(key)}"
+
+
+class S3BlobStore(BlobStore):
+    """
+    A prefix of an S3 (or S3 compatible) bucket
+    """
+
+    def __init__(self, bucket: str, prefix: str = "", client=None):
+        """
+        :param bucket: The bucket name
+        :param prefix: The key prefix of the objects
+        :param client: The S3 client, a new botocore client by default
+        """
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        if client is None:
+            import botocore.session
+
+            client = botocore.session.get_session().create_client(
+                "s3", endpoint_url=ZTR_S3_URL
+            )
+        self.client = client
+
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def put(self, key: str, data: bytes, content_type: str = None) -> None:
+        extra = {"ContentType": content_type} if content_type else {}
+        self.client.put_object(Bucket=self.bucket, Key=self._key(key), Body=data, **extra)
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self._key(key))
+        except self.client.exceptions.NoSuchKey:
+            return None
+        return response["Body"].read()
+
+    def delete(self, key: str) -> None:
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(key))
+
+    def url(self, key: str) -> str:
+        endpoint = self.client.meta.endpoint_url.rstrip("/")
+        return f"s3::{endpoint}/{self.bucket}/{self._key(key)}"
+
+
+def open_store(url: str) -> BlobStore:
+    """
+    Open the blob store of a URL
+
+    :param url: `s3://<bucket>/<prefix>`, or a local directory (or `file://` URL)
+    """
+    parsed = urlparse(url)
+    if parsed.scheme == "s3":
+        return S3BlobStore(parsed.netloc, parsed.path)
+    if parsed.scheme == "file":
+        return LocalBlobStore(parsed.path)
+    return LocalBlobStore(url)
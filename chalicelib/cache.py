@@ -0,0 +1,145 @@
+#  Copyright (c) 2020 Zero A.E., LLC
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional
+
+from .singleflight import SingleFlight
+
+
+class TTLCache(object):
+    """
+    A bounded, thread-safe, read-through cache with LRU eviction
+
+    Entries expire `ttl` seconds after they are loaded. A loader returning None
+    means "not found", which is cached as well, but only for `negative_ttl`
+    seconds. Concurrent misses of the same key share one load, c.f. `flights`.
+    """
+
+    def __init__(
+        self,
+        maxsize: int,
+        ttl: float,
+        negative_ttl: float,
+        clock: Callable[[], float] = monotonic,
+    ):
+        """
+        :param maxsize: The maximum number of entries, the least recently used is evicted
+        :param ttl: The number of seconds found values are cached for
+        :param negative_ttl: The number of seconds not found values are cached for
+        :param clock: Returns the current time in seconds
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._clock = clock
+        self._lock = Lock()
+        self._entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self.flights = SingleFlight()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable, loader: Callable[[], Optional[Any]]) -> Optional[Any]:
+        """
+        Return the cached value for key, calling loader on a miss
+
+        :param key: The cache key
+        :param loader: Returns the value for key, or None if it does not exist
+        """
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        def load() -> Optional[Any]:
+            value = loader()
+            with self._lock:
+                self._store(key, value, now)
+            return value
+
+        return self.flights.do(key, load)
+
+    def get_many(
+        self,
+        keys: Iterable[Hashable],
+        loader: Callable[[List[Hashable]], Dict[Hashable, Any]],
+    ) -> Dict[Hashable, Optional[Any]]:
+        """
+        Return the cached values for many keys, loading all the misses at once
+
+        :param keys: The cache keys
+        :param loader: Returns the values of a list of keys, by key, leaving out
+            the keys that do not exist
+        :return: The value of every key, None for those that do not exist
+        """
+        now = self._clock()
+        values: Dict[Hashable, Optional[Any]] = {}
+        missing = []
+        with self._lock:
+            for key in dict.fromkeys(keys):
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    values[key] = entry[1]
+                else:
+                    self.misses += 1
+                    missing.append(key)
+
+        def load(keys: List[Hashable]) -> Dict[Hashable, Any]:
+            loaded = loader(keys)
+            with self._lock:
+                for key in keys:
+                    self._store(key, loaded.get(key), now)
+            return loaded
+
+        if missing:
+            values.update(self.flights.do_many(missing, load))
+        return values
+
+    def _store(self, key: Hashable, value: Optional[Any], now: float) -> None:
+        expires_at = now + (self.ttl if value is not None else self.negative_ttl)
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key: Hashable) -> None:
+        """
+        Drop the cached value for key, if any
+
+        :param key: The cache key
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        """Drop all the cached values and reset the counters"""
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    def stats(self) -> Dict[str, int]:
+        """Return the hit/miss counters and the current size"""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self)}
@@ -0,0 +1,468 @@
+#  Copyright (c) 2020 Zero A.E., LLC
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+from datetime import datetime, timezone
+from threading import Lock
+from time import monotonic
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from uuid import uuid4
+
+from .blobs import BlobStore, open_store
+from .config import ZTR_CATALOG_CHECK_SECONDS, ZTR_CATALOG_DIR, ZTR_CATALOG_URL
+from .names import ModuleName
+from .repository import get_repository
+
+log = logging.getLogger(__name__)
+
+FORMAT = "ztr-catalog/1"
+SNAPSHOT_PREFIX = "catalog"
+
+# The attributes of a snapshot, the download URLs and the search documents
+_ATTRIBUTES = [
+    "module_name",
+    "version",
+    "getter_url",
+    "mirror_url",
+    "verified",
+    "owner",
+    "description",
+    "source",
+    "published_at",
+    "downloads",
+]
+
+# The block offsets are unsigned 64-bit big-endian integers
+_OFFSET = struct.Struct("!Q")
+
+
+def snapshot_key(generation: str) -> str:
+    """Return the blob store key of the snapshot of a catalog generation"""
+    return f"{SNAPSHOT_PREFIX}/{generation}"
+
+
+def new_generation() -> str:
+    """Return a new catalog generation, generations sort in the order they are made"""
+    return f"{datetime.now(timezone.utc):%Y%m%dT%H%M%S.%fZ}-{uuid4().hex[:8]}"
+
+
+def _document(module) -> Dict:
+    """Return the search document of the latest version of a module"""
+    published_at = module.published_at
+    return {
+        "version": module.version,
+        "verified": module.verified,
+        "owner": module.owner,
+        "description": module.description,
+        "source": module.source,
+        "published_at": published_at.isoformat() if published_at else None,
+        "downloads": module.downloads,
+    }
+
+
+def _blocks(modules: Iterable) -> Dict[str, bytes]:
+    """
+    Render the block of every module, c.f. `render_snapshot`
+
+    :param modules: Module versions, with the snapshot attributes
+    :return: The blocks, by module name
+    """
+    from .versions import version_key
+
+    grouped: Dict[str, List] = {}
+    for module in modules:
+        grouped.setdefault(str(module.module_name), []).append(module)
+
+    blocks = {}
+    for fqmn, versions in grouped.items():
+        keyed = sorted(
+            (version_key(m.version), m)
+            for m in versions
+            if version_key(m.version) is not None
+        )
+        block = {
+            "versions": [m.version for _, m in keyed],
+            "urls": {m.version: m.download_url for m in versions},
+            "latest": _document(keyed[-1][1]) if keyed else None,
+        }
+        blocks[fqmn] = f"{fqmn}\t{json.dumps(block, sort_keys=True)}\n".encode()
+    return blocks
+
+
+def render_snapshot(generation: str, modules: Iterable) -> bytes:
+    """
+    Render a catalog snapshot
+
+    A snapshot is a JSON header line, followed by the offset of every module's
+    block, and the blocks in module name order. A block is one line, the module
+    name and a JSON document separated by a tab, holding the semantic versions in
+    order, the download URL of every version, and the search document of the
+    latest version. Modules are found with a binary search of the offsets, so a
+    lookup only reads the block of the module.
+
+    :param generation: The generation of the snapshot
+    :param modules: Every module version, with the snapshot attributes
+    """
+    return _render(generation, _blocks(modules))
+
+
+def _render(generation: str, rendered: Dict[str, bytes]) -> bytes:
+    """Render a catalog snapshot from the blocks of its modules, by module name"""
+    blocks = [rendered[fqmn] for fqmn in sorted(rendered, key=str.encode)]
+    header = json.dumps(
+        {"format": FORMAT, "generation": generation, "modules": len(blocks)}
+    ).encode()
+    offset = len(header) + 1 + _OFFSET.size * len(blocks)
+    offsets = []
+    for block in blocks:
+        offsets.append(_OFFSET.pack(offset))
+        offset += len(block)
+    return b"".join([header, b"\n", *offsets, *blocks])
+
+
+class CatalogSnapshot(object):
+    """
+    A read-only, memory-mapped catalog snapshot, c.f. `render_snapshot`
+
+    The file is only read as it is looked up, so the pages of the modules that
+    are never requested are not even loaded.
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: The snapshot file
+        :raises ValueError: If the file is not a catalog snapshot
+        """
+        self.path = path
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        end = self._map.find(b"\n")
+        try:
+            header = json.loads(self._map[:end])
+        except ValueError:
+            header = {}
+        if header.get("format") != FORMAT:
+            raise ValueError(f"{path} is not a {FORMAT} catalog snapshot")
+        self.generation: str = header["generation"]
+        self._count: int = header["modules"]
+        self._offsets = end + 1
+        self._index_lock = Lock()
+        self._index = None
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _offset(self, i: int) -> int:
+        return _OFFSET.unpack_from(self._map, self._offsets + _OFFSET.size * i)[0]
+
+    def _name(self, offset: int) -> bytes:
+        return self._map[offset : self._map.find(b"\t", offset)]
+
+    def _line(self, module_name: ModuleName) -> Optional[bytes]:
+        """Return the rendered block of a module, or None if it is not there"""
+        key = str(module_name).encode()
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self._name(self._offset(middle)) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low == self._count:
+            return None
+        offset = self._offset(low)
+        if self._name(offset) != key:
+            return None
+        return self._map[offset : self._map.find(b"\n", offset)]
+
+    def _block(self, module_name: ModuleName) -> Optional[Dict]:
+        """Return the block of a module, or None if the snapshot does not have it"""
+        line = self._line(module_name)
+        return json.loads(line[line.find(b"\t") + 1 :]) if line is not None else None
+
+    def digest(self, module_name: ModuleName) -> str:
+        """
+        Return a digest of the block of a module, which only changes with it
+
+        :param module_name: The module name
+        """
+        line = self._line(module_name)
+        return hashlib.sha256(line or b"").hexdigest()
+
+    def blocks(self) -> Iterator[Tuple[ModuleName, Dict]]:
+        """Yield the name and block of every module, in module name order"""
+        for fqmn, line in self.lines():
+            block = json.loads(line[line.find(b"\t") + 1 :])
+            yield ModuleName(*fqmn.split("/")), block
+
+    def lines(self) -> Iterator[Tuple[str, bytes]]:
+        """Yield the name and the rendered block of every module, c.f. `_blocks`"""
+        for i in range(self._count):
+            offset = self._offset(i)
+            line = self._map[offset : self._map.find(b"\n", offset) + 1]
+            yield line[: line.find(b"\t")].decode(), line
+
+    def versions(self, module_name: ModuleName) -> List[str]:
+        """
+        Return the semantic versions of a module, in semantic version order
+
+        :param module_name: The module name
+        """
+        block = self._block(module_name)
+        return block["versions"] if block is not None else []
+
+    def latest_version(self, module_name: ModuleName) -> Optional[str]:
+        """
+        Return the latest version of a module, or None if it has no versions
+
+        :param module_name: The module name
+        """
+        versions = self.versions(module_name)
+        return versions[-1] if versions else None
+
+    def download_url(self, module_name: ModuleName, version: str) -> Optional[str]:
+        """
+        Return the download URL of a module version, or None if it does not exist
+
+        :param module_name: The module name
+        :param version: The module version
+        """
+        block = self._block(module_name)
+        return block["urls"].get(version) if block is not None else None
+
+    def latest_modules(self) -> Iterator:
+        """Yield the latest version of every module, with its search attributes"""
+        from dateutil.parser import isoparse
+
+        from .models import ModuleModel
+
+        for module_name, block in self.blocks():
+            latest = block["latest"]
+            if latest is None:
+                continue
+            published_at = latest.pop("published_at")
+            yield ModuleModel(
+                module_name,
+                published_at=isoparse(published_at) if published_at else None,
+                **latest,
+            )
+
+    def search(self, q: str, **kwargs):
+        """
+        Search the latest version of every module, c.f. `ModuleRepository.search`
+
+        The search index of the snapshot is built on first use.
+        """
+        from .search import SearchIndex
+
+        with self._index_lock:
+            if self._index is None:
+                index = SearchIndex(loader=self.latest_modules)
+                index.build()
+                self._index = index
+        return self._index.search(q, **kwargs)
+
+
+def publish(
+    store: BlobStore,
+    module_names: Optional[Iterable[ModuleName]] = None,
+    base: Optional[CatalogSnapshot] = None,
+) -> Optional[str]:
+    """
+    Publish a snapshot of the whole catalog, and bump the catalog generation
+
+    The snapshot is stored before the generation is bumped, so readers never see
+    a generation without its snapshot. The snapshot of the replaced generation is
+    deleted. Generations are ordered, so a publish that loses the race with a
+    later one leaves the later one in place.
+
+    Given a base snapshot and the modules changed since, only the versions of
+    those modules are read, and the other blocks are copied from the base. The
+    new generation then only replaces the base's, or the catalog is scanned.
+
+    :param store: The blob store of the snapshots
+    :param module_names: The modules changed since the base snapshot
+    :param base: The snapshot of the current generation
+    :return: The new generation, or None if a later one was published meanwhile
+    """
+    generation = new_generation()
+    repository = get_repository()
+    incremental = base is not None and module_names is not None
+    if not incremental:
+        blocks = _blocks(repository.scan(attributes=_ATTRIBUTES))
+    else:
+        blocks = dict(base.lines())
+        for module_name in set(module_names):
+            blocks.pop(str(module_name), None)
+            versions = repository.module_versions(module_name, attributes=_ATTRIBUTES)
+            blocks.update(_blocks(versions))
+    snapshot = _render(generation, blocks)
+    store.put(snapshot_key(generation), snapshot, "application/octet-stream")
+
+    if incremental:
+        previous = base.generation
+        if not repository.set_catalog_generation(generation, replacing=previous):
+            store.delete(snapshot_key(generation))
+            log.info("The catalog changed since %s, rescanning it", previous)
+            return publish(store)
+    else:
+        previous = repository.catalog_generation()
+        if not repository.set_catalog_generation(generation):
+            store.delete(snapshot_key(generation))
+            return None
+    if previous is not None:
+        store.delete(snapshot_key(previous))
+    return generation
+
+
+class Catalog(object):
+    """
+    The catalog snapshot of a process, reloaded when its generation changes
+
+    The catalog generation is read from the backend at most every `check_seconds`.
+    A new generation's snapshot is copied from the blob store to `directory`, once
+    per host, and memory-mapped. Readers keep using the previous snapshot while
+    another thread checks or loads the next one.
+    """
+
+    def __init__(
+        self,
+        url: Optional[str] = ZTR_CATALOG_URL,
+        directory: str = ZTR_CATALOG_DIR,
+        check_seconds: float = ZTR_CATALOG_CHECK_SECONDS,
+        clock: Callable[[], float] = monotonic,
+    ):
+        """
+        :param url: The blob store of the snapshots, snapshots are disabled if None
+        :param directory: The local directory the snapshots are copied to
+        :param check_seconds: The minimum number of seconds between two checks
+        :param clock: Returns the current time in seconds
+        """
+        self.url = url
+        self.directory = directory
+        self.check_seconds = check_seconds
+        self._clock = clock
+        self._store: Optional[BlobStore] = None
+        self._lock = Lock()
+        self._snapshot: Optional[CatalogSnapshot] = None
+        self._checked_at: Optional[float] = None
+
+    @property
+    def store(self) -> BlobStore:
+        """The blob store of the snapshots"""
+        if self._store is None:
+            self._store = open_store(self.url)
+        return self._store
+
+    def _path(self, generation: str) -> str:
+        return os.path.join(self.directory, f"ztr-{snapshot_key(generation)}")
+
+    def _load(self, generation: str) -> Optional[CatalogSnapshot]:
+        path = self._path(generation)
+        if not os.path.exists(path):
+            data = self.store.get(snapshot_key(generation))
+            if data is None:
+                log.warning("The catalog snapshot %s does not exist", generation)
+                return None
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{uuid4().hex}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        return CatalogSnapshot(path)
+
+    def _check(self) -> None:
+        self._checked_at = self._clock()
+        try:
+            generation = get_repository().catalog_generation()
+            current = self._snapshot
+            if generation is None or (
+                current is not None and current.generation == generation
+            ):
+                return
+            snapshot = self._load(generation)
+            if snapshot is None:
+                return
+            self._snapshot = snapshot
+            if current is not None:
+                # Mapped pages outlive their file, so the readers of the previous
+                # snapshot are unaffected. Another process may have removed it.
+                try:
+                    os.remove(current.path)
+                except FileNotFoundError:
+                    pass
+        except Exception:  # noqa, the routes fall back to the backend
+            log.exception("Failed to check the catalog generation")
+
+    def current(self) -> Optional[CatalogSnapshot]:
+        """
+        Return the current catalog snapshot, or None if snapshots are disabled or
+        there is none yet
+
+        Only the first check blocks, concurrent callers keep using the current
+        snapshot while another thread checks the generation.
+        """
+        if self.url is None:
+            return None
+        if self._checked_at is None:
+            with self._lock:
+                if self._checked_at is None:
+                    self._check()
+            return self._snapshot
+
+        if self._clock() - self._checked_at >= self.check_seconds:
+            if self._lock.acquire(blocking=False):
+                try:
+                    self._check()
+                finally:
+                    self._lock.release()
+        return self._snapshot
+
+    def publish(
+        self, module_names: Optional[Iterable[ModuleName]] = None
+    ) -> Optional[str]:
+        """
+        Publish a new snapshot, if snapshots are enabled, c.f. `publish`
+
+        :param module_names: Only read the versions of these modules, and copy the
+            rest of the catalog from the current snapshot, if there is one
+        :return: The new generation, or None
+        """
+        if self.url is None:
+            return None
+        if module_names is None:
+            return publish(self.store)
+
+        generation = get_repository().catalog_generation()
+        current = self._snapshot
+        if current is not None and current.generation == generation:
+            return publish(self.store, module_names, current)
+        base = self._load(generation) if generation is not None else None
+        try:
+            return publish(self.store, module_names, base)
+        finally:
+            # Only kept by the processes that serve the snapshot, c.f. `_check`
+            if base is not None:
+                try:
+                    os.remove(base.path)
+                except FileNotFoundError:
+                    pass
+
+
+catalog = Catalog()
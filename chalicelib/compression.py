@@ -0,0 +1,218 @@
+#  Copyright (c) 2020 Zero A.E., LLC
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import base64
+import gzip
+import io
+import json
+from functools import wraps
+from typing import Any, Callable, Dict, List, Optional
+
+from chalice import Response
+
+from .cache import TTLCache
+from .config import (
+    ZTR_CACHE_SIZE,
+    ZTR_CACHE_TTL_SECONDS,
+    ZTR_HTTP_COMPRESS,
+    ZTR_HTTP_COMPRESS_MIN_SIZE,
+)
+from .metrics import metrics
+
+# The levels of the responses compressed on every request, and of the cached ones
+GZIP_LEVEL = 6
+GZIP_CACHED_LEVEL = 9
+BROTLI_QUALITY = 5
+BROTLI_CACHED_QUALITY = 11
+
+# The compressed bodies of the responses with an entity tag, by (tag, encoding)
+compressed_bodies = TTLCache(
+    maxsize=ZTR_CACHE_SIZE, ttl=ZTR_CACHE_TTL_SECONDS, negative_ttl=0
+)
+metrics.register_cache("compressed_bodies", compressed_bodies)
+
+_brotli = None
+
+
+def _brotli_module():
+    """Return the brotli module, or None if it is not installed"""
+    global _brotli
+    if _brotli is None:
+        try:
+            import brotli
+        except ImportError:
+            brotli = False
+        _brotli = brotli
+    return _brotli or None
+
+
+def encodings() -> tuple:
+    """Return the supported content codings, in order of preference"""
+    return ("br", "gzip") if _brotli_module() else ("gzip",)
+
+
+def negotiate(accept_encoding: Optional[str]) -> Optional[str]:
+    """
+    Return the content coding to use for a request, or None for the identity
+
+    The codings are ranked by their quality value, then by our preference. A coding
+    with a zero quality value is never used.
+
+    :param accept_encoding: The Accept-Encoding header of the request, if any
+    """
+    if not accept_encoding:
+        return None
+    qualities: Dict[str, float] = {}
+    for item in accept_encoding.split(","):
+        coding, _, params = item.strip().partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key.lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding.strip().lower()] = quality
+
+    supported = encodings()
+    ranked = sorted(
+        supported,
+        key=lambda c: (-qualities.get(c, qualities.get("*", 0.0)), supported.index(c)),
+    )
+    best = ranked[0]
+    return best if qualities.get(best, qualities.get("*", 0.0)) > 0 else None
+
+
+def compress(body: bytes, encoding: str, cached: bool = False) -> bytes:
+    """
+    Compress a response body
+
+    :param body: The body
+    :param encoding: The content coding, c.f. `encodings`
+    :param cached: Spend more time on a body that is compressed once and cached
+    """
+    if encoding == "br":
+        quality = BROTLI_CACHED_QUALITY if cached else BROTLI_QUALITY
+        return _brotli_module().compress(body, quality=quality)
+    if encoding == "gzip":
+        level = GZIP_CACHED_LEVEL if cached else GZIP_LEVEL
+        # No timestamp, so the same body is always compressed to the same bytes.
+        # gzip.compress only takes an mtime as of Python 3.8.
+        buffer = io.BytesIO()
+        with gzip.GzipFile(
+            fileobj=buffer, mode="wb", compresslevel=level, mtime=0
+        ) as gz:
+            gz.write(body)
+        return buffer.getvalue()
+    raise ValueError(f"Unsupported content coding {encoding}")
+
+
+class CompressedResponse(Response):
+    """
+    A response with a compressed body, which is always base64 encoded
+
+    Its content type stays a text type, which the app must not list in its binary
+    types: Chalice would then reject the requests without a matching Accept header.
+    """
+
+    def to_dict(self, binary_types: Optional[List[str]] = None) -> Dict[str, Any]:
+        response = super().to_dict()
+        response["body"] = base64.b64encode(self.body).decode("ascii")
+        response["isBase64Encoded"] = True
+        return response
+
+
+def _body_bytes(body) -> bytes:
+    if isinstance(body, bytes):
+        return body
+    if not isinstance(body, str):
+        # As Chalice serializes it
+        body = json.dumps(body, separators=(",", ":"))
+    return body.encode()
+
+
+def compress_response(
+    response: Response,
+    accept_encoding: Optional[str],
+    min_size: Optional[int] = None,
+) -> Response:
+    """
+    Compress a response, if it is large enough and the client accepts it
+
+    The bodies of the responses with an entity tag are compressed once, and then
+    served from `compressed_bodies`. Their tag is weakened, the compressed body is
+    another representation of the same content.
+
+    :param response: The response
+    :param accept_encoding: The Accept-Encoding header of the request, if any
+    :param min_size: The size under which responses are not compressed, in bytes,
+        ZTR_HTTP_COMPRESS_MIN_SIZE by default
+    """
+    if min_size is None:
+        min_size = ZTR_HTTP_COMPRESS_MIN_SIZE
+    headers = {k.lower(): k for k in response.headers}
+    if (
+        not ZTR_HTTP_COMPRESS
+        or response.body is None
+        or "content-encoding" in headers
+        or not 200 <= response.status_code < 300
+    ):
+        return response
+    body = _body_bytes(response.body)
+    if len(body) < min_size:
+        return response
+
+    response.headers["Vary"] = "Accept-Encoding"
+    encoding = negotiate(accept_encoding)
+    if encoding is None:
+        return response
+
+    tag = response.headers.get(headers.get("etag", "ETag"))
+    if tag is None:
+        compressed = compress(body, encoding)
+    else:
+        compressed = compressed_bodies.get(
+            (tag, encoding), lambda: compress(body, encoding, cached=True)
+        )
+        response.headers[headers["etag"]] = tag if tag.startswith("W/") else f"W/{tag}"
+
+    response.headers.setdefault("Content-Type", "application/json")
+    response.headers["Content-Encoding"] = encoding
+    return CompressedResponse(
+        body=compressed, status_code=response.status_code, headers=response.headers
+    )
+
+
+def compressed(source) -> Callable[[Callable], Callable]:
+    """
+    Compress the responses of a route, c.f. `compress_response`
+
+    Goes between the route decorator and the view function.
+
+    :param source: The app or blueprint of the route, for its current request
+    """
+
+    def decorator(route: Callable) -> Callable:
+        @wraps(route)
+        def compressed_route(*args, **kwargs):
+            response = route(*args, **kwargs)
+            if not isinstance(response, Response):
+                response = Response(body=response)
+            accept_encoding = source.current_request.headers.get("accept-encoding")
+            return compress_response(response, accept_encoding)
+
+        return compressed_route
+
+    return decorator
@@ -13,16 +13,92 @@
 #  You should have received a copy of the GNU Affero General Public License
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import os
+
 from environs import Env
 
 env = Env()
-env.read_env()
+# Lambda functions get their whole environment from the Chalice stage, they skip
+# the search for a `.env` file
+if "AWS_LAMBDA_FUNCTION_NAME" not in os.environ:
+    env.read_env()
 
 # Configuration Options
 ZTR_LIMIT = 1_000
 
 with env.prefixed("ZTR_"):
+    # The storage backend, `dynamodb` or `sqlite`, c.f. `chalicelib.repository`
+    ZTR_BACKEND = env.str("BACKEND", default="dynamodb")
+
     with env.prefixed("DYNAMODB_"):
         ZTR_DYNAMODB_URL = env.str("URL", default=None)
         ZTR_DYNAMODB_TABLE_PREFIX = env.str("TABLE_PREFIX")
         ZTR_DYNAMODB_REGION = env.str("REGION", default="us-east-1")
+        # The connections each process keeps open, at least the threads serving
+        # requests in a multi-threaded server
+        ZTR_DYNAMODB_MAX_POOL_CONNECTIONS = env.int("MAX_POOL_CONNECTIONS", default=10)
+
+    with env.prefixed("SQLITE_"):
+        ZTR_SQLITE_PATH = env.str("PATH", default="registry.sqlite3")
+
+    with env.prefixed("S3_"):
+        # The endpoint of an S3 compatible blob store, AWS S3 if unset
+        ZTR_S3_URL = env.str("URL", default=None)
+
+    with env.prefixed("SEARCH_"):
+        ZTR_SEARCH_REFRESH_SECONDS = env.int("REFRESH_SECONDS", default=60)
+        ZTR_SEARCH_REBUILD_SECONDS = env.int("REBUILD_SECONDS", default=3_600)
+
+    with env.prefixed("CATALOG_"):
+        # The blob store of the catalog snapshots, c.f. `chalicelib.blobs.open_store`.
+        # The read routes are served from the snapshot when set.
+        ZTR_CATALOG_URL = env.str("URL", default=None)
+        # How often the catalog generation is checked, the snapshots are copied to DIR
+        ZTR_CATALOG_CHECK_SECONDS = env.int("CHECK_SECONDS", default=10)
+        ZTR_CATALOG_DIR = env.str("DIR", default="/tmp")
+
+    with env.prefixed("CACHE_"):
+        ZTR_CACHE_SIZE = env.int("SIZE", default=10_000)
+        ZTR_CACHE_TTL_SECONDS = env.int("TTL_SECONDS", default=300)
+        ZTR_CACHE_NEGATIVE_TTL_SECONDS = env.int("NEGATIVE_TTL_SECONDS", default=10)
+
+    with env.prefixed("SINGLEFLIGHT_"):
+        # How long concurrent identical lookups wait for the one in flight
+        ZTR_SINGLEFLIGHT_TIMEOUT_SECONDS = env.int("TIMEOUT_SECONDS", default=10)
+
+    with env.prefixed("HTTP_"):
+        # The Cache-Control max-age of each route, in seconds
+        ZTR_HTTP_DISCOVERY_MAX_AGE = env.int("DISCOVERY_MAX_AGE", default=86_400)
+        ZTR_HTTP_VERSIONS_MAX_AGE = env.int("VERSIONS_MAX_AGE", default=60)
+        ZTR_HTTP_DOWNLOAD_MAX_AGE = env.int("DOWNLOAD_MAX_AGE", default=300)
+        # How long the per-module change stamps behind the ETags are cached
+        ZTR_HTTP_STAMP_TTL_SECONDS = env.int("STAMP_TTL_SECONDS", default=5)
+        # Compress the JSON responses the client accepts compressed, unless they
+        # are smaller than COMPRESS_MIN_SIZE bytes
+        ZTR_HTTP_COMPRESS = env.bool("COMPRESS", default=True)
+        ZTR_HTTP_COMPRESS_MIN_SIZE = env.int("COMPRESS_MIN_SIZE", default=1_024)
+
+    with env.prefixed("SERVER_"):
+        # The WSGI server of the production mode outside Lambda, c.f. wsgi.py
+        ZTR_SERVER_STAGE = env.str("STAGE", default="local")
+        ZTR_SERVER_BIND = env.str("BIND", default="0.0.0.0:8000")
+        ZTR_SERVER_WORKERS = env.int("WORKERS", default=os.cpu_count() or 2)
+        ZTR_SERVER_THREADS = env.int("THREADS", default=8)
+        # Workers are replaced after serving MAX_REQUESTS (+ up to JITTER) requests
+        ZTR_SERVER_MAX_REQUESTS = env.int("MAX_REQUESTS", default=10_000)
+        ZTR_SERVER_MAX_REQUESTS_JITTER = env.int("MAX_REQUESTS_JITTER", default=1_000)
+        ZTR_SERVER_GRACEFUL_TIMEOUT = env.int("GRACEFUL_TIMEOUT", default=30)
+
+    with env.prefixed("METRICS_"):
+        # Print a CloudWatch Embedded Metric Format line per request, on Lambda
+        ZTR_METRICS_EMF = env.bool(
+            "EMF", default="AWS_LAMBDA_FUNCTION_NAME" in os.environ
+        )
+        ZTR_METRICS_NAMESPACE = env.str("NAMESPACE", default="TerraformRegistry")
+
+    with env.prefixed("DOWNLOADS_"):
+        ZTR_DOWNLOADS_SHARDS = env.int("SHARDS", default=10)
+        ZTR_DOWNLOADS_FLUSH_SIZE = env.int("FLUSH_SIZE", default=100)
+        ZTR_DOWNLOADS_FLUSH_SECONDS = env.int("FLUSH_SECONDS", default=30)
+        # How often the flushed counts are stored on the module versions
+        ZTR_DOWNLOADS_ROLLUP_SECONDS = env.int("ROLLUP_SECONDS", default=300)
@@ -0,0 +1,143 @@
+#  Copyright (c) 2020 Zero A.E., LLC
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import operator
+import re
+from functools import lru_cache
+from typing import Callable, Iterable, List, Optional, Tuple
+
+import semver
+
+# One comma-separated part of a constraint, e.g. "~> 3.2" or ">= 1.0.0-beta"
+_PART = re.compile(
+    r"^(?P<operator>=|!=|>=|<=|>|<|~>)?\s*v?"
+    r"(?P<major>\d+)(?:\.(?P<minor>\d+))?(?:\.(?P<patch>\d+))?"
+    r"(?:-(?P<prerelease>[0-9A-Za-z.-]+))?(?:\+[0-9A-Za-z.-]+)?$"
+)
+
+_OPERATORS = {
+    "=": operator.eq,
+    "!=": operator.ne,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le,
+}
+
+Version = semver.VersionInfo
+Check = Callable[[Version], bool]
+
+
+class InvalidConstraint(ValueError):
+    """A version constraint that does not follow the Terraform syntax"""
+
+
+def _compile_part(part: str) -> Tuple[Check, Optional[Version]]:
+    """
+    Compile one part of a constraint
+
+    :return: Its check, and its version if it is an exact constraint
+    """
+    match = _PART.match(part)
+    if match is None:
+        raise InvalidConstraint(f"Invalid version constraint {part!r}")
+    op = match["operator"] or "="
+    segments = [match[s] for s in ("major", "minor", "patch") if match[s] is not None]
+    major, minor, patch = (int(s) for s in (*segments, "0", "0")[:3])
+    version = Version(major, minor, patch, match["prerelease"])
+
+    if op != "~>":
+        compare = _OPERATORS[op]
+        return (lambda v: compare(v, version)), version if op == "=" else None
+
+    # The rightmost segment of a pessimistic constraint is the one that may grow,
+    # `~> 3` is `~> 3.0`
+    if len(segments) == 3:
+        upper = Version(major, minor + 1, 0)
+    else:
+        upper = Version(major + 1, 0, 0)
+    return (lambda v: version <= v < upper), None
+
+
+class Constraint(object):
+    """
+    A compiled Terraform version constraint, e.g. `~> 3.2` or `>= 1.0, < 2.0`
+
+    ref: https://www.terraform.io/docs/configuration/version-constraints.html
+
+    Like Terraform, a prerelease version is only matched by an exact constraint
+    on that version, e.g. `= 2.0.0-rc.1`.
+    """
+
+    def __init__(self, text: str):
+        """
+        :param text: The constraint, an empty one matches every version
+        :raises InvalidConstraint: If the constraint is not valid
+        """
+        self.text = text
+        self._checks: List[Check] = []
+        self._prereleases = set()
+        parts = text.split(",") if text.strip() else []
+        for part in parts:
+            check, exact = _compile_part(part.strip())
+            self._checks.append(check)
+            if exact is not None and exact.prerelease is not None:
+                self._prereleases.add(exact)
+
+    def __repr__(self) -> str:
+        return f"Constraint({self.text!r})"
+
+    def matches(self, version: Version) -> bool:
+        """
+        Return True if a version meets the constraint
+
+        :param version: The version
+        """
+        if version.prerelease is not None and version not in self._prereleases:
+            return False
+        return all(check(version) for check in self._checks)
+
+    def select(self, versions: Iterable[Version]) -> Optional[Version]:
+        """
+        Return the newest version that meets the constraint, if any
+
+        :param versions: The versions, newest first
+        """
+        return next((v for v in versions if self.matches(v)), None)
+
+
+@lru_cache(maxsize=1_024)
+def compile_constraint(text: str) -> Constraint:
+    """
+    Return the compiled constraint of a text, compiled once
+
+    :param text: The constraint
+    :raises InvalidConstraint: If the constraint is not valid
+    """
+    return Constraint(text)
+
+
+def parse_versions(versions: Iterable[str]) -> Tuple[Version, ...]:
+    """
+    Parse the semantic versions of a module, newest first
+
+    :param versions: The versions, in any order, the invalid ones are left out
+    """
+    parsed = []
+    for version in versions:
+        try:
+            parsed.append(Version.parse(version))
+        except (TypeError, ValueError):
+            continue
+    return tuple(sorted(parsed, reverse=True))
@@ -0,0 +1,77 @@
+#  Copyright (c) 2020 Zero A.E., LLC
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import hashlib
+import hmac
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from typing import Tuple
+
+from chalice import BadRequestError
+
+_CHECKSUM_SIZE = 16
+
+
+def _b64encode(data: bytes) -> str:
+    return urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _b64decode(data: str) -> bytes:
+    return urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def _checksum(payload: bytes, scope: str) -> bytes:
+    """
+    Return the checksum of a cursor, which ties it to the query it was issued for
+
+    It is not a signature: a cursor only holds a position in a public listing,
+    which any client may ask for, so there is no secret to share between the
+    processes that serve the pages.
+    """
+    message = scope.encode() + b"\0" + payload
+    return hashlib.sha256(message).digest()[:_CHECKSUM_SIZE]
+
+
+def encode(position: str, offset: int, scope: str) -> str:
+    """
+    Return an opaque pagination cursor
+
+    :param position: The sort key of the last item of the page, e.g. a module FQMN
+    :param offset: The offset of the next page, reported in its meta
+    :param scope: The query the cursor belongs to, it is rejected by any other
+    """
+    payload = json.dumps([position, offset], separators=(",", ":")).encode()
+    return f"{_b64encode(payload)}.{_b64encode(_checksum(payload, scope))}"
+
+
+def decode(cursor: str, scope: str) -> Tuple[str, int]:
+    """
+    Verify and decode a pagination cursor
+
+    :param cursor: The cursor, c.f. `encode`
+    :param scope: The query the cursor must belong to
+    :return: The position and the offset of the page
+    :raises BadRequestError: If the cursor is malformed, corrupted, or was
+                             issued for another query
+    """
+    try:
+        payload, checksum = (_b64decode(part) for part in cursor.split("."))
+        if not hmac.compare_digest(checksum, _checksum(payload, scope)):
+            raise ValueError("bad checksum")
+        position, offset = json.loads(payload)
+        if not isinstance(position, str) or not isinstance(offset, int):
+            raise ValueError("bad payload")
+    except (TypeError, ValueError):
+        raise BadRequestError("cursor is invalid")
+    return position, offset
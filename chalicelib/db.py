@@ -12,35 +12,298 @@
 #
 #  You should have received a copy of the GNU Affero General Public License
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import os
+from itertools import islice
+from random import random
+from time import sleep
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+
+from pynamodb.exceptions import PutError
+
+# The DynamoDB BatchWriteItem request limit
+BATCH_WRITE_SIZE = 25
+BATCH_GET_SIZE = 100
+
+THROTTLING_ERRORS = ("ProvisionedThroughputExceededException", "ThrottlingException")
+
+SerializedItem = Dict[str, Dict[str, Any]]
+
+
+def _models():
+    from chalicelib.models import (
+        CatalogModel,
+        DownloadCounterModel,
+        ModuleModel,
+        ModuleSummaryModel,
+    )
+
+    return [ModuleModel, DownloadCounterModel, ModuleSummaryModel, CatalogModel]
+
+
+def _wait_for_index(model, index_name: str, delay: float = 2.0) -> None:
+    """Wait until a global secondary index is ACTIVE"""
+    while True:
+        description = model._get_connection().describe_table()
+        statuses = {
+            index["IndexName"]: index.get("IndexStatus")
+            for index in description.get("GlobalSecondaryIndexes", [])
+        }
+        if statuses.get(index_name) == "ACTIVE":
+            return
+        sleep(delay)
+
+
+def db_create_missing_indexes(model) -> List[str]:
+    """
+    Create the global secondary indexes added to a model after its table was
+    created, one at a time as DynamoDB requires, and wait for them to be backfilled.
+
+    :param model: The model whose table is migrated
+    :return: The names of the created indexes
+    """
+    connection = model._get_connection()
+    description = connection.describe_table()
+    existing = {i["IndexName"] for i in description.get("GlobalSecondaryIndexes", [])}
+    on_demand = (
+        description.get("BillingModeSummary", {}).get("BillingMode")
+        == "PAY_PER_REQUEST"
+    )
+
+    schema = model._get_schema()
+    created = []
+    for index in schema["global_secondary_indexes"]:
+        if index["index_name"] in existing:
+            continue
+        create = {
+            "IndexName": index["index_name"],
+            "KeySchema": index["key_schema"],
+            "Projection": index["projection"],
+        }
+        if not on_demand:
+            create["ProvisionedThroughput"] = index["provisioned_throughput"]
+        connection.connection.client.update_table(
+            TableName=model.Meta.table_name,
+            AttributeDefinitions=schema["attribute_definitions"],
+            GlobalSecondaryIndexUpdates=[{"Create": create}],
+        )
+        _wait_for_index(model, index["index_name"])
+        created.append(index["index_name"])
+
+    return created
 
 
 def db_init() -> bool:
+    for model in _models():
+        if not model.exists():
+            model.create_table(
+                read_capacity_units=1, write_capacity_units=1, wait=True
+            )
+        else:
+            db_create_missing_indexes(model)
+
+    return all(model.exists() for model in _models())
+
+
+def db_backfill() -> Tuple[int, List[str]]:
+    """
+    Store the attributes derived on every write (the sortable `version_key`, the
+    `namespace` and `namespace_name`) on items written without them, e.g. by an
+    older deployment, which are otherwise invisible to the indexes built on them.
+
+    Versions that are not valid semantic versions have no key, they are
+    reported, so that they can be fixed or deleted, and only saved if they miss
+    another attribute.
+
+    The `version_key-index` is a local secondary index, and DynamoDB can only
+    create those along with the table. Tables created before it existed must be
+    migrated with `db backup`, `db destroy`, `db init` and `db restore`.
+
+    :return: The number of items updated, and the FQVMN of the invalid versions
+    """
     from chalicelib.models import ModuleModel
+    from chalicelib.versions import version_key
 
-    if not ModuleModel.exists():
-        ModuleModel.create_table(
-            read_capacity_units=1, write_capacity_units=1, wait=True
-        )
+    count = 0
+    invalid = []
+    condition = ModuleModel.version_key.does_not_exist() | (
+        ModuleModel.namespace_name.does_not_exist()
+    )
+    with ModuleModel.batch_write() as batch:
+        for module in ModuleModel.scan(condition):
+            if version_key(module.version) is None:
+                invalid.append(f"{module.module_name}/{module.version}")
+                if module.namespace_name is not None:
+                    continue
+            batch.save(module)
+            count += 1
+
+    return count, invalid
 
-    return ModuleModel.exists()
+
+def db_migrate() -> Tuple[List[str], int, List[str]]:
+    """
+    Migrate the tables created by an older deployment: create the missing global
+    secondary indexes, c.f. `db_create_missing_indexes`, backfill the attributes
+    they are built on, c.f. `db_backfill`, and rebuild the module summaries.
+
+    :return: The names of the created indexes, the number of items updated, and
+             the FQVMN of the invalid versions
+    """
+    from chalicelib.repository import get_repository
+    from chalicelib.stamps import touch_all
+
+    created = []
+    for model in _models():
+        created.extend(db_create_missing_indexes(model))
+    backfilled = db_backfill()
+    # The summaries written before they held the versions
+    get_repository().rebuild_summaries()
+    touch_all()
+    return (created, *backfilled)
+
+
+def chunks(items: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    """
+    Split an iterable in lists of at most size items
+
+    :param items: The items to split
+    :param size: The maximum size of each chunk
+    """
+    iterator = iter(items)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
+
+
+def db_batch_write(
+    model,
+    items: Iterable[SerializedItem],
+    max_attempts: int = 8,
+    base_delay: float = 0.05,
+    limiter=None,
+) -> int:
+    """
+    Put items with BatchWriteItem requests, 25 items at a time.
+
+    Unprocessed and throttled items are re-driven with exponential backoff and
+    full jitter, up to max_attempts times per chunk.
+
+    :param model: The model whose table the items are written to
+    :param items: The items, serialized with `Model.serialize()`
+    :param max_attempts: The maximum number of requests per chunk
+    :param base_delay: The backoff delay after the first attempt, in seconds
+    :param limiter: An optional `chalicelib.restore.AdaptiveRateLimiter`, which
+                    paces the requests and is told about throttling
+    :return: The number of items written
+    """
+    connection = model._get_connection()
+    table_name = model.Meta.table_name
+
+    written = 0
+    for pending in chunks(items, BATCH_WRITE_SIZE):
+        for attempt in range(max_attempts):
+            if limiter is not None:
+                limiter.acquire(len(pending))
+            try:
+                data = connection.batch_write_item(put_items=pending) or {}
+            except PutError as pe:
+                if pe.cause_response_code not in THROTTLING_ERRORS:
+                    raise
+                requests = [{"PutRequest": {"Item": item}} for item in pending]
+                data = {"UnprocessedItems": {table_name: requests}}
+
+            unprocessed = data.get("UnprocessedItems", {}).get(table_name, [])
+            written += len(pending) - len(unprocessed)
+            pending = [request["PutRequest"]["Item"] for request in unprocessed]
+            if limiter is not None and pending:
+                limiter.throttled()
+            elif limiter is not None:
+                limiter.succeeded()
+            if not pending:
+                break
+            sleep(base_delay * 2 ** attempt * random())
+        else:
+            raise PutError(
+                f"Failed to write {len(pending)} items after {max_attempts} attempts"
+            )
+
+    return written
 
 
 def db_destroy() -> bool:
-    from chalicelib.models import ModuleModel
+    for model in _models():
+        if model.exists():
+            model.delete_table()
+
+    return not any(model.exists() for model in _models())
 
-    if ModuleModel.exists():
-        ModuleModel.delete_table()
 
-    return not ModuleModel.exists()
+def backup_filename(filename: str, model) -> str:
+    """
+    Return the backup file of a model's table
 
+    The module table is backed up to filename itself, so that backups of earlier
+    versions, which only held the modules, can be restored the same way.
 
-def db_dump(filename):
+    :param filename: The backup file
+    :param model: The model of the table
+    """
     from chalicelib.models import ModuleModel
 
-    ModuleModel.dump(filename)
+    return filename if model is ModuleModel else f"{filename}.{model.__name__}"
 
 
-def db_load(filename):
-    from chalicelib.models import ModuleModel
+def db_dump(filename: str, segments: int = 4) -> Dict[str, Dict]:
+    """
+    Back up every table as gzip-compressed NDJSON, c.f. `chalicelib.backup.backup`
+
+    :param filename: The backup file, c.f. `backup_filename`
+    :param segments: The number of parallel scan segments
+    :return: The backup manifest of each model
+    """
+    from chalicelib.backup import backup
 
-    ModuleModel.load(filename)
+    return {
+        model.__name__: backup(
+            backup_filename(filename, model), segments=segments, model=model
+        )
+        for model in _models()
+    }
+
+
+def db_load(
+    filename: str, workers: int = 4, max_rate: float = None, resume: bool = True
+) -> Dict:
+    """
+    Restore the tables from a backup written by `db_dump`, or the modules from a
+    backup written by PynamoDB's `Model.dump` in earlier versions, c.f.
+    `chalicelib.restore.restore`
+
+    :param filename: The backup file, c.f. `backup_filename`
+    :param workers: The number of concurrent BatchWriteItem requests
+    :param max_rate: The maximum number of items written per second
+    :param resume: Resume from the checkpoint of an interrupted restore, if any
+    :return: The `RestoreReport` of each restored model
+    """
+    from chalicelib.repository import get_repository
+    from chalicelib.restore import restore
+    from chalicelib.stamps import touch_all
+
+    reports = {}
+    for model in _models():
+        model_filename = backup_filename(filename, model)
+        if model_filename != filename and not os.path.exists(model_filename):
+            continue
+        reports[model.__name__] = restore(
+            model_filename,
+            workers=workers,
+            max_rate=max_rate,
+            resume=resume,
+            model=model,
+        )
+    # The restored summaries may predate the restored versions
+    get_repository().rebuild_summaries(workers=workers)
+    # The restored modules may differ from what clients cached
+    touch_all()
+    return reports
@@ -0,0 +1,205 @@
+#  Copyright (c) 2020 Zero A.E., LLC
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import atexit
+import logging
+from collections import Counter
+from threading import Event, Lock, Thread
+from time import monotonic
+from typing import Callable, Optional, Set, Tuple
+
+from .config import (
+    ZTR_DOWNLOADS_FLUSH_SECONDS,
+    ZTR_DOWNLOADS_FLUSH_SIZE,
+    ZTR_DOWNLOADS_ROLLUP_SECONDS,
+)
+from .names import ModuleName
+from .repository import get_repository
+
+log = logging.getLogger(__name__)
+
+
+class DownloadCounter(object):
+    """
+    Write-behind download counters
+
+    Downloads are aggregated in memory, per module version, and flushed by a
+    background thread once `flush_size` module versions are pending or every
+    `flush_seconds`. Each flush adds to the count of every pending module version,
+    c.f. `ModuleRepository.add_downloads`, so recording a download never waits on
+    the backend.
+
+    The flushed module versions are rolled up, c.f. `rollup`, by the first flush
+    `rollup_seconds` after the previous roll-up, so the module versions and
+    summaries of popular modules are written once per roll-up, not per flush.
+
+    Pending counts are lost if the process is killed before they are flushed, and
+    flushed counts are then only rolled up after the next download.
+    """
+
+    def __init__(
+        self,
+        flush_size: int = ZTR_DOWNLOADS_FLUSH_SIZE,
+        flush_seconds: float = ZTR_DOWNLOADS_FLUSH_SECONDS,
+        rollup_seconds: float = ZTR_DOWNLOADS_ROLLUP_SECONDS,
+        clock: Callable[[], float] = monotonic,
+    ):
+        """
+        :param flush_size: Flush once this many module versions are pending
+        :param flush_seconds: Flush at least this often while downloads are recorded
+        :param rollup_seconds: The minimum number of seconds between two roll-ups
+        :param clock: Returns the current time in seconds
+        """
+        self.flush_size = flush_size
+        self.flush_seconds = flush_seconds
+        self.rollup_seconds = rollup_seconds
+        self._clock = clock
+        self._lock = Lock()
+        self._flush_lock = Lock()
+        self._pending: "Counter[Tuple[ModuleName, str]]" = Counter()
+        self._flushed: Set[Tuple[ModuleName, str]] = set()
+        self._flushed_at = clock()
+        self._rolled_up_at = clock()
+        self._flush_requested = Event()
+        self._worker: Optional[Thread] = None
+
+    @property
+    def pending(self) -> int:
+        """The number of downloads waiting to be flushed"""
+        with self._lock:
+            return sum(self._pending.values())
+
+    def record(self, module_name: ModuleName, version: str, count: int = 1) -> None:
+        """
+        Count downloads of a module version
+
+        :param module_name: The module name
+        :param version: The module version
+        :param count: The number of downloads
+        """
+        with self._lock:
+            self._pending[(module_name, version)] += count
+            due = (
+                len(self._pending) >= self.flush_size
+                or self._clock() - self._flushed_at >= self.flush_seconds
+            )
+        if due:
+            self._request_flush()
+
+    def _request_flush(self) -> None:
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = Thread(target=self._run, name=__name__, daemon=True)
+                self._worker.start()
+        self._flush_requested.set()
+
+    def _run(self) -> None:
+        while True:
+            self._flush_requested.wait(self.flush_seconds)
+            self._flush_requested.clear()
+            try:
+                self.flush()
+            except Exception:  # noqa, the worker must survive anything
+                log.exception("Failed to flush the download counters")
+
+    def flush(self) -> int:
+        """
+        Write the pending downloads to the backend
+
+        Increments that fail, for any reason, are put back and retried on the next
+        flush.
+
+        :return: The number of downloads written
+        """
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, Counter()
+                self._flushed_at = self._clock()
+
+            repository = get_repository()
+            flushed = 0
+            for (module_name, version), count in pending.items():
+                try:
+                    repository.add_downloads(module_name, version, count)
+                    flushed += count
+                    self._flushed.add((module_name, version))
+                except Exception:  # noqa, e.g. botocore's EndpointConnectionError
+                    log.exception(
+                        "Failed to flush %s downloads of %s/%s",
+                        count,
+                        module_name,
+                        version,
+                    )
+                    with self._lock:
+                        self._pending[(module_name, version)] += count
+
+            if self._clock() - self._rolled_up_at >= self.rollup_seconds:
+                self._rollup()
+            return flushed
+
+    def rollup(self) -> int:
+        """
+        Store the counts of the flushed module versions on their records and
+        summaries now, c.f. `ModuleRepository.rollup_downloads`
+
+        :return: The number of module versions rolled up
+        """
+        with self._flush_lock:
+            return self._rollup()
+
+    def _rollup(self) -> int:
+        from .stamps import stamps
+
+        flushed, self._flushed = self._flushed, set()
+        self._rolled_up_at = self._clock()
+        try:
+            rolled_up = get_repository().rollup_downloads(flushed)
+        except Exception:  # noqa, e.g. botocore's EndpointConnectionError
+            log.exception("Failed to roll up %d module versions", len(flushed))
+            self._flushed |= flushed
+            return 0
+        # The roll-up gave the modules new stamps
+        for module_name in {module_name for module_name, _ in flushed}:
+            stamps.invalidate(module_name)
+        return rolled_up
+
+    def count(self, module_name: ModuleName, version: str) -> int:
+        """
+        Return the flushed download count of a module version
+
+        :param module_name: The module name
+        :param version: The module version
+        """
+        return get_repository().downloads(module_name, version)
+
+
+_counter: Optional[DownloadCounter] = None
+_counter_lock = Lock()
+
+
+def get_counter() -> DownloadCounter:
+    """
+    Return the download counter of the process, created on first use
+
+    Its pending downloads are flushed, and rolled up, when the process exits.
+    """
+    global _counter
+    if _counter is None:
+        with _counter_lock:
+            if _counter is None:
+                _counter = DownloadCounter()
+                # Run last in, first out: flushed, then rolled up
+                atexit.register(_counter.rollup)
+                atexit.register(_counter.flush)
+    return _counter
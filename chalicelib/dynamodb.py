@@ -0,0 +1,417 @@
+#  Copyright (c) 2020 Zero A.E., LLC
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import logging
+from datetime import datetime, timezone
+from random import randrange
+from typing import Iterable, Iterator, List, Optional, Tuple
+from uuid import uuid4
+
+from pynamodb.exceptions import (
+    DoesNotExist,
+    PutError,
+    TransactWriteError,
+    UpdateError,
+)
+from pynamodb.transactions import TransactWrite
+
+from .config import ZTR_DOWNLOADS_SHARDS, ZTR_LIMIT
+from .metrics import instrument_pynamodb
+from .models import (
+    UPDATED_DAY_FORMAT,
+    CatalogModel,
+    DownloadCounterModel,
+    ModuleModel,
+    ModuleName,
+    ModuleSummaryModel,
+)
+from .repository import ModuleRepository
+from .versions import version_order
+
+log = logging.getLogger(__name__)
+
+# The attributes of the versions a module summary is derived from
+_SUMMARY_SOURCE = ["module_name", "version", "downloads", "published_at"]
+
+# The times a write is tried, while concurrent writes of the module change its summary
+SUMMARY_ATTEMPTS = 10
+
+
+def latest_versions(versions: Iterable[ModuleModel]) -> Iterator[ModuleModel]:
+    """
+    Yield the latest version of each module
+
+    Versions that are not valid semantic versions come before all the others,
+    c.f. `version_order`.
+
+    :param versions: The versions of the modules, grouped by module
+    """
+    latest = None
+    for module in versions:
+        if latest is not None and module.module_name != latest.module_name:
+            yield latest
+            latest = None
+        if latest is None or version_order(module.version) > version_order(
+            latest.version
+        ):
+            latest = module
+    if latest is not None:
+        yield latest
+
+
+def counter_id(module_name: ModuleName, version: str, shard: int) -> str:
+    """
+    Return the hash key of one shard of a module version's download counter
+
+    :param module_name: The module name
+    :param version: The module version
+    :param shard: The shard number
+    """
+    return f"{module_name}/{version}#{shard}"
+
+
+class DynamoDBRepository(ModuleRepository):
+    """
+    The module versions in DynamoDB, c.f. `chalicelib.models`
+
+    Searches are served by the in-memory `chalicelib.search.index`. Download
+    counts are split into `shards` counter items, so the writes of popular modules
+    are spread over many items. The sums of the shards are only stored on the
+    module versions and their summaries by `rollup_downloads`, which the download
+    counter calls on its own, slower schedule, c.f. `chalicelib.downloads`.
+
+    Each write of a module version updates the module's summary in the same
+    transaction, c.f. `_write`.
+    """
+
+    def __init__(self, shards: int = ZTR_DOWNLOADS_SHARDS):
+        """
+        :param shards: The number of download counter items per module version
+        """
+        self.shards = shards
+        instrument_pynamodb()
+
+    # The hash key of the catalog generation item
+    _CATALOG = "catalog"
+
+    def init(self) -> None:
+        from .db import db_init
+
+        db_init()
+
+    def destroy(self) -> None:
+        from .db import db_destroy
+
+        db_destroy()
+
+    def get(
+        self, module_name: ModuleName, version: str, attributes: List[str] = None
+    ) -> Optional[ModuleModel]:
+        try:
+            # noinspection PyTypeChecker
+            return ModuleModel.get(
+                module_name, range_key=version, attributes_to_get=attributes
+            )
+        except DoesNotExist:
+            return None
+
+    def get_many(
+        self, keys: Iterable[Tuple[ModuleName, str]], attributes: List[str] = None
+    ) -> Iterator[ModuleModel]:
+        from .db import BATCH_GET_SIZE, chunks
+
+        if attributes is not None:
+            attributes = sorted({"module_name", "version", *attributes})
+        # BatchGetItem rejects duplicate keys
+        for batch in chunks(dict.fromkeys(keys), BATCH_GET_SIZE):
+            # noinspection PyTypeChecker
+            yield from ModuleModel.batch_get(batch, attributes_to_get=attributes)
+
+    def module_versions(
+        self, module_name: ModuleName, attributes: List[str] = None
+    ) -> List[ModuleModel]:
+        if attributes is not None:
+            attributes = sorted({"module_name", "version", "version_key", *attributes})
+        # One query of the table's partition, the version index leaves out the
+        # versions that are not semantic versions
+        # noinspection PyTypeChecker
+        versions = ModuleModel.query(module_name, attributes_to_get=attributes)
+        return sorted(versions, key=lambda m: (m.version_key or "", m.version))
+
+    def latest(
+        self, module_name: ModuleName, attributes: List[str] = None
+    ) -> Optional[ModuleModel]:
+        return ModuleModel.latest(module_name, attributes_to_get=attributes)
+
+    def versions(self, module_name: ModuleName) -> Iterator[str]:
+        last_evaluated_key = None
+        while True:
+            # noinspection PyTypeChecker
+            page = ModuleModel.version_index.query(
+                module_name,
+                attributes_to_get=["version"],
+                limit=ZTR_LIMIT,
+                last_evaluated_key=last_evaluated_key,
+            )
+            for module in page:
+                yield module.version
+
+            last_evaluated_key = page.last_evaluated_key
+            if last_evaluated_key is None:
+                return
+
+    def list_latest(
+        self,
+        namespace: str,
+        name: Optional[str] = None,
+        after: Optional[ModuleName] = None,
+        page_size: int = ZTR_LIMIT,
+    ) -> Iterator[ModuleModel]:
+        if name is None:
+            index, hash_key = ModuleModel.namespace_index, namespace
+        else:
+            index, hash_key = ModuleModel.namespace_name_index, f"{namespace}/{name}"
+        range_key_condition = None
+        if after is not None:
+            range_key_condition = ModuleModel.module_name > after
+        versions = index.query(
+            hash_key, range_key_condition=range_key_condition, page_size=page_size
+        )
+        return latest_versions(versions)
+
+    def search(self, q: str, **kwargs) -> Tuple[List[ModuleModel], int]:
+        from .search import index
+
+        index.ensure_fresh()
+        return index.search(q, **kwargs)
+
+    def scan(self, attributes: List[str] = None) -> Iterator[ModuleModel]:
+        return iter(ModuleModel.scan(attributes_to_get=attributes))
+
+    def save(self, module: ModuleModel) -> None:
+        self._write(module.module_name, put=module)
+
+    def save_many(self, modules: Iterable[ModuleModel]) -> int:
+        from .db import db_batch_write
+
+        module_names = set()
+
+        def serialize(module: ModuleModel):
+            module_names.add(module.module_name)
+            return module.serialize()
+
+        # BatchWriteItem is not transactional, the summaries are refreshed after it
+        saved = db_batch_write(ModuleModel, map(serialize, modules))
+        self.refresh_summaries(module_names)
+        return saved
+
+    def delete(self, module_name: ModuleName, version: str) -> bool:
+        return self._write(module_name, delete=version)
+
+    def _write(
+        self,
+        module_name: ModuleName,
+        put: Optional[ModuleModel] = None,
+        delete: Optional[str] = None,
+    ) -> bool:
+        """
+        Write a version of a module and the module's summary, in one transaction
+
+        The summary is derived from a consistent read of the module's versions, and
+        written on condition that its stamp did not change since. A write that
+        races another write of the module is tried again, with the versions the
+        other write left.
+
+        :param module_name: The module name
+        :param put: The module version to create or replace, if any
+        :param delete: The version to delete, if any
+        :return: False if the version to delete did not exist
+        """
+        version = put.version if put is not None else delete
+        for attempt in range(1, SUMMARY_ATTEMPTS + 1):
+            current = self._summary(module_name, consistent_read=True)
+            # noinspection PyTypeChecker
+            modules = [
+                module
+                for module in ModuleModel.query(
+                    module_name, consistent_read=True, attributes_to_get=_SUMMARY_SOURCE
+                )
+                if module.version != version
+            ]
+            if put is not None:
+                modules.append(put)
+            summary = ModuleSummaryModel.summarize(module_name, modules, uuid4().hex)
+            if current is None:
+                unchanged = ModuleSummaryModel.module_name.does_not_exist()
+            else:
+                unchanged = ModuleSummaryModel.stamp == current.stamp
+
+            connection = ModuleModel._get_connection().connection
+            try:
+                with TransactWrite(connection=connection) as transaction:
+                    if put is not None:
+                        transaction.save(put)
+                    elif delete is not None:
+                        # noinspection PyTypeChecker
+                        transaction.delete(
+                            ModuleModel(module_name, delete),
+                            condition=ModuleModel.module_name.exists(),
+                        )
+                    transaction.save(summary, condition=unchanged)
+                return True
+            except TransactWriteError as twe:
+                failed = [
+                    r is not None and r.code == "ConditionalCheckFailed"
+                    for r in twe.cancellation_reasons or [None]
+                ]
+                if delete is not None and failed[0]:
+                    return False
+                if not failed[-1] or attempt == SUMMARY_ATTEMPTS:
+                    raise
+                log.debug("The summary of %s changed, attempt %d", module_name, attempt)
+        return False  # pragma: no cover, the last attempt returns or raises
+
+    def add_downloads(self, module_name: ModuleName, version: str, count: int) -> None:
+        shard = counter_id(module_name, version, randrange(self.shards))
+        DownloadCounterModel(shard).update(
+            actions=[DownloadCounterModel.downloads.add(count)]
+        )
+
+    def rollup_downloads(self, keys: Iterable[Tuple[ModuleName, str]]) -> int:
+        rolled_up = 0
+        module_names = set()
+        for module_name, version in set(keys):
+            if self._rollup(module_name, version):
+                module_names.add(module_name)
+                rolled_up += 1
+        for module_name in module_names:
+            self._rollup_summary(module_name)
+        return rolled_up
+
+    def _rollup(self, module_name: ModuleName, version: str) -> bool:
+        """
+        Store the download count of a module version on its record
+
+        The count is set, not added, so concurrent roll-ups converge. Deleted
+        module versions are not re-created. The version is written to the
+        `updated_day-index` again, so the search index refreshes its count.
+
+        :return: False if the module version does not exist
+        """
+        downloads = self.downloads(module_name, version)
+        updated_at = datetime.now(timezone.utc)
+        try:
+            # noinspection PyTypeChecker
+            ModuleModel(module_name, version).update(
+                actions=[
+                    ModuleModel.downloads.set(downloads),
+                    ModuleModel.updated_at.set(updated_at),
+                    ModuleModel.updated_day.set(
+                        updated_at.strftime(UPDATED_DAY_FORMAT)
+                    ),
+                ],
+                condition=ModuleModel.module_name.exists(),
+            )
+            return True
+        except UpdateError as ue:
+            if ue.cause_response_code != "ConditionalCheckFailedException":
+                raise
+            return False
+
+    def _rollup_summary(self, module_name: ModuleName) -> None:
+        """
+        Store the total download count of a module on its summary, with a new
+        change stamp
+
+        The total is derived from the versions' counts, which are rolled up
+        before, and is set, not added, so concurrent roll-ups converge.
+        """
+        versions = ModuleModel.query(module_name, attributes_to_get=["downloads"])
+        downloads = sum(module.downloads or 0 for module in versions)
+        try:
+            # noinspection PyTypeChecker
+            ModuleSummaryModel(module_name).update(
+                actions=[
+                    ModuleSummaryModel.downloads.set(downloads),
+                    ModuleSummaryModel.stamp.set(uuid4().hex),
+                ],
+                condition=ModuleSummaryModel.module_name.exists(),
+            )
+        except UpdateError as ue:
+            if ue.cause_response_code != "ConditionalCheckFailedException":
+                raise
+
+    def downloads(self, module_name: ModuleName, version: str) -> int:
+        shards = [counter_id(module_name, version, i) for i in range(self.shards)]
+        return sum(c.downloads for c in DownloadCounterModel.batch_get(shards))
+
+    def stamp(self, module_name: ModuleName) -> Optional[str]:
+        try:
+            # noinspection PyTypeChecker
+            summary = ModuleSummaryModel.get(module_name, attributes_to_get=["stamp"])
+            return summary.stamp
+        except DoesNotExist:
+            return None
+
+    def set_stamps(self, stamps: Iterable[Tuple[ModuleName, str]]) -> None:
+        # Updates, not puts, which would drop the rest of the summaries
+        for module_name, stamp in stamps:
+            # noinspection PyTypeChecker
+            ModuleSummaryModel(module_name).update(
+                actions=[ModuleSummaryModel.stamp.set(stamp)]
+            )
+
+    def summary(self, module_name: ModuleName) -> Optional[ModuleSummaryModel]:
+        return self._summary(module_name)
+
+    def _summary(
+        self, module_name: ModuleName, consistent_read: bool = False
+    ) -> Optional[ModuleSummaryModel]:
+        try:
+            # noinspection PyTypeChecker
+            return ModuleSummaryModel.get(module_name, consistent_read=consistent_read)
+        except DoesNotExist:
+            return None
+
+    def summary_names(self) -> Iterator[ModuleName]:
+        scan = ModuleSummaryModel.scan(attributes_to_get=["module_name"])
+        return (summary.module_name for summary in scan)
+
+    def refresh_summaries(self, module_names: Iterable[ModuleName]) -> None:
+        for module_name in module_names:
+            self._write(module_name)
+
+    def catalog_generation(self) -> Optional[str]:
+        try:
+            # noinspection PyTypeChecker
+            return CatalogModel.get(self._CATALOG, consistent_read=True).generation
+        except DoesNotExist:
+            return None
+
+    def set_catalog_generation(
+        self, generation: str, replacing: Optional[str] = None
+    ) -> bool:
+        if replacing is not None:
+            condition = CatalogModel.generation == replacing
+        else:
+            condition = CatalogModel.generation.does_not_exist() | (
+                CatalogModel.generation < generation
+            )
+        try:
+            CatalogModel(self._CATALOG, generation=generation).save(condition=condition)
+            return True
+        except PutError as pe:
+            if pe.cause_response_code != "ConditionalCheckFailedException":
+                raise
+            return False
@@ -0,0 +1,268 @@
+#  Copyright (c) 2020 Zero A.E., LLC
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from http import HTTPStatus
+from threading import Lock
+from time import monotonic
+from typing import Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urljoin
+
+import requests
+from dateutil.parser import isoparse
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .models import ModuleModel, ModuleName
+from .repository import get_repository
+from .stamps import touch
+
+# (registry, namespace, name, provider, version)
+ImportRequest = Tuple[str, str, str, str, str]
+
+
+class ImportFailed(Exception):
+    """
+    A module version could not be imported, `code` is the `record import` exit status
+    """
+
+    code = 1
+
+
+class ModuleNotFound(ImportFailed):
+    code = 1
+
+
+class GetterUrlNotFound(ImportFailed):
+    code = 2
+
+
+def registry_url(registry: str) -> str:
+    """
+    Return the base URL of a registry domain, or the registry itself if it is a URL
+
+    :param registry: The registry domain (e.g. registry.terraform.io), or URL
+    """
+    return registry if "://" in registry else f"https://{registry}"
+
+
+def new_session(pool_size: int = 10) -> requests.Session:
+    """
+    Return an HTTP session with a connection pool of pool_size connections
+    per host, which retries transient upstream errors.
+
+    :param pool_size: The number of pooled connections per host
+    """
+    retry = Retry(
+        total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504]
+    )
+    adapter = HTTPAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry
+    )
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class RegistryClient(object):
+    """
+    A client of the modules.v1 API of a Terraform registry
+
+    The service discovery is resolved once, on first use.
+    """
+
+    def __init__(self, registry: str, session: Optional[requests.Session] = None):
+        """
+        :param registry: The registry domain, or URL
+        :param session: The HTTP session to use, a new one by default
+        """
+        self.registry = registry
+        self.session = session or new_session()
+        self._lock = Lock()
+        self._modules_url: Optional[str] = None
+
+    @property
+    def modules_url(self) -> str:
+        """The modules.v1 base URL of the registry"""
+        with self._lock:
+            if self._modules_url is None:
+                url = f"{registry_url(self.registry)}/.well-known/terraform.json"
+                r = self.session.get(url)
+                r.raise_for_status()
+                self._modules_url = urljoin(url, r.json()["modules.v1"])
+            return self._modules_url
+
+    def fetch(self, module_name: ModuleName, version: str) -> ModuleModel:
+        """
+        Fetch a module version's metadata and getter URL
+
+        :param module_name: The module name
+        :param version: The module version
+        :return: The (unsaved) module version record
+        """
+        url = f"{self.modules_url}{module_name}/{version}"
+
+        metadata_r = self.session.get(url)
+        if metadata_r.status_code != HTTPStatus.OK:
+            raise ModuleNotFound(
+                f"{module_name}/{version} was not found in {self.registry}"
+            )
+        metadata = metadata_r.json()
+
+        getter_url_r = self.session.get(f"{url}/download")
+        if (
+            getter_url_r.status_code != HTTPStatus.NO_CONTENT
+            or "X-Terraform-Get" not in getter_url_r.headers
+        ):
+            raise GetterUrlNotFound(
+                f"{module_name}/{version} go-getter-url was not found..."
+            )
+
+        return ModuleModel(
+            module_name,
+            version,
+            getter_url=getter_url_r.headers["X-Terraform-Get"],
+            verified=metadata.get("verified"),
+            owner=metadata.get("owner"),
+            description=metadata.get("description"),
+            source=metadata.get("source"),
+            published_at=isoparse(metadata["published_at"]),
+        )
+
+
+def parse_manifest(lines: Iterable[str], registry: str) -> List[ImportRequest]:
+    """
+    Parse a manifest of module versions to import, one per line.
+
+    Each line is either `<namespace>/<name>/<provider>/<version>`, imported from the
+    default registry, or `<registry>/<namespace>/<name>/<provider>/<version>`.
+    Blank lines and lines starting with `#` are ignored.
+
+    :param lines: The manifest lines
+    :param registry: The default registry
+    """
+    manifest = []
+    for number, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        parts = line.rsplit("/", 4)
+        if len(parts) == 4:
+            parts.insert(0, registry)
+        if len(parts) != 5 or not all(parts):
+            raise ValueError(f"line {number}: {line!r} is not a FQVMN")
+        manifest.append(tuple(parts))
+    return manifest
+
+
+@dataclass
+class ImportReport(object):
+    """
+    The outcome of a bulk import
+    """
+
+    requested: int = 0
+    imported: int = 0
+    elapsed: float = 0.0
+    failures: Dict[str, str] = field(default_factory=dict)
+
+    @property
+    def rate(self) -> float:
+        """The number of module versions imported per second"""
+        return self.imported / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self) -> str:
+        return (
+            f"Imported {self.imported} of {self.requested} module versions "
+            f"in {self.elapsed:.2f}s ({self.rate:.1f}/s)"
+        )
+
+
+class BulkImporter(object):
+    """
+    Import module versions from upstream registries, concurrently
+
+    The upstream metadata is fetched by a bounded thread pool sharing one pooled
+    HTTP session, and the records are written in batches, c.f.
+    `ModuleRepository.save_many`.
+    """
+
+    def __init__(self, workers: int = 10, session: Optional[requests.Session] = None):
+        """
+        :param workers: The number of concurrent upstream fetches
+        :param session: The HTTP session to use, a new pool of `workers` by default
+        """
+        self.workers = workers
+        self.session = session or new_session(pool_size=workers)
+        self._clients: Dict[str, RegistryClient] = {}
+
+    def client(self, registry: str) -> RegistryClient:
+        """
+        Return the (shared) client of a registry
+
+        :param registry: The registry domain, or URL
+        """
+        if registry not in self._clients:
+            self._clients[registry] = RegistryClient(registry, self.session)
+        return self._clients[registry]
+
+    def run(self, manifest: List[ImportRequest]) -> ImportReport:
+        """
+        Import every module version of the manifest
+
+        A module version listed more than once (e.g. from two registries) is only
+        imported from its first entry, the others are reported as failures.
+
+        :param manifest: The module versions to import, c.f. `parse_manifest`
+        """
+        report = ImportReport(requested=len(manifest))
+        started = monotonic()
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {}
+            first_entries: Dict[Tuple[ModuleName, str], str] = {}
+            for number, request in enumerate(manifest, start=1):
+                registry, namespace, name, provider, version = request
+                module_name = ModuleName(namespace, name, provider)
+                entry = f"{registry}/{module_name}/{version}"
+                # One batch must not put the same item twice
+                if (module_name, version) in first_entries:
+                    first_entry = first_entries[(module_name, version)]
+                    report.failures[f"{entry} (entry {number})"] = (
+                        f"duplicate of {first_entry}"
+                    )
+                    continue
+                first_entries[(module_name, version)] = entry
+                client = self.client(registry)
+                future = executor.submit(client.fetch, module_name, version)
+                futures[future] = entry
+
+            module_names = set()
+
+            def fetched():
+                for future in as_completed(futures):
+                    try:
+                        module = future.result()
+                        yield module
+                        module_names.add(module.module_name)
+                    except Exception as e:  # noqa, e.g. a malformed upstream response
+                        report.failures[futures[future]] = f"{type(e).__name__}: {e}"
+
+            report.imported = get_repository().save_many(fetched())
+            touch(module_names)
+
+        report.elapsed = monotonic() - started
+        return report
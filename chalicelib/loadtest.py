@@ -0,0 +1,406 @@
+#  Copyright (c) 2020 Zero A.E., LLC
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import json
+from dataclasses import dataclass, field
+from http.client import HTTPConnection, HTTPException, HTTPSConnection
+from itertools import accumulate
+from random import Random
+from threading import Thread, local
+from time import monotonic
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urljoin, urlsplit
+
+# A request: its method and path, to its status, lowercase headers and body
+Transport = Callable[[str, str], Tuple[int, Dict[str, str], bytes]]
+
+# The routes of a `terraform init` of one module, in order
+ROUTES = ("discovery", "list_versions", "download_latest", "download")
+
+# The statuses of a throttled request, by API Gateway, the WSGI server or the app
+THROTTLED = (429, 503)
+
+DISCOVERY_PATH = "/.well-known/terraform.json"
+
+
+class HTTPTransport(object):
+    """
+    Requests over one keep-alive connection per thread, like a Terraform client
+    """
+
+    def __init__(self, base_url: str, timeout: float = 10):
+        """
+        :param base_url: The URL of the registry, e.g. http://localhost:8000
+        :param timeout: The number of seconds a request may take
+        """
+        url = urlsplit(base_url)
+        self.https = url.scheme == "https"
+        self.netloc = url.netloc
+        self.timeout = timeout
+        self._local = local()
+
+    def __call__(self, method: str, path: str) -> Tuple[int, Dict[str, str], bytes]:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection_class = HTTPSConnection if self.https else HTTPConnection
+            connection = connection_class(self.netloc, timeout=self.timeout)
+            self._local.connection = connection
+        try:
+            connection.request(method, path, headers={"User-Agent": "ztr-bench-load"})
+            response = connection.getresponse()
+            body = response.read()
+        except (OSError, HTTPException):
+            connection.close()
+            self._local.connection = None
+            raise
+        return response.status, {k.lower(): v for k, v in response.getheaders()}, body
+
+
+def popularity(count: int, distribution: str = "zipf", exponent: float = 1.1):
+    """
+    Return the cumulative weights of modules, from the most to the least popular
+
+    :param count: The number of modules
+    :param distribution: `zipf`, the k-th most popular module is requested
+        1/k^exponent times as often as the most popular one, or `uniform`
+    :param exponent: The exponent of the zipf distribution
+    :raises ValueError: If the distribution is unknown
+    """
+    if distribution == "zipf":
+        weights = (1 / (rank ** exponent) for rank in range(1, count + 1))
+    elif distribution == "uniform":
+        weights = (1.0 for _ in range(count))
+    else:
+        raise ValueError(f"Unknown popularity distribution {distribution!r}")
+    return list(accumulate(weights))
+
+
+@dataclass
+class RouteStats(object):
+    """
+    The requests of one route, and the seconds each took
+    """
+
+    requests: int = 0
+    errors: int = 0
+    throttled: int = 0
+    latencies: List[float] = field(default_factory=list)
+
+    def merge(self, other: "RouteStats") -> None:
+        self.requests += other.requests
+        self.errors += other.errors
+        self.throttled += other.throttled
+        self.latencies.extend(other.latencies)
+
+    def percentile(self, p: float) -> Optional[float]:
+        """
+        Return the p-th percentile latency, in seconds, by the nearest-rank method
+
+        :param p: The percentile, in ]0, 100]
+        """
+        if not self.latencies:
+            return None
+        latencies = sorted(self.latencies)
+        rank = max(1, -(-len(latencies) * p // 100))
+        return latencies[int(rank) - 1]
+
+
+@dataclass
+class LoadReport(object):
+    """
+    The outcome of a load test
+    """
+
+    duration: float = 0.0
+    concurrency: int = 0
+    flows: int = 0
+    failed_flows: int = 0
+    routes: Dict[str, RouteStats] = field(
+        default_factory=lambda: {route: RouteStats() for route in ROUTES}
+    )
+
+    @property
+    def requests(self) -> int:
+        return sum(stats.requests for stats in self.routes.values())
+
+    @property
+    def throughput(self) -> float:
+        """The requests per second"""
+        return self.requests / self.duration if self.duration else 0.0
+
+    def merge(self, other: "LoadReport") -> None:
+        self.flows += other.flows
+        self.failed_flows += other.failed_flows
+        for route, stats in other.routes.items():
+            self.routes[route].merge(stats)
+
+    def to_json(self) -> Dict:
+        """Return the report as JSON, with the latencies in milliseconds"""
+
+        def ms(seconds: Optional[float]) -> Optional[float]:
+            return round(seconds * 1_000, 3) if seconds is not None else None
+
+        return {
+            "duration": round(self.duration, 3),
+            "concurrency": self.concurrency,
+            "flows": self.flows,
+            "failed_flows": self.failed_flows,
+            "requests": self.requests,
+            "throughput": round(self.throughput, 3),
+            "routes": {
+                route: {
+                    "requests": stats.requests,
+                    "errors": stats.errors,
+                    "throttled": stats.throttled,
+                    "p50_ms": ms(stats.percentile(50)),
+                    "p95_ms": ms(stats.percentile(95)),
+                    "p99_ms": ms(stats.percentile(99)),
+                    "max_ms": ms(max(stats.latencies, default=None)),
+                }
+                for route, stats in self.routes.items()
+            },
+        }
+
+    def __str__(self) -> str:
+        lines = [
+            f"{self.flows} terraform init flows ({self.failed_flows} failed), "
+            f"{self.requests} requests in {self.duration:.1f}s with "
+            f"{self.concurrency} clients: {self.throughput:.1f} requests/s",
+            f"{'route':<16} {'requests':>9} {'p50 ms':>9} {'p95 ms':>9} "
+            f"{'p99 ms':>9} {'errors':>7} {'throttled':>9}",
+        ]
+        for route, stats in self.to_json()["routes"].items():
+            requests = stats["requests"] or 1
+
+            def ms(value: Optional[float]) -> str:
+                return f"{value:9.1f}" if value is not None else f"{'-':>9}"
+
+            lines.append(
+                f"{route:<16} {stats['requests']:>9} {ms(stats['p50_ms'])} "
+                f"{ms(stats['p95_ms'])} {ms(stats['p99_ms'])} "
+                f"{stats['errors'] / requests:>7.1%} "
+                f"{stats['throttled'] / requests:>9.1%}"
+            )
+        return "\n".join(lines)
+
+
+class FlowFailed(Exception):
+    """A request of a flow failed, the rest of the flow is skipped"""
+
+
+def _get_json(transport: Transport, path: str):
+    """
+    Read a JSON document
+
+    :raises FlowFailed: If the document cannot be read
+    """
+    try:
+        status, _, body = transport("GET", path)
+        if status != 200:
+            raise FlowFailed(f"GET {path}: {status}")
+        return json.loads(body)
+    except (OSError, HTTPException, ValueError) as e:
+        raise FlowFailed(f"GET {path}: {e!r}")
+
+
+def discover(transport: Transport, prefix: str = "") -> str:
+    """
+    Return the path of the modules API, from the service discovery document
+
+    :param transport: Makes the requests
+    :param prefix: The path of the registry, e.g. the API Gateway stage
+    :raises FlowFailed: If the discovery document cannot be read
+    """
+    discovery = _get_json(transport, prefix + DISCOVERY_PATH)
+    try:
+        return urljoin(prefix + DISCOVERY_PATH, discovery["modules.v1"])
+    except (LookupError, TypeError):
+        raise FlowFailed(f"{prefix + DISCOVERY_PATH} has no modules.v1 service")
+
+
+def list_modules(
+    transport: Transport, prefix: str = "", limit: Optional[int] = None
+) -> List[str]:
+    """
+    Return the modules of a registry, as listed by its list route
+
+    :param transport: Makes the requests
+    :param prefix: The path of the registry, e.g. the API Gateway stage
+    :param limit: The maximum number of modules, all of them by default
+    :raises FlowFailed: If the modules cannot be listed
+    """
+    modules_path = discover(transport, prefix)
+    modules: List[str] = []
+    query = {"limit": "100"}
+    while limit is None or len(modules) < limit:
+        path = f"{modules_path}?{urlencode(query)}"
+        page = _get_json(transport, path)
+        try:
+            modules.extend(
+                f"{m['namespace']}/{m['name']}/{m['provider']}"
+                for m in page["modules"]
+            )
+            next_url = page["meta"].get("next_url")
+        except (LookupError, TypeError, AttributeError):
+            raise FlowFailed(f"GET {path}: not a module list")
+        if not next_url:
+            break
+        # Relative to the modules API, whatever the prefix
+        query = dict(parse_qsl(urlsplit(next_url).query))
+    return modules[:limit]
+
+
+class LoadGenerator(object):
+    """
+    Replay the requests of concurrent `terraform init` runs, for a duration
+
+    Each flow installs one module, picked by popularity: it reads the discovery
+    document, lists the module's versions, and downloads either the latest version
+    through the `download` redirect, or one of the newest versions directly.
+    """
+
+    def __init__(
+        self,
+        transport: Transport,
+        modules: List[str],
+        prefix: str = "",
+        concurrency: int = 16,
+        duration: float = 60,
+        distribution: str = "zipf",
+        exponent: float = 1.1,
+        latest_share: float = 0.2,
+        seed: int = 0,
+        clock: Callable[[], float] = monotonic,
+    ):
+        """
+        :param transport: Makes the requests, e.g. an `HTTPTransport`
+        :param modules: The modules, as <namespace>/<name>/<provider>
+        :param prefix: The path of the registry, e.g. the API Gateway stage
+        :param concurrency: The number of concurrent clients
+        :param duration: The number of seconds new flows are started for
+        :param distribution: The popularity of the modules, c.f. `popularity`
+        :param exponent: The exponent of the zipf popularity
+        :param latest_share: The share of the flows downloading the latest version
+            through the redirect
+        :param seed: Seeds the popularity ranking and the choices of the clients
+        :param clock: Returns the current time in seconds
+        """
+        if not modules:
+            raise ValueError("There are no modules to request")
+        self.transport = transport
+        self.prefix = prefix
+        self.concurrency = concurrency
+        self.duration = duration
+        self.latest_share = latest_share
+        self.seed = seed
+        self._clock = clock
+        # The most popular modules are not simply the first ones listed
+        self.modules = sorted(modules)
+        Random(seed).shuffle(self.modules)
+        self._weights = popularity(len(self.modules), distribution, exponent)
+
+    def _request(
+        self, report: LoadReport, route: str, path: str, expected: int
+    ) -> Tuple[Dict[str, str], bytes]:
+        stats = report.routes[route]
+        stats.requests += 1
+        start = self._clock()
+        try:
+            status, headers, body = self.transport("GET", path)
+        except (OSError, HTTPException) as e:
+            stats.errors += 1
+            raise FlowFailed(f"GET {path}: {e}")
+        stats.latencies.append(self._clock() - start)
+        if status != expected:
+            if status in THROTTLED:
+                stats.throttled += 1
+            else:
+                stats.errors += 1
+            raise FlowFailed(f"GET {path}: {status}")
+        return headers, body
+
+    @staticmethod
+    def _read(report: LoadReport, route: str, body: bytes, read: Callable):
+        """Read a response body, a response Terraform cannot read is an error"""
+        try:
+            return read(json.loads(body))
+        except (ValueError, LookupError, TypeError) as e:
+            report.routes[route].errors += 1
+            raise FlowFailed(f"Invalid {route} response: {e!r}")
+
+    def flow(self, rng: Random, report: LoadReport) -> None:
+        """
+        Make the requests of one `terraform init`, c.f. `LoadGenerator`
+
+        :param rng: The random number generator of the client
+        :param report: The report of the client
+        :raises FlowFailed: If a request failed
+        """
+        module = rng.choices(self.modules, cum_weights=self._weights)[0]
+        # As Terraform resolves the modules.v1 path, relative to the discovery URL
+        discovery = self.prefix + DISCOVERY_PATH
+        _, body = self._request(report, "discovery", discovery, 200)
+        modules_path = self._read(
+            report, "discovery", body, lambda d: urljoin(discovery, d["modules.v1"])
+        )
+
+        path = f"{modules_path}{module}/versions"
+        _, body = self._request(report, "list_versions", path, 200)
+        versions = self._read(
+            report,
+            "list_versions",
+            body,
+            lambda d: [v["version"] for v in d["modules"][0]["versions"]][-3:],
+        )
+        if not versions:
+            report.routes["list_versions"].errors += 1
+            raise FlowFailed(f"{module} has no versions")
+
+        if rng.random() < self.latest_share:
+            path = f"{modules_path}{module}/download"
+            headers, _ = self._request(report, "download_latest", path, 302)
+            path = urljoin(path, headers["location"])
+        else:
+            path = f"{modules_path}{module}/{rng.choice(versions)}/download"
+        self._request(report, "download", path, 204)
+
+    def _client(self, number: int, deadline: float, report: LoadReport) -> None:
+        rng = Random(f"{self.seed}/{number}")
+        while self._clock() < deadline:
+            try:
+                self.flow(rng, report)
+                report.flows += 1
+            except FlowFailed:
+                report.failed_flows += 1
+
+    def run(self) -> LoadReport:
+        """Run the clients for the duration, and return their merged report"""
+        start = self._clock()
+        deadline = start + self.duration
+        reports = [LoadReport() for _ in range(self.concurrency)]
+        clients = [
+            Thread(target=self._client, args=(i, deadline, reports[i]), daemon=True)
+            for i in range(self.concurrency)
+        ]
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+
+        report = LoadReport(
+            duration=self._clock() - start, concurrency=self.concurrency
+        )
+        for client_report in reports:
+            report.merge(client_report)
+        return report
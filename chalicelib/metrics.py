@@ -0,0 +1,365 @@
+#  Copyright (c) 2020 Zero A.E., LLC
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import json
+import sys
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+from functools import wraps
+from threading import Lock, local
+from time import perf_counter, time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from .config import ZTR_METRICS_EMF, ZTR_METRICS_NAMESPACE
+
+# The upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# The route of the backend calls made outside of a request, e.g. by a flush thread
+BACKGROUND = "background"
+
+
+class Histogram(object):
+    """
+    A cumulative latency histogram, with the Prometheus `le` buckets
+
+    Not thread-safe, c.f. `Metrics`.
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = BUCKETS):
+        """
+        :param buckets: The upper bounds of the buckets, in increasing order
+        """
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        """
+        Record a value
+
+        :param value: The value, in seconds
+        """
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> Iterator[Tuple[str, int]]:
+        """Yield the `le` label and the cumulative count of every bucket"""
+        total = 0
+        for bound, count in zip((*map(str, self.buckets), "+Inf"), self.counts):
+            total += count
+            yield bound, total
+
+
+class _Request(object):
+    """The backend usage of the request being served"""
+
+    def __init__(self, route: str):
+        self.route = route
+        self.backend_calls = 0
+        self.backend_seconds = 0.0
+        self.capacity = 0.0
+
+
+class Metrics(object):
+    """
+    The per-route latencies, backend calls and consumed capacity of the process
+
+    The routes are timed by `instrument`, and the DynamoDB calls by
+    `instrument_pynamodb`. Every request can be printed as a CloudWatch Embedded
+    Metric Format (EMF) line, and the totals are rendered in the Prometheus text
+    format, along with the counters of the registered caches and single-flight
+    groups.
+    """
+
+    def __init__(
+        self,
+        emf: bool = ZTR_METRICS_EMF,
+        namespace: str = ZTR_METRICS_NAMESPACE,
+        write: Callable[[str], Any] = None,
+    ):
+        """
+        :param emf: Print an EMF line after every request
+        :param namespace: The CloudWatch namespace of the EMF metrics
+        :param write: Writes an EMF line, to the standard output by default
+        """
+        self.emf = emf
+        self.namespace = namespace
+        self._write = write
+        self._lock = Lock()
+        self._local = local()
+        self._caches: Dict[str, Any] = {}
+        self._flights: Dict[str, Any] = {}
+        self.reset()
+
+    def reset(self) -> None:
+        """Drop every recorded value"""
+        with self._lock:
+            self.latencies: Dict[str, Histogram] = {}
+            self.backend_latencies: Dict[str, Histogram] = {}
+            # (route, operation) and (route, table)
+            self.backend_calls: "Counter[Tuple[str, str]]" = Counter()
+            self.capacity: "Counter[Tuple[str, str]]" = Counter()
+
+    def register_cache(self, name: str, cache) -> None:
+        """
+        Report the hit and miss counters of a cache, and the counters of the
+        single-flight group of its loads
+
+        :param name: The cache name
+        :param cache: The cache, c.f. `TTLCache.stats`
+        """
+        self._caches[name] = cache
+        self.register_flights(name, cache.flights)
+
+    def register_flights(self, name: str, flights) -> None:
+        """
+        Report the call and collapsed call counters of a single-flight group
+
+        :param name: The group name
+        :param flights: The group, c.f. `SingleFlight.stats`
+        """
+        self._flights[name] = flights
+
+    @property
+    def _request(self) -> Optional[_Request]:
+        return getattr(self._local, "request", None)
+
+    @contextmanager
+    def request(self, route: str) -> Iterator[_Request]:
+        """
+        Time a request, and attribute the backend calls of its thread to its route
+
+        :param route: The route name
+        """
+        request = self._local.request = _Request(route)
+        started = perf_counter()
+        try:
+            yield request
+        finally:
+            elapsed = perf_counter() - started
+            self._local.request = None
+            with self._lock:
+                self.latencies.setdefault(route, Histogram()).observe(elapsed)
+                self.backend_latencies.setdefault(route, Histogram()).observe(
+                    request.backend_seconds
+                )
+            if self.emf:
+                self._emit(request, elapsed)
+
+    def backend_call(
+        self, operation: str, seconds: float, capacity: Dict[str, float]
+    ) -> None:
+        """
+        Record a backend call
+
+        :param operation: The backend operation, e.g. Query
+        :param seconds: How long the call took
+        :param capacity: The capacity units the call consumed, per table
+        """
+        request = self._request
+        route = request.route if request is not None else BACKGROUND
+        if request is not None:
+            request.backend_calls += 1
+            request.backend_seconds += seconds
+            request.capacity += sum(capacity.values())
+        with self._lock:
+            self.backend_calls[(route, operation)] += 1
+            for table, units in capacity.items():
+                self.capacity[(route, table)] += units
+
+    def emf_line(self, request: _Request, elapsed: float) -> Dict[str, Any]:
+        """
+        Return the EMF document of a request
+
+        :param request: The request
+        :param elapsed: How long the request took, in seconds
+        """
+        metrics: List[Tuple[str, str, float]] = [
+            ("Latency", "Milliseconds", elapsed * 1_000),
+            ("BackendLatency", "Milliseconds", request.backend_seconds * 1_000),
+            ("BackendCalls", "Count", request.backend_calls),
+            ("ConsumedCapacity", "Count", request.capacity),
+        ]
+        cache_metrics: List[Tuple[str, str, float]] = []
+        for name, cache in sorted(self._caches.items()):
+            stats = cache.stats()
+            accesses = stats["hits"] + stats["misses"]
+            if accesses:
+                hit_rate = 100.0 * stats["hits"] / accesses
+                cache_metrics.append((f"{name}.HitRate", "Percent", hit_rate))
+
+        def directive(dimensions, values):
+            return {
+                "Namespace": self.namespace,
+                "Dimensions": dimensions,
+                "Metrics": [{"Name": name, "Unit": unit} for name, unit, _ in values],
+            }
+
+        directives = [directive([["Route"]], metrics)]
+        if cache_metrics:
+            directives.append(directive([[]], cache_metrics))
+        return {
+            "_aws": {"Timestamp": int(time() * 1_000), "CloudWatchMetrics": directives},
+            "Route": request.route,
+            **{name: value for name, _, value in metrics + cache_metrics},
+        }
+
+    def _emit(self, request: _Request, elapsed: float) -> None:
+        line = json.dumps(self.emf_line(request, elapsed))
+        if self._write is not None:
+            self._write(line)
+        else:
+            # A raw line, the Lambda log handler would prefix it and break the format
+            print(line, file=sys.stdout, flush=True)
+
+    def prometheus(self) -> str:
+        """Render the totals in the Prometheus text exposition format"""
+        lines = []
+
+        def family(name: str, kind: str, help_: str) -> None:
+            lines.append(f"# HELP {name} {help_}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        def labels(**values: str) -> str:
+            pairs = ",".join(f'{k}="{_escape(v)}"' for k, v in values.items())
+            return f"{{{pairs}}}"
+
+        with self._lock:
+            for name, histograms, help_ in (
+                ("ztr_route_latency_seconds", self.latencies, "Route latency"),
+                (
+                    "ztr_route_backend_seconds",
+                    self.backend_latencies,
+                    "Time each request spent in backend calls",
+                ),
+            ):
+                family(name, "histogram", help_)
+                for route, histogram in sorted(histograms.items()):
+                    for le, count in histogram.cumulative():
+                        lines.append(
+                            f"{name}_bucket{labels(route=route, le=le)} {count}"
+                        )
+                    lines.append(f"{name}_sum{labels(route=route)} {histogram.sum}")
+                    lines.append(f"{name}_count{labels(route=route)} {histogram.count}")
+
+            family("ztr_backend_calls_total", "counter", "Backend calls")
+            for (route, operation), count in sorted(self.backend_calls.items()):
+                lines.append(
+                    f"ztr_backend_calls_total"
+                    f"{labels(route=route, operation=operation)} {count}"
+                )
+
+            family(
+                "ztr_consumed_capacity_units_total",
+                "counter",
+                "DynamoDB capacity units consumed (ReturnConsumedCapacity=TOTAL)",
+            )
+            for (route, table), units in sorted(self.capacity.items()):
+                lines.append(
+                    f"ztr_consumed_capacity_units_total"
+                    f"{labels(route=route, table=table)} {units}"
+                )
+
+        for counter in ("hits", "misses"):
+            family(f"ztr_cache_{counter}_total", "counter", f"Cache {counter}")
+            for name, cache in sorted(self._caches.items()):
+                value = cache.stats()[counter]
+                lines.append(f"ztr_cache_{counter}_total{labels(cache=name)} {value}")
+
+        for counter, help_ in (
+            ("calls", "Calls made by single-flight groups"),
+            ("collapsed", "Calls that waited for an identical call in flight"),
+            ("errors", "Single-flight calls that failed"),
+            ("timeouts", "Single-flight waits that timed out"),
+        ):
+            family(f"ztr_singleflight_{counter}_total", "counter", help_)
+            for name, flights in sorted(self._flights.items()):
+                value = flights.stats()[counter]
+                lines.append(
+                    f"ztr_singleflight_{counter}_total{labels(group=name)} {value}"
+                )
+
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+metrics = Metrics()
+
+
+def instrument(route: Callable) -> Callable:
+    """
+    Record the latency and the backend usage of a route, c.f. `Metrics.request`
+
+    Goes between the route decorator and the view function.
+    """
+
+    @wraps(route)
+    def instrumented(*args, **kwargs):
+        with metrics.request(route.__name__):
+            return route(*args, **kwargs)
+
+    return instrumented
+
+
+def consumed_capacity(data: Optional[Dict]) -> Dict[str, float]:
+    """
+    Return the capacity units consumed by a DynamoDB call, per table
+
+    :param data: The response of the call, if any
+    """
+    capacity = (data or {}).get("ConsumedCapacity")
+    if capacity is None:
+        return {}
+    if isinstance(capacity, dict):
+        capacity = [capacity]
+    totals: "Counter[str]" = Counter()
+    for item in capacity:
+        totals[item.get("TableName", "")] += float(item.get("CapacityUnits", 0))
+    return dict(totals)
+
+
+def instrument_pynamodb() -> None:
+    """
+    Record every DynamoDB call made by PynamoDB, c.f. `Metrics.backend_call`
+
+    PynamoDB asks for the TOTAL consumed capacity of every data call, this reads
+    it from the responses. Calling this again has no effect.
+    """
+    from pynamodb.connection.base import Connection
+
+    dispatch = Connection.dispatch
+    if getattr(dispatch, "instrumented", False):
+        return
+
+    @wraps(dispatch)
+    def instrumented(self, operation_name: str, operation_kwargs: Dict) -> Dict:
+        started = perf_counter()
+        data = None
+        try:
+            data = dispatch(self, operation_name, operation_kwargs)
+            return data
+        finally:
+            metrics.backend_call(
+                operation_name, perf_counter() - started, consumed_capacity(data)
+            )
+
+    instrumented.instrumented = True
+    Connection.dispatch = instrumented
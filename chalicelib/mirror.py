@@ -0,0 +1,342 @@
+#  Copyright (c) 2020 Zero A.E., LLC
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import gzip
+import hashlib
+import io
+import os
+import stat
+import subprocess
+import tarfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from tempfile import TemporaryDirectory
+from threading import Lock
+from time import monotonic
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
+
+from .blobs import BlobStore
+from .models import ModuleModel
+from .repository import get_repository
+from .stamps import touch
+
+ARCHIVE_PREFIX = "archives/sha256"
+ARCHIVE_CONTENT_TYPE = "application/gzip"
+
+# The hosts go-getter clones from when a source has no forced getter
+_GIT_HOSTS = ("github.com/", "bitbucket.org/", "gitlab.com/")
+
+_ARCHIVE_SUFFIXES = (".tar.gz", ".tgz", ".zip")
+
+
+class UnsupportedSource(ValueError):
+    """A getter URL the mirror cannot fetch, e.g. an `hg::` or `gcs::` source"""
+
+
+def archive_key(digest: str) -> str:
+    """
+    Return the key of an archive in the blob store, c.f. `BlobStore`
+
+    :param digest: The SHA-256 digest of the archive
+    """
+    return f"{ARCHIVE_PREFIX}/{digest[:2]}/{digest}.tar.gz"
+
+
+def split_subdir(getter_url: str) -> Tuple[str, str]:
+    """
+    Split the `//subdir` off a go-getter URL
+
+    ref: https://github.com/hashicorp/go-getter#subdirectories
+
+    :param getter_url: The getter URL
+    :return: The URL of the source, and the subdirectory of the module, if any
+    """
+    scheme = getter_url.find("://")
+    start = scheme + 3 if scheme >= 0 else 0
+    separator = getter_url.find("//", start)
+    if separator < 0:
+        return getter_url, ""
+    subdir, has_query, query = getter_url[separator + 2 :].partition("?")
+    return getter_url[:separator] + has_query + query, subdir
+
+
+def _without_params(url: str, *names: str) -> Tuple[str, Dict[str, str]]:
+    """Return a URL without some of its query parameters, and their values"""
+    parsed = urlparse(url)
+    params = parse_qsl(parsed.query, keep_blank_values=True)
+    removed = {k: v for k, v in params if k in names}
+    kept = urlencode([(k, v) for k, v in params if k not in names])
+    return urlunparse(parsed._replace(query=kept)), removed
+
+
+def fetch_git(url: str, ref: Optional[str], destination: str) -> None:
+    """
+    Fetch one revision of a git repository, without its history
+
+    :param url: The repository URL
+    :param ref: The branch, tag or commit, the default branch if None
+    :param destination: The directory to check the revision out in
+    """
+
+    def git(*args: str) -> None:
+        subprocess.run(
+            ["git", *args],
+            cwd=destination,
+            check=True,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+        )
+
+    git("init", "--quiet")
+    git("fetch", "--quiet", "--depth=1", url, ref or "HEAD")
+    git("checkout", "--quiet", "FETCH_HEAD")
+
+
+def fetch_archive(url: str, archive: Optional[str], destination: str) -> None:
+    """
+    Download and extract a tar.gz or zip archive
+
+    :param url: The archive URL
+    :param archive: The archive format, guessed from the URL path if None
+    :param destination: The directory to extract the archive in
+    """
+    import requests
+
+    path = urlparse(url).path
+    archive = archive or ("zip" if path.endswith(".zip") else "tar.gz")
+    response = requests.get(url, timeout=60)
+    response.raise_for_status()
+    data = io.BytesIO(response.content)
+
+    root = os.path.realpath(destination)
+    if archive == "zip":
+        f = zipfile.ZipFile(data)
+        members = names = f.namelist()
+    else:
+        f = tarfile.open(fileobj=data, mode="r:*")
+        members = [m for m in f.getmembers() if m.isfile() or m.isdir()]
+        names = [m.name for m in members]
+    with f:
+        for name in names:
+            target = os.path.realpath(os.path.join(root, name))
+            if target != root and not target.startswith(root + os.sep):
+                raise ValueError(f"{url} has a member outside of its root: {name}")
+        f.extractall(root, members=members)
+
+
+def fetch_source(url: str, destination: str) -> None:
+    """
+    Fetch the source of a go-getter URL, without its subdirectory
+
+    Supports git repositories, including the GitHub, Bitbucket and GitLab
+    shorthands, and tar.gz or zip archives served over HTTP(S).
+
+    :param url: The getter URL, c.f. `split_subdir`
+    :param destination: The (empty) directory to fetch the source in
+    :raises UnsupportedSource: If the URL uses another getter
+    """
+    forced, _, rest = url.partition("::")
+    if not rest:
+        forced, rest = "", url
+
+    if forced == "git" or (not forced and rest.startswith(_GIT_HOSTS)):
+        if not forced and "://" not in rest:
+            rest = f"https://{rest}"
+        rest, params = _without_params(rest, "ref", "depth")
+        return fetch_git(rest, params.get("ref"), destination)
+
+    if forced in ("", "http", "https") and rest.startswith(("http://", "https://")):
+        rest, params = _without_params(rest, "archive", "checksum")
+        archive = params.get("archive")
+        if archive or urlparse(rest).path.endswith(_ARCHIVE_SUFFIXES):
+            return fetch_archive(rest, archive, destination)
+
+    raise UnsupportedSource(f"Cannot mirror {url}")
+
+
+def build_archive(root: str) -> bytes:
+    """
+    Package a directory tree as a deterministic tar.gz archive
+
+    The entries are sorted, and their timestamps, owners and permissions (other
+    than the executable bit) are normalized, so the same tree always gives the
+    same bytes. The `.git` directory is left out.
+
+    :param root: The directory
+    """
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode="wb", mtime=0) as gz:
+        with tarfile.open(fileobj=gz, mode="w", format=tarfile.PAX_FORMAT) as tar:
+            for directory, dirnames, filenames in os.walk(root):
+                dirnames[:] = sorted(d for d in dirnames if d != ".git")
+                for name in [*dirnames, *sorted(filenames)]:
+                    path = os.path.join(directory, name)
+                    info = tar.gettarinfo(path, os.path.relpath(path, root))
+                    info.mtime = 0
+                    info.uid = info.gid = 0
+                    info.uname = info.gname = ""
+                    if info.isdir() or info.mode & stat.S_IXUSR:
+                        info.mode = 0o755
+                    else:
+                        info.mode = 0o644
+                    if info.isfile():
+                        with open(path, "rb") as f:
+                            tar.addfile(info, f)
+                    else:
+                        tar.addfile(info)
+    return buffer.getvalue()
+
+
+@dataclass
+class MirrorReport(object):
+    """
+    The outcome of a mirror run
+    """
+
+    mirrored: int = 0
+    stored: int = 0
+    deduplicated: int = 0
+    skipped: int = 0
+    elapsed: float = 0.0
+    failures: Dict[str, str] = field(default_factory=dict)
+
+    def __str__(self) -> str:
+        return (
+            f"Mirrored {self.mirrored} module versions in {self.elapsed:.2f}s: "
+            f"{self.stored} archives stored, {self.deduplicated} shared, "
+            f"{self.skipped} versions already mirrored, {len(self.failures)} failed"
+        )
+
+
+class Mirror(object):
+    """
+    Mirror the sources of module versions as content-addressed archives
+
+    Each source is fetched once, packaged with `build_archive` and stored under
+    its SHA-256 digest, so the versions with the same content share one archive.
+    The mirror URL of a version tells go-getter to verify that digest.
+    """
+
+    def __init__(
+        self,
+        store: BlobStore,
+        base_url: Optional[str] = None,
+        workers: int = 4,
+        fetch: Callable[[str, str], None] = fetch_source,
+    ):
+        """
+        :param store: The blob store of the archives
+        :param base_url: The URL the store is served from, `BlobStore.url` if None
+        :param workers: The number of concurrent fetches
+        :param fetch: Fetches the source of a getter URL into a directory
+        """
+        self.store = store
+        self.base_url = base_url.rstrip("/") if base_url else None
+        self.workers = workers
+        self._fetch = fetch
+        self._lock = Lock()
+        self._digests: Dict[str, Lock] = {}
+
+    def url(self, digest: str, subdir: str = "") -> str:
+        """
+        Return the getter URL of an archive
+
+        :param digest: The SHA-256 digest of the archive
+        :param subdir: The subdirectory of the module in the archive
+        """
+        key = archive_key(digest)
+        url = f"{self.base_url}/{key}" if self.base_url else self.store.url(key)
+        subdir = f"//{subdir}" if subdir else ""
+        return f"{url}{subdir}?archive=tar.gz&checksum=sha256:{digest}"
+
+    def _digest_lock(self, digest: str) -> Lock:
+        with self._lock:
+            return self._digests.setdefault(digest, Lock())
+
+    def store_archive(self, archive: bytes) -> Tuple[str, bool]:
+        """
+        Store an archive under its digest, unless an identical one is stored
+
+        An archive already stored is read back and checked against its digest,
+        it is replaced if it does not match.
+
+        :param archive: The archive
+        :return: The digest of the archive, and whether it was written
+        """
+        digest = hashlib.sha256(archive).hexdigest()
+        key = archive_key(digest)
+        with self._digest_lock(digest):
+            stored = self.store.get(key)
+            if stored is not None and hashlib.sha256(stored).hexdigest() == digest:
+                return digest, False
+            self.store.put(key, archive, content_type=ARCHIVE_CONTENT_TYPE)
+        return digest, True
+
+    def package(self, source_url: str) -> bytes:
+        """
+        Fetch a source and package it, c.f. `build_archive`
+
+        :param source_url: The getter URL, without subdirectory
+        """
+        with TemporaryDirectory(prefix="ztr-mirror-") as directory:
+            self._fetch(source_url, directory)
+            return build_archive(directory)
+
+    def run(self, modules: Iterable[ModuleModel], force: bool = False) -> MirrorReport:
+        """
+        Mirror module versions, and record their mirror URL
+
+        :param modules: The module versions, with all their attributes
+        :param force: Mirror the versions that already have a mirror URL again
+        """
+        report = MirrorReport()
+        started = monotonic()
+
+        # The versions of each source, a source is fetched once for all of them
+        sources: Dict[str, List[Tuple[ModuleModel, str]]] = {}
+        for module in modules:
+            if module.mirror_url and not force:
+                report.skipped += 1
+                continue
+            source_url, subdir = split_subdir(module.getter_url)
+            sources.setdefault(source_url, []).append((module, subdir))
+
+        def mirror(source_url: str) -> Tuple[str, bool]:
+            return self.store_archive(self.package(source_url))
+
+        mirrored: List[ModuleModel] = []
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(mirror, url): url for url in sources}
+            for future in as_completed(futures):
+                versions = sources[futures[future]]
+                try:
+                    digest, written = future.result()
+                except Exception as e:  # noqa, e.g. a failed clone
+                    for module, _ in versions:
+                        name = f"{module.module_name}/{module.version}"
+                        report.failures[name] = f"{type(e).__name__}: {e}"
+                    continue
+                report.stored += int(written)
+                report.deduplicated += len(versions) - int(written)
+                for module, subdir in versions:
+                    module.mirror_url = self.url(digest, subdir)
+                    module.archive_sha256 = digest
+                    mirrored.append(module)
+
+        report.mirrored = get_repository().save_many(mirrored)
+        touch(module.module_name for module in mirrored)
+        report.elapsed = monotonic() - started
+        return report
@@ -12,35 +12,34 @@
 #
 #  You should have received a copy of the GNU Affero General Public License
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
-from dataclasses import dataclass
-from datetime import datetime
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, Optional
 
 from pynamodb.attributes import (
     Attribute,
+    ListAttribute,
     UnicodeAttribute,
     UTCDateTimeAttribute,
     BooleanAttribute,
     NumberAttribute,
 )
 from pynamodb.constants import STRING
+from pynamodb.indexes import (
+    AllProjection,
+    GlobalSecondaryIndex,
+    IncludeProjection,
+    LocalSecondaryIndex,
+)
 from pynamodb.models import Model
 
-from .config import ZTR_DYNAMODB_TABLE_PREFIX, ZTR_DYNAMODB_URL, ZTR_DYNAMODB_REGION
-
-
-@dataclass
-class ModuleName(object):
-    """
-    The Terraform Registry Fully Qualified Module Name (FQMN)
-    """
-
-    namespace: str
-    name: str
-    provider: str
-
-    def __str__(self) -> str:
-        """Return the `/`-separated form of the module name"""
-        return "/".join([self.namespace, self.name, self.provider])
+from .config import (
+    ZTR_DYNAMODB_MAX_POOL_CONNECTIONS,
+    ZTR_DYNAMODB_REGION,
+    ZTR_DYNAMODB_TABLE_PREFIX,
+    ZTR_DYNAMODB_URL,
+)
+from .names import ModuleName  # noqa, re-exported
+from .versions import is_stable, version_key
 
 
 class ModuleNameAttribute(Attribute):
@@ -57,6 +56,80 @@ class ModuleNameAttribute(Attribute):
         return ModuleName(*value.split("/"))
 
 
+class ModuleVersionIndex(LocalSecondaryIndex):
+    """
+    The versions of a module, in semantic version order
+    """
+
+    class Meta:
+        index_name = "version_key-index"
+        projection = AllProjection()
+
+    module_name = ModuleNameAttribute(hash_key=True)
+    version_key = UnicodeAttribute(range_key=True)
+
+
+class ModuleChangesIndex(GlobalSecondaryIndex):
+    """
+    The module versions written on each (UTC) day, in write order
+
+    Lets readers pick up new and updated versions without scanning the table.
+    """
+
+    class Meta:
+        index_name = "updated_day-index"
+        projection = AllProjection()
+        read_capacity_units = 1
+        write_capacity_units = 1
+
+    updated_day = UnicodeAttribute(hash_key=True)
+    updated_at = UTCDateTimeAttribute(range_key=True)
+
+
+UPDATED_DAY_FORMAT = "%Y-%m-%d"
+
+# The attributes of the module JSON representation, c.f. `chalicelib.search.to_json`
+_LISTING_ATTRIBUTES = [
+    "verified",
+    "owner",
+    "description",
+    "source",
+    "published_at",
+    "downloads",
+    "version_key",
+]
+
+
+class ModuleNamespaceIndex(GlobalSecondaryIndex):
+    """
+    The versions of the modules of a namespace, grouped by module
+    """
+
+    class Meta:
+        index_name = "namespace-index"
+        projection = IncludeProjection(_LISTING_ATTRIBUTES)
+        read_capacity_units = 1
+        write_capacity_units = 1
+
+    namespace = UnicodeAttribute(hash_key=True)
+    module_name = ModuleNameAttribute(range_key=True)
+
+
+class ModuleNamespaceNameIndex(GlobalSecondaryIndex):
+    """
+    The versions of a module for all of its providers, grouped by provider
+    """
+
+    class Meta:
+        index_name = "namespace_name-index"
+        projection = IncludeProjection(_LISTING_ATTRIBUTES)
+        read_capacity_units = 1
+        write_capacity_units = 1
+
+    namespace_name = UnicodeAttribute(hash_key=True)
+    module_name = ModuleNameAttribute(range_key=True)
+
+
 class ModuleModel(Model):
     """
     A Terraform Registry Module Model
@@ -66,6 +139,7 @@ class ModuleModel(Model):
         host = ZTR_DYNAMODB_URL
         table_name = f"{ZTR_DYNAMODB_TABLE_PREFIX}Module"
         region = ZTR_DYNAMODB_REGION
+        max_pool_connections = ZTR_DYNAMODB_MAX_POOL_CONNECTIONS
 
     module_name = ModuleNameAttribute(hash_key=True)
     version = UnicodeAttribute(range_key=True)
@@ -79,3 +153,155 @@ class ModuleModel(Model):
 
     published_at = UTCDateTimeAttribute(default_for_new=datetime.utcnow)
     downloads = NumberAttribute(default_for_new=0)
+
+    # Set by `manage.py mirror`, see `chalicelib.mirror`
+    mirror_url = UnicodeAttribute(null=True)
+    archive_sha256 = UnicodeAttribute(null=True)
+
+    # Derived from `version` on every write, see `chalicelib.versions.version_key`
+    version_key = UnicodeAttribute(null=True)
+    version_index = ModuleVersionIndex()
+
+    # Set on every write, see `ModuleChangesIndex`
+    updated_at = UTCDateTimeAttribute(null=True)
+    updated_day = UnicodeAttribute(null=True)
+    changes_index = ModuleChangesIndex()
+
+    # Derived from `module_name` on every write, see `ModuleNamespaceIndex` and
+    # `ModuleNamespaceNameIndex`
+    namespace = UnicodeAttribute(null=True)
+    namespace_name = UnicodeAttribute(null=True)
+    namespace_index = ModuleNamespaceIndex()
+    namespace_name_index = ModuleNamespaceNameIndex()
+
+    def serialize(self, null_check: bool = True) -> Dict[str, Dict[str, Any]]:
+        self.version_key = version_key(self.version)
+        self.namespace = self.module_name.namespace
+        self.namespace_name = f"{self.module_name.namespace}/{self.module_name.name}"
+        self.updated_at = datetime.now(timezone.utc)
+        self.updated_day = self.updated_at.strftime(UPDATED_DAY_FORMAT)
+        return super().serialize(null_check=null_check)
+
+    @property
+    def download_url(self) -> str:
+        """The URL Terraform downloads the module from, its mirror if it has one"""
+        return self.mirror_url or self.getter_url
+
+    @classmethod
+    def latest(cls, module_name: ModuleName, **kwargs) -> Optional["ModuleModel"]:
+        """
+        Return the latest version of a module, or None if it has no versions
+
+        Versions that are not valid semantic versions have no `version_key`, so
+        they are left out of the index and never returned.
+
+        :param module_name: The module name
+        :param kwargs: Extra arguments for the index query, e.g. attributes_to_get
+        """
+        results = cls.version_index.query(
+            module_name, scan_index_forward=False, limit=1, **kwargs
+        )
+        return next(iter(results), None)
+
+
+class DownloadCounterModel(Model):
+    """
+    One shard of the download counter of a module version
+
+    The counter of a module version is split into shards, so that the writes of
+    popular modules are spread over many items, see `chalicelib.downloads`.
+    """
+
+    class Meta:
+        host = ZTR_DYNAMODB_URL
+        table_name = f"{ZTR_DYNAMODB_TABLE_PREFIX}DownloadCounter"
+        region = ZTR_DYNAMODB_REGION
+        max_pool_connections = ZTR_DYNAMODB_MAX_POOL_CONNECTIONS
+
+    counter_id = UnicodeAttribute(hash_key=True)
+    downloads = NumberAttribute(default=0)
+
+
+class ModuleSummaryModel(Model):
+    """
+    Per-module metadata, maintained on every write to the module's versions
+
+    The `stamp` changes whenever a version of the module is created, imported,
+    restored or deleted, see `chalicelib.stamps`. The other attributes are derived
+    from the module's versions, c.f. `summarize`, and written along with them, so
+    the hot routes answer from the summary alone.
+    """
+
+    class Meta:
+        host = ZTR_DYNAMODB_URL
+        table_name = f"{ZTR_DYNAMODB_TABLE_PREFIX}ModuleSummary"
+        region = ZTR_DYNAMODB_REGION
+        max_pool_connections = ZTR_DYNAMODB_MAX_POOL_CONNECTIONS
+
+    module_name = ModuleNameAttribute(hash_key=True)
+    stamp = UnicodeAttribute()
+
+    # The semantic versions, in order, None for summaries written before they were
+    # added, see `chalicelib.repository.ModuleRepository.rebuild_summaries`
+    versions = ListAttribute(of=UnicodeAttribute, null=True)
+    latest_stable = UnicodeAttribute(null=True)
+    downloads = NumberAttribute(null=True)
+    published_at = UTCDateTimeAttribute(null=True)
+
+    @classmethod
+    def summarize(
+        cls, module_name: ModuleName, modules: Iterable[ModuleModel], stamp: str
+    ) -> "ModuleSummaryModel":
+        """
+        Return the summary of a module
+
+        Versions that are not valid semantic versions are left out of the version
+        list, as they are left out of the version index.
+
+        :param module_name: The module name
+        :param modules: All the versions of the module, with at least their
+            `version`, `downloads` and `published_at`
+        :param stamp: The change stamp of the summary
+        """
+        keyed = []
+        downloads = 0
+        published_at = None
+        for module in modules:
+            key = version_key(module.version)
+            if key is not None:
+                keyed.append((key, module.version))
+            downloads += module.downloads or 0
+            if module.published_at is not None:
+                published = module.published_at
+                if published.tzinfo is None:
+                    # The `default_for_new` of unsaved versions is naive UTC
+                    published = published.replace(tzinfo=timezone.utc)
+                published_at = max(published_at or published, published)
+        versions = [version for _, version in sorted(keyed)]
+        stable = [version for version in versions if is_stable(version)]
+        return cls(
+            module_name,
+            stamp=stamp,
+            versions=versions,
+            latest_stable=stable[-1] if stable else None,
+            downloads=downloads,
+            published_at=published_at,
+        )
+
+
+class CatalogModel(Model):
+    """
+    The generation of the catalog snapshot, a single item named `catalog`
+
+    The generation is bumped whenever a new snapshot of the catalog is published,
+    see `chalicelib.catalog`.
+    """
+
+    class Meta:
+        host = ZTR_DYNAMODB_URL
+        table_name = f"{ZTR_DYNAMODB_TABLE_PREFIX}Catalog"
+        region = ZTR_DYNAMODB_REGION
+        max_pool_connections = ZTR_DYNAMODB_MAX_POOL_CONNECTIONS
+
+    name = UnicodeAttribute(hash_key=True)
+    generation = UnicodeAttribute()
@@ -12,32 +12,314 @@
 #
 #  You should have received a copy of the GNU Affero General Public License
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
-from functools import cmp_to_key
+import json
 from http import HTTPStatus
+from itertools import islice
 from re import sub
-from typing import Dict
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import urlencode
 
-import semver
-from chalice import Blueprint, Response, ChaliceViewError
-from pynamodb.exceptions import DoesNotExist
+from chalice import Blueprint, Response, ChaliceViewError, BadRequestError
 
+from . import cursors
+from .cache import TTLCache
+from .compression import compressed
 from .config import *
-from .models import ModuleName, ModuleModel
+from .downloads import get_counter
+from .metrics import instrument, metrics
+from .names import ModuleName
+from .repository import get_repository
+from .singleflight import SingleFlight
+from .stamps import (
+    cache_headers,
+    etag,
+    module_etag,
+    not_modified,
+    not_modified_response,
+)
+
+# The storage backend and the search index are only imported by the routes that
+# use them, so that a cold start serving e.g. the service discovery stays fast
+if TYPE_CHECKING:  # pragma: no cover
+    from .catalog import CatalogSnapshot
+    from .models import ModuleModel
 
 bp = Blueprint(__name__)
 
+# The service discovery document, for the blueprint mounted at /modules
+DISCOVERY = json.dumps({"modules.v1": "/modules/"})
+
+# Modules usually have a few versions each, so listing pages read at least this many
+_MIN_PAGE_SIZE = 100
+
+# The attributes of the get_module response, besides the keys
+_MODULE_ATTRIBUTES = [
+    "verified",
+    "owner",
+    "description",
+    "source",
+    "published_at",
+    "downloads",
+]
+
+# The `root` of the get_module response, for a module whose source is not analyzed
+_EMPTY_ROOT = {
+    "path": "",
+    "readme": "",
+    "empty": False,
+    "inputs": [],
+    "outputs": [],
+    "dependencies": [],
+    "provider_dependencies": [],
+    "resources": [],
+}
+
+# Survives across warm invocations, see ZTR_CACHE_* for its size and expiration
+getter_urls = TTLCache(
+    maxsize=ZTR_CACHE_SIZE,
+    ttl=ZTR_CACHE_TTL_SECONDS,
+    negative_ttl=ZTR_CACHE_NEGATIVE_TTL_SECONDS,
+)
+metrics.register_cache("getter_urls", getter_urls)
+
+# The semantic versions of each module, newest first, c.f. `resolve`
+module_versions = TTLCache(
+    maxsize=ZTR_CACHE_SIZE,
+    ttl=ZTR_CACHE_TTL_SECONDS,
+    negative_ttl=ZTR_CACHE_NEGATIVE_TTL_SECONDS,
+)
+metrics.register_cache("module_versions", module_versions)
+
+# Concurrent identical backend lookups of the routes share one call, keyed by
+# (operation, module name, version), e.g. after a popular module is published
+lookups = SingleFlight()
+metrics.register_flights("lookups", lookups)
+
+
+def _snapshot() -> Optional["CatalogSnapshot"]:
+    """
+    Return the catalog snapshot the read routes are served from, or None to serve
+    them from the backend, c.f. ZTR_CATALOG_URL
+    """
+    if ZTR_CATALOG_URL is None:
+        return None
+    from .catalog import catalog
+
+    return catalog.current()
+
+
+def _read_etag(
+    fqmn: ModuleName, snapshot: Optional["CatalogSnapshot"], *parts: str
+) -> Optional[str]:
+    """
+    Return the entity tag of a read route response
+
+    A response served from a catalog snapshot is tagged with a digest of the
+    module's block, so its ETag changes with its body, and only then, without
+    reading the module's change stamp. Otherwise it is derived from the stamp,
+    c.f. `module_etag`.
+
+    :param fqmn: The module name
+    :param snapshot: The snapshot the response is served from, if any
+    :param parts: What else the response depends on, e.g. the route
+    """
+    if snapshot is not None:
+        return etag(str(fqmn), snapshot.digest(fqmn), *parts)
+    return module_etag(fqmn, *parts)
+
+
+def _summary_versions(fqmn: ModuleName) -> Optional[List[str]]:
+    """
+    Read the semantic versions of a module, in order, from its summary
+
+    :param fqmn: The module name
+    :return: The versions, or None if the module has no summary with versions,
+        which are then read from the version index
+    """
+    summary = lookups.do(
+        ("summary", fqmn, None), lambda: get_repository().summary(fqmn)
+    )
+    return summary.versions if summary is not None else None
+
+
+def _query_int(params: Dict, name: str, default: int) -> int:
+    """
+    Read a non-negative integer query parameter
+
+    :param params: The request query parameters
+    :param name: The parameter name
+    :param default: The value to use when the parameter is missing
+    """
+    try:
+        value = int(params.get(name, default))
+    except ValueError:
+        raise BadRequestError(f"{name} must be an integer")
+    if value < 0:
+        raise BadRequestError(f"{name} must not be negative")
+    return value
+
+
+# The query parameters that select a page, and are not part of the cursor scope
+_PAGING_PARAMS = ("cursor", "offset", "limit")
+
+
+def _cursor_scope(params: Dict) -> str:
+    """Return the query a cursor belongs to: the route and its filters"""
+    filters = sorted((k, v) for k, v in params.items() if k not in _PAGING_PARAMS)
+    return f"{bp.current_request.context['path']}?{urlencode(filters)}"
+
+
+def _paging() -> Tuple[Dict, int, int, Optional[str]]:
+    """
+    Read the paging query parameters of the list and search routes
+
+    A page is selected either by `offset`, or by the `cursor` returned in the
+    meta.next_url of the previous page, which takes precedence.
+
+    :return: The query parameters, the offset, the limit, and the position the
+             page starts after if it was selected by a cursor
+    :raises BadRequestError: If the offset, limit or cursor are invalid
+    """
+    params = dict(bp.current_request.query_params or {})
+    offset = _query_int(params, "offset", 0)
+    limit = min(_query_int(params, "limit", ZTR_LIMIT), ZTR_LIMIT)
+    if limit < 1:
+        raise BadRequestError("limit must be positive")
+
+    after = None
+    if "cursor" in params:
+        after, offset = cursors.decode(params["cursor"], _cursor_scope(params))
+    return params, offset, limit, after
+
+
+def _page(
+    params: Dict, offset: int, limit: int, modules: List["ModuleModel"]
+) -> Response:
+    """
+    Serve a page of modules, with the meta of the list and search routes
+
+    The meta.next_url carries a cursor positioned after the last module of the
+    page, so the next page does not depend on the number of modules before it.
+
+    :param params: The request query parameters
+    :param offset: The offset of the page
+    :param limit: The page size
+    :param modules: The modules of the page, and the first module of the next
+                    page if there is one
+    """
+    from .search import to_json as module_json
+
+    meta = {"limit": limit, "current_offset": offset}
+    if offset > 0:
+        meta["prev_offset"] = max(offset - limit, 0)
+    if len(modules) > limit:
+        modules = modules[:limit]
+        meta["next_offset"] = offset + limit
+        cursor = cursors.encode(
+            str(modules[-1].module_name), meta["next_offset"], _cursor_scope(params)
+        )
+        next_params = {k: v for k, v in params.items() if k not in _PAGING_PARAMS}
+        next_params.update(cursor=cursor, limit=limit)
+        meta["next_url"] = (
+            f"{bp.current_request.context['path']}?{urlencode(next_params)}"
+        )
+
+    return Response(
+        body={"meta": meta, "modules": [module_json(m) for m in modules]},
+        status_code=HTTPStatus.OK,
+    )
+
+
+def _bad_request(bre: BadRequestError) -> Response:
+    """Render a BadRequestError as a registry API error response"""
+    return Response(body={"errors": list(bre.args)}, status_code=bre.STATUS_CODE)
+
+
+def _search(q: str, **filters) -> Response:
+    """
+    Serve a page of search results for the list and search routes
+
+    :param q: The query string
+    :param filters: The namespace, provider and verified filters, if set
+    """
+    try:
+        params, offset, limit, after = _paging()
+    except BadRequestError as bre:
+        return _bad_request(bre)
+
+    snapshot = _snapshot()
+    source = snapshot if snapshot is not None else get_repository()
+    modules, _ = source.search(
+        q, offset=offset, limit=limit + 1, after=after, **filters
+    )
+    return _page(params, offset, limit, modules)
+
+
+def _list_latest(
+    namespace: str,
+    name: Optional[str] = None,
+    provider: Optional[str] = None,
+    verified: Optional[bool] = None,
+) -> Response:
+    """
+    Serve a page of the latest versions of the modules of a namespace
+
+    The modules are read in module name order, and only until the page is full,
+    so a page selected by a cursor costs reads proportional to its limit.
+
+    :param namespace: The module namespace
+    :param name: Only list the modules with this name
+    :param provider: Only return modules for this provider
+    :param verified: Only return modules whose latest version has this verified status
+    """
+    try:
+        params, offset, limit, after = _paging()
+    except BadRequestError as bre:
+        return _bad_request(bre)
+
+    latest = get_repository().list_latest(
+        namespace,
+        name,
+        after=ModuleName(*after.split("/")) if after is not None else None,
+        page_size=min(max(limit + 1, _MIN_PAGE_SIZE), ZTR_LIMIT),
+    )
+    modules = (
+        module
+        for module in latest
+        if provider in (None, module.module_name.provider)
+        and verified in (None, bool(module.verified))
+    )
+    skip = offset if after is None else 0
+    return _page(params, offset, limit, list(islice(modules, skip, skip + limit + 1)))
+
+
+def _verified_filter(params: Dict) -> Optional[bool]:
+    """Parse the optional `verified` query parameter"""
+    verified = params.get("verified", None)
+    if verified is None:
+        return None
+    return verified.lower() in ("1", "true", "yes")
+
 
 @bp.route("/")
+@instrument
+@compressed(bp)
 def list_all() -> Response:
     """
     Lists all modules in the registry
     ref: https://www.terraform.io/docs/registry/api.html#list-modules
     """
-    bp.current_request.query_params["q"] = "*"
-    return search()
+    params = bp.current_request.query_params or {}
+    return _search(
+        "*",
+        provider=params.get("provider", None),
+        verified=_verified_filter(params),
+    )
 
 
 @bp.route("/{namespace}")
+@instrument
+@compressed(bp)
 def list_namespace(namespace) -> Response:
     """
     Lists all modules in the given namespace
@@ -45,30 +327,40 @@ def list_namespace(namespace) -> Response:
 
     :param namespace: The module namespace
     """
-    bp.current_request.query_params["q"] = "*"
-    bp.current_request.query_params["namespace"] = namespace
-    return search()
+    params = bp.current_request.query_params or {}
+    return _list_latest(
+        namespace,
+        provider=params.get("provider", None),
+        verified=_verified_filter(params),
+    )
 
 
 @bp.route("/search")
+@instrument
+@compressed(bp)
 def search() -> Response:
     """
     Search for modules in the registry
     ref: https://www.terraform.io/docs/registry/api.html#search-modules
     """
-    q = bp.current_request.query_params["q"]
-
-    # Optional
-    offset = bp.current_request.query_params.get("offset", 0)
-    limit = bp.current_request.query_params.get("limit", ZTR_LIMIT)
-    provider = bp.current_request.query_params.get("provider", None)
-    verified = bp.current_request.query_params.get("verified", None)
-    namespace = bp.current_request.query_params.get("namespace", None)
+    params = bp.current_request.query_params or {}
+    if "q" not in params:
+        return Response(
+            body={"errors": ["The `q` query parameter is required."]},
+            status_code=HTTPStatus.BAD_REQUEST,
+        )
 
-    raise NotImplementedError()
+    return _search(
+        params["q"],
+        namespace=params.get("namespace", None),
+        provider=params.get("provider", None),
+        verified=_verified_filter(params),
+    )
 
 
 @bp.route("/{namespace}/{name}")
+@instrument
+@compressed(bp)
 def list_latest_all_providers(namespace: str, name: str) -> Response:
     """
     List Latest Version of Module for All Providers
@@ -77,14 +369,12 @@ def list_latest_all_providers(namespace: str, name: str) -> Response:
     :param namespace: The module namespace
     :param name: The module name
     """
-    # Optional
-    offset = bp.current_request.uri_params.get("offset", 0)
-    limit = bp.current_request.uri_params.get("limit", ZTR_LIMIT)
-
-    raise NotImplementedError()
+    return _list_latest(namespace, name)
 
 
 @bp.route("/{namespace}/{name}/{provider}")
+@instrument
+@compressed(bp)
 def list_latest(namespace: str, name: str, provider: str) -> Response:
     """
     Latest Version for a Specific Module Provider
@@ -95,55 +385,237 @@ def list_latest(namespace: str, name: str, provider: str) -> Response:
     :param provider: The module primary provider
     """
 
-    raise NotImplementedError()
+    fqmn = ModuleName(namespace, name, provider)
+    latest = lookups.do(("latest", fqmn, None), lambda: get_repository().latest(fqmn))
+
+    if latest is None:
+        return Response(
+            status_code=HTTPStatus.NOT_FOUND,
+            body={"errors": [f"Module {fqmn} was not found!"]},
+        )
+
+    from .search import to_json as module_json
+
+    return Response(body=module_json(latest), status_code=HTTPStatus.OK)
+
+
+def versions_json(fqmn: ModuleName, versions: Iterable[str]) -> Iterator[str]:
+    """
+    Yield the chunks of the list_versions JSON document
+
+    :param fqmn: The module name
+    :param versions: The versions, in the order they are listed
+    """
+    yield f'{{"modules": [{{"source": {json.dumps(str(fqmn))}, "versions": ['
+    for i, version in enumerate(versions):
+        yield f'{", " if i else ""}{{"version": {json.dumps(version)}}}'
+    yield "]}]}"
 
 
 @bp.route("/{namespace}/{name}/{provider}/versions")
-def list_versions(namespace: str, name: str, provider: str) -> Dict:
+@instrument
+@compressed(bp)
+def list_versions(namespace: str, name: str, provider: str) -> Response:
     """
     List Available Versions for a Specific Module
     ref: https://www.terraform.io/docs/registry/api.html#list-available-versions-for-a-specific-module
 
+    The versions are read in semantic version order from the module's summary, by
+    one backend call shared by the concurrent requests for the module, or from the
+    catalog snapshot. A request whose If-None-Match matches the module's change
+    stamp, or its block in the snapshot, is answered with a 304, without reading
+    the versions.
+
     :param namespace: The module namespace
     :param name: The module name
     :param provider: The module primary provider
     """
 
     fqmn = ModuleName(namespace, name, provider)
-    # noinspection PyTypeChecker
-    modules = [
-        {
-            "source": str(fqmn),
-            "versions": [
-                {"version": v_module.version} for v_module in ModuleModel.query(fqmn)
-            ],
-        }
-    ]
+    snapshot = _snapshot()
+    tag = _read_etag(fqmn, snapshot, "versions")
+    if not_modified(bp.current_request, tag):
+        return not_modified_response(tag, ZTR_HTTP_VERSIONS_MAX_AGE)
+
+    if snapshot is not None:
+        versions: Optional[Iterable[str]] = snapshot.versions(fqmn)
+    else:
+        versions = _summary_versions(fqmn)
+    if versions is None:
+        versions = lookups.do(
+            ("versions", fqmn, None), lambda: list(get_repository().versions(fqmn))
+        )
 
-    return {"modules": modules}
+    return Response(
+        body="".join(versions_json(fqmn, versions)),
+        status_code=HTTPStatus.OK,
+        headers={
+            "Content-Type": "application/json",
+            **cache_headers(tag, ZTR_HTTP_VERSIONS_MAX_AGE),
+        },
+    )
+
+
+def _load_module_versions(module_names: List[ModuleName]) -> Dict:
+    """Read the semantic versions of modules, newest first, c.f. `parse_versions`"""
+    from .constraints import parse_versions
+
+    repository = get_repository()
+    loaded = {m: parse_versions(repository.versions(m)) for m in module_names}
+    return {m: versions for m, versions in loaded.items() if versions}
+
+
+def _load_download_urls(keys: List[Tuple[ModuleName, str]]) -> Dict:
+    """Read the download URLs of module versions, in BatchGetItem-sized groups"""
+    modules = get_repository().get_many(keys, attributes=["getter_url", "mirror_url"])
+    return {(m.module_name, m.version): m.download_url for m in modules}
+
+
+def _resolve_requests(body) -> List[Tuple[ModuleName, str]]:
+    """
+    Read the module names and constraints of a resolve request
+
+    :param body: The JSON body of the request
+    :raises BadRequestError: If the body is not a valid resolve request
+    """
+    requests = body.get("modules") if isinstance(body, dict) else None
+    if not isinstance(requests, list):
+        raise BadRequestError("The body must be an object with a `modules` list.")
+    if len(requests) > ZTR_LIMIT:
+        raise BadRequestError(f"At most {ZTR_LIMIT} modules can be resolved at once.")
+
+    resolved = []
+    for i, request in enumerate(requests):
+        source = request.get("source") if isinstance(request, dict) else None
+        constraint = request.get("version", "") if isinstance(request, dict) else None
+        parts = source.split("/") if isinstance(source, str) else []
+        if len(parts) != 3 or not all(parts) or not isinstance(constraint, str):
+            raise BadRequestError(
+                f"modules[{i}] must have a `<namespace>/<name>/<provider>` source "
+                f"and an optional version constraint string."
+            )
+        resolved.append((ModuleName(*parts), constraint))
+    return resolved
+
+
+@bp.route("/resolve", methods=["POST"])
+@instrument
+@compressed(bp)
+def resolve() -> Response:
+    """
+    Resolve the version constraints of many modules at once
+
+    The body lists the modules as in Terraform module blocks,
+    `{"modules": [{"source": "<namespace>/<name>/<provider>", "version": "~> 3.2"}]}`,
+    and each is answered, in the same order, with the newest version that meets
+    its constraint and the URL to download it from, or with an error.
+
+    The versions of each module are cached, and the download URLs of the
+    resolved versions are read in BatchGetItem-sized groups.
+    """
+    from .constraints import InvalidConstraint, compile_constraint
+
+    try:
+        pairs = _resolve_requests(bp.current_request.json_body)
+    except BadRequestError as bre:
+        return _bad_request(bre)
+
+    versions = module_versions.get_many(
+        (module_name for module_name, _ in pairs), _load_module_versions
+    )
+    results = []
+    resolved = []
+    for module_name, text in pairs:
+        result = {"source": str(module_name), "version": text}
+        results.append(result)
+        try:
+            constraint = compile_constraint(text)
+        except InvalidConstraint as ic:
+            result["error"] = str(ic)
+            continue
+        if versions[module_name] is None:
+            result["error"] = f"Module {module_name} was not found!"
+            continue
+        selected = constraint.select(versions[module_name])
+        if selected is None:
+            result["error"] = f"No version of {module_name} meets {text!r}"
+            continue
+        result["resolved"] = str(selected)
+        resolved.append((module_name, result))
+
+    download_urls = getter_urls.get_many(
+        ((module_name, result["resolved"]) for module_name, result in resolved),
+        _load_download_urls,
+    )
+    for module_name, result in resolved:
+        result["download_url"] = download_urls[(module_name, result["resolved"])]
+
+    return Response(body={"modules": results}, status_code=HTTPStatus.OK)
 
 
 @bp.route("/{namespace}/{name}/{provider}/{version}")
+@instrument
+@compressed(bp)
 def get_module(namespace: str, name: str, provider: str, version: str) -> Response:
     """
     Get details about Specific Module
     ref: https://www.terraform.io/docs/registry/api.html#get-a-specific-module
 
+    The module's versions are read with one query of its partition, projected to
+    the attributes of the response, and ordered by the `version_key` stored with
+    each version. The requested version is picked out of the same results.
+
+    Module sources are not analyzed, so `root` is empty and there are no
+    `submodules`. The download counts change the module's stamp when they are
+    rolled up, so a request whose If-None-Match matches the stamp is answered
+    with a 304, without reading the versions.
+
     :param namespace: The module namespace
     :param name: The module name
     :param provider: The module primary provider
     :param version: The module version
     """
+    from .search import to_json as module_json
+
+    fqmn = ModuleName(namespace, name, provider)
+    tag = module_etag(fqmn, "module", version)
+    if not_modified(bp.current_request, tag):
+        return not_modified_response(tag, ZTR_HTTP_VERSIONS_MAX_AGE)
+
+    ordered = lookups.do(
+        ("module_versions", fqmn, None),
+        lambda: get_repository().module_versions(fqmn, attributes=_MODULE_ATTRIBUTES),
+    )
+    module = next((m for m in ordered if m.version == version), None)
+    if module is None:
+        return Response(
+            status_code=HTTPStatus.NOT_FOUND,
+            body={"errors": [f"Module {fqmn}/{version} was not found!"]},
+        )
 
-    raise NotImplementedError()
+    return Response(
+        body={
+            **module_json(module),
+            "root": _EMPTY_ROOT,
+            "submodules": [],
+            # As listed by list_versions, only the semantic versions
+            "versions": [m.version for m in ordered if m.version_key is not None],
+        },
+        status_code=HTTPStatus.OK,
+        headers=cache_headers(tag, ZTR_HTTP_VERSIONS_MAX_AGE),
+    )
 
 
 @bp.route("/{namespace}/{name}/{provider}/download")
+@instrument
 def download_latest(namespace: str, name: str, provider: str) -> Response:
     """
     Download the Latest Version of a Module
     ref: https://www.terraform.io/docs/registry/api.html#download-the-latest-version-of-a-module
 
+    The latest version is the last version of the module's summary, or is read
+    from the catalog snapshot.
+
     :param namespace: The module namespace
     :param name: The module name
     :param provider: The module primary provider
@@ -151,29 +623,63 @@ def download_latest(namespace: str, name: str, provider: str) -> Response:
     """
 
     fqmn = ModuleName(namespace, name, provider)
-    max_version = max(
-        (module.version for module in ModuleModel.query(fqmn)),
-        key=cmp_to_key(semver.compare),
-        default=None,
-    )
+    snapshot = _snapshot()
+    tag = _read_etag(fqmn, snapshot, "download")
+    if not_modified(bp.current_request, tag):
+        return not_modified_response(tag, ZTR_HTTP_VERSIONS_MAX_AGE)
+
+    versions = _summary_versions(fqmn) if snapshot is None else None
+    if snapshot is not None:
+        latest_version = snapshot.latest_version(fqmn)
+    elif versions is not None:
+        latest_version = versions[-1] if versions else None
+    else:
+        latest = lookups.do(
+            ("latest_version", fqmn, None),
+            lambda: get_repository().latest(fqmn, attributes=["version"]),
+        )
+        latest_version = latest.version if latest is not None else None
 
-    if max_version is None:
+    if latest_version is None:
         return Response(
             status_code=HTTPStatus.NOT_FOUND,
             body={"errors": [f"Module {fqmn} was not found!"]},
         )
 
     new_path = sub(
-        r"/download$", f"/{max_version}/download", bp.current_request.context["path"]
+        r"/download$", f"/{latest_version}/download", bp.current_request.context["path"]
     )
     return Response(
         status_code=HTTPStatus.FOUND,
-        headers={"Location": new_path},
+        headers={"Location": new_path, **cache_headers(tag, ZTR_HTTP_VERSIONS_MAX_AGE)},
         body=f'<a href="{new_path}">Found</a>.',
     )
 
 
+def _load_getter_url(module_name: ModuleName, version: str) -> Optional[str]:
+    """
+    Read the download URL of a module version from the backend
+
+    :param module_name: The module name
+    :param version: The module version
+    :return: The mirror URL, or the getter URL of a module version that is not
+        mirrored, or None if the module version does not exist
+    """
+    module = get_repository().get(
+        module_name, version, attributes=["getter_url", "mirror_url"]
+    )
+    if module is None:
+        return None
+
+    if module.download_url is None:
+        raise ChaliceViewError(
+            msg=f"{module_name}/{version} is missing the `source` attribute."
+        )
+    return module.download_url
+
+
 @bp.route("/{namespace}/{name}/{provider}/{version}/download")
+@instrument
 def download(namespace: str, name: str, provider: str, version: str) -> Response:
     """
     Download Source Code for a Specific Module Version
@@ -191,23 +697,34 @@ def download(namespace: str, name: str, provider: str, version: str) -> Response
     :return: HTTP 204 (no content), with X-Terraform-Get header pointing to module.source
     """
 
-    # noinspection PyTypeChecker
+    module_name = ModuleName(namespace, name, provider)
     try:
-        module_name = ModuleName(namespace, name, provider)
-        module = ModuleModel.get(module_name, range_key=version)
-        if module.getter_url is None:
-            raise ChaliceViewError(
-                msg=f"{namespace}/{name}/{provider}/{version} is missing the `source` attribute."
+        snapshot = _snapshot()
+        if snapshot is not None:
+            getter_url = snapshot.download_url(module_name, version)
+        else:
+            getter_url = getter_urls.get(
+                (module_name, version), lambda: _load_getter_url(module_name, version)
+            )
+        if getter_url is None:
+            return Response(
+                body={"errors": [f"Module {module_name}/{version} was not found!"]},
+                status_code=HTTPStatus.NOT_FOUND,
             )
 
+        # The getter URL is cached longer than the change stamps, so the ETag is
+        # derived from the URL served rather than from the module's stamp
+        tag = etag(str(module_name), "download", version, getter_url)
+        get_counter().record(module_name, version)
+        if not_modified(bp.current_request, tag):
+            return not_modified_response(tag, ZTR_HTTP_DOWNLOAD_MAX_AGE)
         return Response(
             body=None,
             status_code=HTTPStatus.NO_CONTENT,
-            headers={"X-Terraform-Get": module.getter_url},
-        )
-    except DoesNotExist as dne:
-        return Response(
-            body={"errors": [dne.args[0]]}, status_code=HTTPStatus.NOT_FOUND
+            headers={
+                "X-Terraform-Get": getter_url,
+                **cache_headers(tag, ZTR_HTTP_DOWNLOAD_MAX_AGE),
+            },
         )
     except ChaliceViewError as cve:
         return Response(body={"errors": cve.args}, status_code=cve.STATUS_CODE)
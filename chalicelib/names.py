@@ -0,0 +1,30 @@
+#  Copyright (c) 2020 Zero A.E., LLC
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class ModuleName(object):
+    """
+    The Terraform Registry Fully Qualified Module Name (FQMN)
+    """
+
+    namespace: str
+    name: str
+    provider: str
+
+    def __str__(self) -> str:
+        """Return the `/`-separated form of the module name"""
+        return "/".join([self.namespace, self.name, self.provider])
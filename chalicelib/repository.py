@@ -0,0 +1,343 @@
+#  Copyright (c) 2020 Zero A.E., LLC
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+from abc import ABC, abstractmethod
+from threading import Lock
+from typing import TYPE_CHECKING, Iterable, Iterator, List, Optional, Tuple
+
+from .config import ZTR_BACKEND, ZTR_LIMIT, ZTR_SQLITE_PATH
+from .names import ModuleName
+
+# The backends are only imported once one is opened, c.f. `open_repository`
+if TYPE_CHECKING:  # pragma: no cover
+    from .models import ModuleModel, ModuleSummaryModel
+
+
+class ModuleRepository(ABC):
+    """
+    The storage of the module versions, behind the routes and the CLI
+
+    Records are `ModuleModel` instances, whatever the backend. They are only saved
+    through the repository, never with `ModuleModel.save`.
+    """
+
+    @abstractmethod
+    def init(self) -> None:
+        """Create the storage, if it does not exist"""
+
+    @abstractmethod
+    def destroy(self) -> None:
+        """Delete the storage, and everything in it"""
+
+    @abstractmethod
+    def get(
+        self, module_name: ModuleName, version: str, attributes: List[str] = None
+    ) -> Optional["ModuleModel"]:
+        """
+        Return a module version, or None if it does not exist
+
+        :param module_name: The module name
+        :param version: The module version
+        :param attributes: The attributes to read, all of them by default
+        """
+
+    @abstractmethod
+    def get_many(
+        self, keys: Iterable[Tuple[ModuleName, str]], attributes: List[str] = None
+    ) -> Iterator["ModuleModel"]:
+        """
+        Lazily yield the module versions that exist among many, in no particular
+        order
+
+        The versions are read in groups of `BATCH_GET_SIZE`, c.f. DynamoDB's
+        BatchGetItem.
+
+        :param keys: The module name and version of each module version
+        :param attributes: The attributes to read, all of them by default
+        """
+
+    @abstractmethod
+    def module_versions(
+        self, module_name: ModuleName, attributes: List[str] = None
+    ) -> List["ModuleModel"]:
+        """
+        Return every version of a module, read at once, in semantic version order
+
+        The order is the one of the `version_key` stored with each version, the
+        versions that are not valid semantic versions come first.
+
+        :param module_name: The module name
+        :param attributes: The attributes to read, all of them by default
+        """
+
+    @abstractmethod
+    def latest(
+        self, module_name: ModuleName, attributes: List[str] = None
+    ) -> Optional["ModuleModel"]:
+        """
+        Return the latest version of a module, or None if it has no versions
+
+        Versions that are not valid semantic versions are never returned.
+
+        :param module_name: The module name
+        :param attributes: The attributes to read, all of them by default
+        """
+
+    @abstractmethod
+    def versions(self, module_name: ModuleName) -> Iterator[str]:
+        """
+        Lazily yield the versions of a module, in semantic version order
+
+        Versions that are not valid semantic versions are left out.
+
+        :param module_name: The module name
+        """
+
+    @abstractmethod
+    def list_latest(
+        self,
+        namespace: str,
+        name: Optional[str] = None,
+        after: Optional[ModuleName] = None,
+        page_size: int = ZTR_LIMIT,
+    ) -> Iterator["ModuleModel"]:
+        """
+        Lazily yield the latest version of the modules of a namespace, in module
+        name order
+
+        :param namespace: The module namespace
+        :param name: Only yield the modules (i.e. the providers) with this name
+        :param after: Only yield the modules after this one
+        :param page_size: The number of records read at a time
+        """
+
+    @abstractmethod
+    def search(
+        self,
+        q: str,
+        offset: int = 0,
+        limit: int = 15,
+        provider: Optional[str] = None,
+        verified: Optional[bool] = None,
+        namespace: Optional[str] = None,
+        after: Optional[str] = None,
+    ) -> Tuple[List["ModuleModel"], int]:
+        """
+        Search the latest version of every module, in module name order
+
+        :param q: The query string, every token must match. `*` matches all modules.
+        :param offset: The number of results to skip
+        :param limit: The maximum number of results to return
+        :param provider: Only return modules for this provider
+        :param verified: Only return modules with this verified status
+        :param namespace: Only return modules in this namespace
+        :param after: Only return modules after this FQMN, instead of skipping offset
+        :return: The page of matching modules, and the total number of matches
+        """
+
+    @abstractmethod
+    def scan(self, attributes: List[str] = None) -> Iterator["ModuleModel"]:
+        """
+        Lazily yield every module version, in no particular order
+
+        :param attributes: The attributes to read, all of them by default
+        """
+
+    @abstractmethod
+    def save(self, module: "ModuleModel") -> None:
+        """
+        Create or replace a module version
+
+        :param module: The module version
+        """
+
+    @abstractmethod
+    def save_many(self, modules: Iterable["ModuleModel"]) -> int:
+        """
+        Create or replace many module versions, in batches
+
+        :param modules: The module versions, each at most once
+        :return: The number of module versions saved
+        """
+
+    @abstractmethod
+    def delete(self, module_name: ModuleName, version: str) -> bool:
+        """
+        Delete a module version
+
+        :param module_name: The module name
+        :param version: The module version
+        :return: False if the module version did not exist
+        """
+
+    @abstractmethod
+    def add_downloads(self, module_name: ModuleName, version: str, count: int) -> None:
+        """
+        Add to the download count of a module version
+
+        The count is returned by `downloads` at once, but may only be stored on
+        the module version and its module's summary by `rollup_downloads`.
+
+        :param module_name: The module name
+        :param version: The module version
+        :param count: The number of downloads
+        """
+
+    @abstractmethod
+    def rollup_downloads(self, keys: Iterable[Tuple[ModuleName, str]]) -> int:
+        """
+        Store the download counts of module versions on their records, and the
+        totals of their modules on the modules' summaries
+
+        The modules get a new change stamp, since their documents changed.
+        Downloads of module versions that do not exist are ignored.
+
+        :param keys: The module name and version of each module version
+        :return: The number of module versions rolled up
+        """
+
+    @abstractmethod
+    def downloads(self, module_name: ModuleName, version: str) -> int:
+        """
+        Return the download count of a module version
+
+        :param module_name: The module name
+        :param version: The module version
+        """
+
+    @abstractmethod
+    def stamp(self, module_name: ModuleName) -> Optional[str]:
+        """
+        Return the change stamp of a module, or None if it has none (yet)
+
+        :param module_name: The module name
+        """
+
+    @abstractmethod
+    def set_stamps(self, stamps: Iterable[Tuple[ModuleName, str]]) -> None:
+        """
+        Set the change stamp of modules, c.f. `chalicelib.stamps.touch`
+
+        :param stamps: The module names and their new stamps
+        """
+
+    @abstractmethod
+    def summary(self, module_name: ModuleName) -> Optional["ModuleSummaryModel"]:
+        """
+        Return the summary of a module, in a single read
+
+        :param module_name: The module name
+        :return: The summary, or None if the module has none (yet)
+        """
+
+    @abstractmethod
+    def summary_names(self) -> Iterator[ModuleName]:
+        """Lazily yield the name of every module with a summary"""
+
+    @abstractmethod
+    def refresh_summaries(self, module_names: Iterable[ModuleName]) -> None:
+        """
+        Derive the summary of modules from their versions, c.f.
+        `ModuleSummaryModel.summarize`, and give them a new stamp
+
+        :param module_names: The module names
+        """
+
+    def rebuild_summaries(
+        self, module_names: Iterable[ModuleName] = None, workers: int = 8
+    ) -> int:
+        """
+        Rebuild the summary of modules from their versions, in parallel, e.g. after
+        a restore, or to repair the summaries written before they held the versions
+
+        :param module_names: The module names, by default every module with
+            versions or a summary
+        :param workers: The number of modules refreshed concurrently
+        :return: The number of summaries rebuilt
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        from .db import BATCH_WRITE_SIZE, chunks
+
+        if module_names is None:
+            scan = self.scan(attributes=["module_name"])
+            module_names = {m.module_name for m in scan}.union(self.summary_names())
+        module_names = sorted(set(module_names), key=str)
+        batches = chunks(module_names, BATCH_WRITE_SIZE)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for _ in executor.map(self.refresh_summaries, batches):
+                pass
+        return len(module_names)
+
+    @abstractmethod
+    def catalog_generation(self) -> Optional[str]:
+        """Return the generation of the catalog snapshot, or None if there is none"""
+
+    @abstractmethod
+    def set_catalog_generation(
+        self, generation: str, replacing: Optional[str] = None
+    ) -> bool:
+        """
+        Set the generation of the catalog snapshot, c.f. `chalicelib.catalog`
+
+        Generations are ordered as strings, a generation older than the current one
+        is not set.
+
+        :param generation: The new generation
+        :param replacing: Only set the generation if the current one is this one,
+            e.g. because the new snapshot was derived from its snapshot
+        :return: False if the current generation is newer, or is not `replacing`
+        """
+
+
+def open_repository(backend: str = ZTR_BACKEND) -> ModuleRepository:
+    """
+    Open the repository of a backend
+
+    :param backend: `dynamodb`, or `sqlite` for the database at ZTR_SQLITE_PATH
+    """
+    if backend == "dynamodb":
+        from .dynamodb import DynamoDBRepository
+
+        return DynamoDBRepository()
+    if backend == "sqlite":
+        from .sqlite import SQLiteRepository
+
+        return SQLiteRepository(ZTR_SQLITE_PATH)
+    raise ValueError(f"{backend} is not a supported backend")
+
+
+_repository: Optional[ModuleRepository] = None
+_repository_lock = Lock()
+
+
+def get_repository() -> ModuleRepository:
+    """Return the repository of the configured backend, c.f. ZTR_BACKEND"""
+    global _repository
+    if _repository is None:
+        with _repository_lock:
+            if _repository is None:
+                _repository = open_repository()
+    return _repository
+
+
+def set_repository(repository: Optional[ModuleRepository]) -> None:
+    """
+    Replace the repository returned by `get_repository`
+
+    :param repository: The repository, or None to open the configured one again
+    """
+    global _repository
+    with _repository_lock:
+        _repository = repository
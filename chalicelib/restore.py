@@ -0,0 +1,295 @@
+#  Copyright (c) 2020 Zero A.E., LLC
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import json
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from threading import BoundedSemaphore, Lock
+from time import monotonic, sleep
+from typing import Callable, List, Optional, Set
+
+from .backup import read_backup, sha256, verify_backup
+from .db import BATCH_WRITE_SIZE, chunks, db_batch_write
+from .models import ModuleModel
+
+# The write rate used for on-demand tables, which do not report a capacity
+_ON_DEMAND_RATE = 100.0
+
+_EPSILON = 1e-6
+_MIN_SLEEP = 0.001
+
+
+class AdaptiveRateLimiter(object):
+    """
+    A thread-safe token bucket whose rate adapts to throttling (AIMD)
+
+    The bucket holds at most one second worth of tokens. Every throttled request
+    halves the rate, and every successful one increases it by `increase`, up to
+    `max_rate`, so the rate converges on the capacity the table really has.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        max_rate: Optional[float] = None,
+        min_rate: float = 1.0,
+        increase: Optional[float] = None,
+        clock: Callable[[], float] = monotonic,
+        sleep_: Callable[[float], None] = sleep,
+    ):
+        """
+        :param rate: The initial rate, in tokens per second
+        :param max_rate: The maximum rate, unbounded by default
+        :param min_rate: The minimum rate
+        :param increase: The rate increase after a success, a tenth of rate by default
+        :param clock: Returns the current time in seconds
+        :param sleep_: Sleeps for the given number of seconds
+        """
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.rate = self._bound(rate)
+        self.increase = increase if increase is not None else max(rate / 10, 1.0)
+        self._clock = clock
+        self._sleep = sleep_
+        self._lock = Lock()
+        self._tokens = self.rate
+        self._updated_at = clock()
+
+    def _bound(self, rate: float) -> float:
+        if self.max_rate is not None:
+            rate = min(rate, self.max_rate)
+        return max(rate, self.min_rate)
+
+    def _refill(self) -> None:
+        now = self._clock()
+        refill = (now - self._updated_at) * self.rate
+        self._tokens = min(self.rate, self._tokens + refill)
+        self._updated_at = now
+
+    def acquire(self, tokens: float = 1) -> None:
+        """
+        Block until tokens are available.
+
+        Requests larger than the bucket are let through once it is full, leaving
+        it in debt.
+
+        :param tokens: The number of tokens to take
+        """
+        while True:
+            with self._lock:
+                self._refill()
+                needed = min(tokens, self.rate)
+                # Tolerate the rounding errors of the refills, which would otherwise
+                # keep the wait below the resolution of the clock forever
+                if self._tokens >= needed - _EPSILON:
+                    self._tokens -= tokens
+                    return
+                wait = max((needed - self._tokens) / self.rate, _MIN_SLEEP)
+            self._sleep(wait)
+
+    def throttled(self) -> None:
+        """Halve the rate, after the backend throttled a request"""
+        with self._lock:
+            self.rate = self._bound(self.rate / 2)
+            self._tokens = min(self._tokens, self.rate)
+
+    def succeeded(self) -> None:
+        """Increase the rate, after the backend accepted a request"""
+        with self._lock:
+            self.rate = self._bound(self.rate + self.increase)
+
+
+def table_write_rate(model) -> float:
+    """
+    Return the provisioned write capacity of a table, in items (up to 1KB) per second
+
+    :param model: The model of the table
+    """
+    throughput = model.describe_table().get("ProvisionedThroughput", {})
+    return float(throughput.get("WriteCapacityUnits") or _ON_DEMAND_RATE)
+
+
+def checkpoint_filename(filename: str) -> str:
+    """Return the name of the restore checkpoint of a backup file"""
+    return f"{filename}.checkpoint.json"
+
+
+class Checkpoint(object):
+    """
+    The number of leading batches of a backup that were restored
+
+    Batches complete out of order, so only the contiguous prefix of completed
+    batches is recorded. Restoring is idempotent, the batches completed after the
+    prefix are simply written again when resuming.
+    """
+
+    def __init__(self, filename: str, backup_sha256: str, interval: float = 1.0):
+        """
+        A checkpoint written for another backup (e.g. a new backup written to the
+        same file), or with another batch size, is ignored.
+
+        :param filename: The checkpoint file
+        :param backup_sha256: The checksum of the backup file being restored
+        :param interval: The minimum number of seconds between two saves
+        """
+        self.filename = filename
+        self.backup_sha256 = backup_sha256
+        self.interval = interval
+        self._lock = Lock()
+        self._completed: Set[int] = set()
+        self._saved_at = 0.0
+        self.batches = 0
+        try:
+            with open(filename) as f:
+                saved = json.load(f)
+        except FileNotFoundError:
+            return
+        if (
+            saved.get("backup_sha256") == backup_sha256
+            and saved.get("batch_size") == BATCH_WRITE_SIZE
+        ):
+            self.batches = saved["batches"]
+
+    def complete(self, batch: int) -> None:
+        """
+        Record that a batch was restored
+
+        :param batch: The batch number, counted from the start of the backup
+        """
+        with self._lock:
+            self._completed.add(batch)
+            while self.batches in self._completed:
+                self._completed.remove(self.batches)
+                self.batches += 1
+            if monotonic() - self._saved_at >= self.interval:
+                self._save()
+
+    def _save(self) -> None:
+        tmp = f"{self.filename}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(
+                {
+                    "backup_sha256": self.backup_sha256,
+                    "batches": self.batches,
+                    "batch_size": BATCH_WRITE_SIZE,
+                },
+                f,
+            )
+        os.replace(tmp, self.filename)
+        self._saved_at = monotonic()
+
+    def save(self) -> None:
+        """Save the checkpoint now"""
+        with self._lock:
+            self._save()
+
+    def remove(self) -> None:
+        """Remove the checkpoint file, once the restore is complete"""
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+
+
+@dataclass
+class RestoreReport(object):
+    """
+    The outcome of a restore
+    """
+
+    restored: int = 0
+    skipped: int = 0
+    elapsed: float = 0.0
+    final_rate: float = 0.0
+
+    def __str__(self) -> str:
+        return (
+            f"Restored {self.restored} records in {self.elapsed:.2f}s, "
+            f"skipped {self.skipped} already restored records, "
+            f"final write rate {self.final_rate:.1f}/s"
+        )
+
+
+def restore(
+    filename: str,
+    workers: int = 4,
+    max_rate: Optional[float] = None,
+    resume: bool = True,
+    model=ModuleModel,
+) -> RestoreReport:
+    """
+    Restore a backup with concurrent BatchWriteItem requests
+
+    The backup is streamed, at most `2 * workers` batches are held in memory, and
+    the requests are paced by an `AdaptiveRateLimiter` that starts at the table's
+    provisioned write capacity. The restore can be resumed from its checkpoint
+    after an interruption.
+
+    :param filename: The backup file, c.f. `chalicelib.backup`
+    :param workers: The number of concurrent BatchWriteItem requests
+    :param max_rate: The maximum number of items written per second
+    :param resume: Skip the batches recorded in the checkpoint of a previous restore
+    :param model: The model whose table is restored
+    """
+    manifest = verify_backup(filename)
+    started = monotonic()
+
+    backup_sha256 = manifest["sha256"] if manifest else sha256(filename)
+    checkpoint = Checkpoint(checkpoint_filename(filename), backup_sha256)
+    if not resume:
+        checkpoint.batches = 0
+    limiter = AdaptiveRateLimiter(table_write_rate(model), max_rate=max_rate)
+    report = RestoreReport()
+
+    def remaining():
+        for number, item in enumerate(read_backup(filename, model)):
+            if number < checkpoint.batches * BATCH_WRITE_SIZE:
+                report.skipped += 1
+                continue
+            yield model.from_raw_data(item).serialize()
+
+    in_flight = BoundedSemaphore(2 * workers)
+    errors: List[BaseException] = []
+    lock = Lock()
+
+    def write(batch: List) -> int:
+        return db_batch_write(model, batch, max_attempts=16, limiter=limiter)
+
+    def done(batch_number: int, future: Future) -> None:
+        in_flight.release()
+        if future.exception() is not None:
+            errors.append(future.exception())
+            return
+        with lock:
+            report.restored += future.result()
+        checkpoint.complete(batch_number)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for batch_number, batch in enumerate(
+            chunks(remaining(), BATCH_WRITE_SIZE), start=checkpoint.batches
+        ):
+            in_flight.acquire()
+            if errors:
+                in_flight.release()
+                break
+            future = executor.submit(write, batch)
+            future.add_done_callback(lambda f, n=batch_number: done(n, f))
+
+    if errors:
+        checkpoint.save()
+        raise errors[0]
+
+    checkpoint.remove()
+    report.elapsed = monotonic() - started
+    report.final_rate = limiter.rate
+    return report
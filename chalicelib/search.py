@@ -0,0 +1,326 @@
+#  Copyright (c) 2020 Zero A.E., LLC
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import re
+from bisect import bisect_left, bisect_right, insort
+from datetime import datetime, timedelta, timezone
+from heapq import nsmallest
+from threading import Lock, RLock
+from time import monotonic
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from .config import ZTR_SEARCH_REBUILD_SECONDS, ZTR_SEARCH_REFRESH_SECONDS
+from .versions import version_order
+
+# The index also serves the SQLite backend, only the DynamoDB loader needs the models
+if TYPE_CHECKING:  # pragma: no cover
+    from .models import ModuleModel
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_FILTER_FIELDS = ("namespace", "provider")
+_SEARCH_ATTRIBUTES = [
+    "module_name",
+    "version",
+    "verified",
+    "owner",
+    "description",
+    "source",
+    "published_at",
+    "downloads",
+    "updated_at",
+]
+
+# Global secondary indexes are eventually consistent, so refreshes look back this
+# far before the last write they saw. Re-indexing a version is harmless.
+_INDEX_LAG = timedelta(minutes=1)
+
+
+def tokenize(text: Optional[str]) -> Set[str]:
+    """
+    Split text into the lower-case alphanumeric tokens used by the index
+
+    :param text: The text to tokenize, None is treated as empty
+    """
+    return set(_TOKEN_RE.findall(text.lower())) if text else set()
+
+
+def _newer(module: "ModuleModel", other: Optional["ModuleModel"]) -> bool:
+    """Return True if module is the same or a more recent semantic version than other"""
+    if other is None:
+        return True
+    return version_order(module.version) >= version_order(other.version)
+
+
+def _load(since: Optional[datetime] = None) -> Iterable["ModuleModel"]:
+    """
+    Read the module versions to index, projecting only the attributes it needs
+
+    :param since: If set, only return the versions written after this timestamp,
+                  read from the `updated_day-index` one day at a time, instead of
+                  scanning the whole table. Rolling up the download counts also
+                  writes the timestamp, so refreshes pick up the new counts.
+    """
+    from .models import UPDATED_DAY_FORMAT, ModuleModel
+
+    if since is None:
+        yield from ModuleModel.scan(attributes_to_get=_SEARCH_ATTRIBUTES)
+        return
+
+    since = since - _INDEX_LAG
+    day = since.date()
+    while day <= datetime.now(timezone.utc).date():
+        yield from ModuleModel.changes_index.query(
+            day.strftime(UPDATED_DAY_FORMAT),
+            range_key_condition=ModuleModel.updated_at > since,
+            attributes_to_get=_SEARCH_ATTRIBUTES,
+        )
+        day += timedelta(days=1)
+
+
+class SearchIndex(object):
+    """
+    An in-memory inverted index of the latest version of every module
+
+    Documents are keyed by the module's FQMN, and hold the metadata of its most
+    recent version. Tokens from the namespace, name, provider and description
+    point to the documents that contain them, and the namespace, provider and
+    verified filters have postings of their own, so a query only touches the
+    documents that match it.
+    """
+
+    def __init__(self, loader: Callable[..., Iterable["ModuleModel"]] = _load):
+        """
+        :param loader: Returns the modules to index, optionally only those written
+                       after the given timestamp
+        """
+        self._loader = loader
+        self._lock = RLock()
+        self._update_lock = Lock()
+        self._clear()
+        self._built_at: Optional[float] = None
+        self._refreshed_at: Optional[float] = None
+
+    def _clear(self) -> None:
+        self._docs: Dict[str, "ModuleModel"] = {}
+        self._ids: List[str] = []
+        self._tokens: Dict[str, Set[str]] = {}
+        self._fields: Dict[str, Dict[str, Set[str]]] = {f: {} for f in _FILTER_FIELDS}
+        self._verified: Set[str] = set()
+        self._high_water_mark: Optional[datetime] = None
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    @staticmethod
+    def _terms(module: "ModuleModel") -> Set[str]:
+        fqmn = module.module_name
+        return (
+            tokenize(fqmn.namespace)
+            | tokenize(fqmn.name)
+            | tokenize(fqmn.provider)
+            | tokenize(module.description)
+        )
+
+    def add(self, module: "ModuleModel") -> None:
+        """
+        Add a module version to the index, replacing the indexed version of the
+        same module unless it is older.
+
+        :param module: The module version to index
+        """
+        doc_id = str(module.module_name)
+        with self._lock:
+            if module.updated_at is not None and (
+                self._high_water_mark is None
+                or module.updated_at > self._high_water_mark
+            ):
+                self._high_water_mark = module.updated_at
+
+            current = self._docs.get(doc_id)
+            if not _newer(module, current):
+                return
+            if current is not None:
+                self._unlink(doc_id, current)
+            else:
+                insort(self._ids, doc_id)
+
+            self._docs[doc_id] = module
+            for term in self._terms(module):
+                self._tokens.setdefault(term, set()).add(doc_id)
+            for field in _FILTER_FIELDS:
+                value = getattr(module.module_name, field)
+                self._fields[field].setdefault(value, set()).add(doc_id)
+            if module.verified:
+                self._verified.add(doc_id)
+
+    def remove(self, doc_id: str) -> None:
+        """
+        Remove a module (all of its versions) from the index
+
+        :param doc_id: The module FQMN
+        """
+        with self._lock:
+            current = self._docs.pop(doc_id, None)
+            if current is None:
+                return
+            self._unlink(doc_id, current)
+            del self._ids[bisect_left(self._ids, doc_id)]
+
+    def _unlink(self, doc_id: str, module: "ModuleModel") -> None:
+        for term in self._terms(module):
+            postings = self._tokens.get(term)
+            postings.discard(doc_id)
+            if not postings:
+                del self._tokens[term]
+        for field in _FILTER_FIELDS:
+            value = getattr(module.module_name, field)
+            postings = self._fields[field][value]
+            postings.discard(doc_id)
+            if not postings:
+                del self._fields[field][value]
+        self._verified.discard(doc_id)
+
+    def build(self) -> None:
+        """(Re)build the whole index from the backend"""
+        started_at = datetime.now(timezone.utc)
+        modules = list(self._loader())
+        with self._lock:
+            self._clear()
+            for module in modules:
+                self.add(module)
+            if self._high_water_mark is None:
+                self._high_water_mark = started_at
+            self._built_at = self._refreshed_at = monotonic()
+
+    def refresh(self) -> None:
+        """Add the module versions written since the last build or refresh"""
+        modules = list(self._loader(since=self._high_water_mark))
+        with self._lock:
+            for module in modules:
+                self.add(module)
+            self._refreshed_at = monotonic()
+
+    def ensure_fresh(self) -> None:
+        """
+        Build the index on first use, and keep it up to date afterwards.
+
+        New and updated versions are picked up incrementally every
+        ZTR_SEARCH_REFRESH_SECONDS. Deleted versions are only dropped by the full
+        rebuild, which happens every ZTR_SEARCH_REBUILD_SECONDS.
+
+        Only the first build blocks, concurrent callers keep searching the current
+        index while another thread refreshes it.
+        """
+        if self._built_at is None:
+            with self._update_lock:
+                if self._built_at is None:
+                    self.build()
+            return
+
+        if not self._update_lock.acquire(blocking=False):
+            return
+        try:
+            now = monotonic()
+            if now - self._built_at >= ZTR_SEARCH_REBUILD_SECONDS:
+                self.build()
+            elif now - self._refreshed_at >= ZTR_SEARCH_REFRESH_SECONDS:
+                self.refresh()
+        finally:
+            self._update_lock.release()
+
+    def search(
+        self,
+        q: str,
+        offset: int = 0,
+        limit: int = 15,
+        provider: Optional[str] = None,
+        verified: Optional[bool] = None,
+        namespace: Optional[str] = None,
+        after: Optional[str] = None,
+    ) -> Tuple[List["ModuleModel"], int]:
+        """
+        Search the index
+
+        :param q: The query string, every token must match. `*` matches all modules.
+        :param offset: The number of results to skip
+        :param limit: The maximum number of results to return
+        :param provider: Only return modules for this provider
+        :param verified: Only return modules with this verified status
+        :param namespace: Only return modules in this namespace
+        :param after: Only return modules after this FQMN, instead of skipping offset
+        :return: The page of matching modules, and the total number of matches
+        """
+        with self._lock:
+            candidates: List[Set[str]] = []
+            for term in tokenize(q if q != "*" else None):
+                candidates.append(self._tokens.get(term, set()))
+            for field, value in (("namespace", namespace), ("provider", provider)):
+                if value is not None:
+                    candidates.append(self._fields[field].get(value, set()))
+
+            if not candidates and verified is None:
+                total = len(self._ids)
+                if after is not None:
+                    offset = bisect_right(self._ids, after)
+                page = self._ids[offset : offset + limit]
+            else:
+                matches = self._intersect(candidates, verified)
+                total = len(matches)
+                if after is not None:
+                    page = nsmallest(limit, (m for m in matches if m > after))
+                else:
+                    page = nsmallest(offset + limit, matches)[offset:]
+
+            return [self._docs[doc_id] for doc_id in page], total
+
+    def _intersect(self, candidates: List[Set[str]], verified: Optional[bool]) -> Set[str]:
+        if verified is True:
+            candidates = candidates + [self._verified]
+        candidates = sorted(candidates, key=len)
+        matches = set(candidates[0]) if candidates else set(self._docs)
+        for postings in candidates[1:]:
+            matches.intersection_update(postings)
+            if not matches:
+                break
+        if verified is False:
+            matches.difference_update(self._verified)
+        return matches
+
+
+def to_json(module: "ModuleModel") -> Dict:
+    """
+    Render a module version as a Registry API module object
+
+    :param module: The module version
+    """
+    fqmn = module.module_name
+    published_at = module.published_at
+    if published_at is not None:
+        published_at = published_at.astimezone(timezone.utc).isoformat()
+    return {
+        "id": f"{fqmn}/{module.version}",
+        "owner": module.owner or "",
+        "namespace": fqmn.namespace,
+        "name": fqmn.name,
+        "version": module.version,
+        "provider": fqmn.provider,
+        "description": module.description or "",
+        "source": module.source or "",
+        "published_at": published_at,
+        "downloads": module.downloads or 0,
+        "verified": bool(module.verified),
+    }
+
+
+index = SearchIndex()
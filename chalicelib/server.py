@@ -0,0 +1,187 @@
+#  Copyright (c) 2020 Zero A.E., LLC
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import base64
+import json
+import os
+from http import HTTPStatus
+from threading import local
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import quote
+
+from chalice import Chalice
+
+StartResponse = Callable[[str, List[Tuple[str, str]]], Any]
+
+
+class ThreadLocalChalice(Chalice):
+    """
+    A Chalice app serving one request per thread, e.g. under a threaded WSGI server
+
+    Chalice keeps the request being served (and its Lambda context) on the app,
+    where concurrent requests would overwrite each other. They are thread-local
+    here, which changes nothing on Lambda.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._local = local()
+        super().__init__(*args, **kwargs)
+
+    @property
+    def current_request(self):
+        return getattr(self._local, "current_request", None)
+
+    @current_request.setter
+    def current_request(self, request) -> None:
+        self._local.current_request = request
+
+    @property
+    def lambda_context(self):
+        return getattr(self._local, "lambda_context", None)
+
+    @lambda_context.setter
+    def lambda_context(self, context) -> None:
+        self._local.lambda_context = context
+
+
+def apply_chalice_stage(stage: str, project_dir: str = ".") -> None:
+    """
+    Set the environment variables of a Chalice stage, as `chalice local` does
+
+    The variables already set in the environment are kept. Must be called before
+    `chalicelib.config` is imported.
+
+    :param stage: The stage name, e.g. local
+    :param project_dir: The Chalice project directory
+    """
+    with open(os.path.join(project_dir, ".chalice", "config.json")) as f:
+        config = json.load(f)
+    variables = {
+        **config.get("environment_variables", {}),
+        **config["stages"][stage].get("environment_variables", {}),
+    }
+    for name, value in variables.items():
+        os.environ.setdefault(name, value)
+
+
+def _status(code: int) -> str:
+    try:
+        return f"{code} {HTTPStatus(code).phrase}"
+    except ValueError:
+        return str(code)
+
+
+class WSGIApplication(object):
+    """
+    Serve a Chalice app to a WSGI server, e.g. gunicorn
+
+    The requests are turned into API Gateway proxy events by Chalice's local
+    gateway, like `chalice local` does, but the server is free to serve them
+    from many processes and threads. The app must be a `ThreadLocalChalice`
+    when the server uses threads.
+    """
+
+    def __init__(self, app: Chalice, stage: str = "local"):
+        """
+        :param app: The Chalice app
+        :param stage: The Chalice stage, for the API Gateway stage variables
+        """
+        from chalice.config import Config
+        from chalice.local import LocalGateway
+
+        self.app = app
+        self.gateway = LocalGateway(app, Config(chalice_stage=stage))
+
+    @staticmethod
+    def _headers(environ: Dict[str, Any]) -> Dict[str, str]:
+        headers = {
+            key[5:].replace("_", "-").lower(): value
+            for key, value in environ.items()
+            if key.startswith("HTTP_")
+        }
+        for key in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            if environ.get(key):
+                headers[key.replace("_", "-").lower()] = environ[key]
+        return headers
+
+    @staticmethod
+    def _path(environ: Dict[str, Any]) -> str:
+        # PEP 3333 decodes the path as latin-1, the gateway expects it quoted
+        path = environ.get("PATH_INFO", "/").encode("latin-1").decode("utf-8")
+        path = quote(path, safe="/:@!$&'()*+,;=-._~%")
+        query = environ.get("QUERY_STRING")
+        return f"{path}?{query}" if query else path
+
+    @staticmethod
+    def _body(environ: Dict[str, Any]) -> Optional[bytes]:
+        try:
+            length = int(environ.get("CONTENT_LENGTH") or 0)
+        except ValueError:
+            length = 0
+        return environ["wsgi.input"].read(length) if length > 0 else None
+
+    def __call__(self, environ: Dict[str, Any], start_response: StartResponse):
+        from chalice.local import LocalGatewayException
+
+        try:
+            response = self.gateway.handle_request(
+                method=environ["REQUEST_METHOD"],
+                path=self._path(environ),
+                headers=self._headers(environ),
+                body=self._body(environ),
+            )
+        except LocalGatewayException as e:
+            start_response(_status(e.CODE), list(e.headers.items()))
+            return [e.body or b""]
+
+        body = response.get("body") or b""
+        # The local gateway already decodes the base64 encoded bodies to bytes
+        if isinstance(body, str):
+            if response.get("isBase64Encoded"):
+                body = base64.b64decode(body)
+            else:
+                body = body.encode("utf-8")
+
+        headers: List[Tuple[str, str]] = list(response.get("headers", {}).items())
+        for name, values in (response.get("multiValueHeaders") or {}).items():
+            headers.extend((name, value) for value in values)
+        start_response(_status(response["statusCode"]), headers)
+        return [body]
+
+
+def warm_up(models: Iterable = None) -> None:
+    """
+    Open new backend connections, e.g. in a forked worker
+
+    The connections (and their connection pools) inherited from the parent are
+    dropped, and the botocore clients of the models are created before the
+    worker serves requests from many threads, as creating them is not
+    thread-safe.
+
+    :param models: The PynamoDB models, those of `chalicelib.models` by default
+    """
+    from .config import ZTR_BACKEND
+
+    if ZTR_BACKEND != "dynamodb":
+        return
+
+    if models is None:
+        from .models import DownloadCounterModel, ModuleModel, ModuleSummaryModel
+
+        models = (ModuleModel, DownloadCounterModel, ModuleSummaryModel)
+
+    for model in models:
+        model._connection = None
+        # noinspection PyStatementEffect
+        model._get_connection().connection.client
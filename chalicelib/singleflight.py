@@ -0,0 +1,165 @@
+#  Copyright (c) 2020 Zero A.E., LLC
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+from threading import Event, Lock
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+from .config import ZTR_SINGLEFLIGHT_TIMEOUT_SECONDS
+
+# key -> call
+_Calls = Dict[Hashable, "_Call"]
+
+
+class FlightTimeout(TimeoutError):
+    """A caller gave up waiting for the call in flight for the same key"""
+
+
+class _Call(object):
+    """A call in flight, and its outcome once done"""
+
+    def __init__(self):
+        self.done = Event()
+        self.value: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight(object):
+    """
+    Coalesces concurrent identical calls, e.g. backend lookups of the same module
+
+    The first caller of a key makes the call, and the callers of the same key
+    that arrive while it is in flight wait for it and share its outcome, its
+    value or its exception. The key is forgotten as soon as the call is done, so
+    results are only shared by concurrent callers, caching them is up to the
+    caller, c.f. `TTLCache`.
+    """
+
+    def __init__(self, timeout: float = ZTR_SINGLEFLIGHT_TIMEOUT_SECONDS):
+        """
+        :param timeout: The number of seconds callers wait for a call in flight
+        """
+        self.timeout = timeout
+        self._lock = Lock()
+        self._calls: _Calls = {}
+        self.calls = 0
+        self.collapsed = 0
+        self.errors = 0
+        self.timeouts = 0
+
+    def _join(self, keys: Iterable[Hashable]) -> Tuple[_Calls, _Calls]:
+        """
+        Start a call for each key that has none in flight
+
+        :return: The calls started, and the calls in flight that were joined
+        """
+        started, joined = {}, {}
+        with self._lock:
+            for key in dict.fromkeys(keys):
+                call = self._calls.get(key)
+                if call is None:
+                    started[key] = self._calls[key] = _Call()
+                    self.calls += 1
+                else:
+                    joined[key] = call
+                    self.collapsed += 1
+        return started, joined
+
+    def _land(self, calls: _Calls, error: Optional[BaseException] = None) -> None:
+        """Forget the calls, and release their waiters"""
+        with self._lock:
+            if error is not None:
+                self.errors += 1
+            for key, call in calls.items():
+                call.error = error
+                del self._calls[key]
+        for call in calls.values():
+            call.done.set()
+
+    def _wait(self, key: Hashable, call: _Call, timeout: Optional[float]) -> Any:
+        if not call.done.wait(self.timeout if timeout is None else timeout):
+            with self._lock:
+                self.timeouts += 1
+            raise FlightTimeout(f"Timed out waiting for the call in flight for {key}")
+        if call.error is not None:
+            raise call.error
+        return call.value
+
+    def do(
+        self, key: Hashable, fn: Callable[[], Any], timeout: Optional[float] = None
+    ) -> Any:
+        """
+        Return the value of fn, or of the call in flight for the same key
+
+        :param key: The call key, e.g. (operation, module name, version)
+        :param fn: Makes the call
+        :param timeout: The number of seconds to wait for a call in flight, the
+            timeout of the group by default
+        :raises FlightTimeout: If the call in flight did not return in time
+        """
+        started, joined = self._join([key])
+        if joined:
+            return self._wait(key, joined[key], timeout)
+
+        call = started[key]
+        try:
+            call.value = fn()
+        except BaseException as e:
+            self._land(started, e)
+            raise
+        self._land(started)
+        return call.value
+
+    def do_many(
+        self,
+        keys: Iterable[Hashable],
+        fn: Callable[[List[Hashable]], Dict[Hashable, Any]],
+        timeout: Optional[float] = None,
+    ) -> Dict[Hashable, Any]:
+        """
+        Return the values of many keys, making one call for the keys that have no
+        call in flight, and waiting for the others
+
+        :param keys: The call keys
+        :param fn: Makes the call for a list of keys, returns the values by key,
+            leaving out the keys that have none
+        :param timeout: The number of seconds to wait for the calls in flight, the
+            timeout of the group by default
+        :return: The value of every key, None for those that have none
+        :raises FlightTimeout: If a call in flight did not return in time
+        """
+        started, joined = self._join(keys)
+        values: Dict[Hashable, Any] = {}
+        if started:
+            try:
+                loaded = fn(list(started))
+            except BaseException as e:
+                self._land(started, e)
+                raise
+            for key, call in started.items():
+                values[key] = call.value = loaded.get(key)
+            self._land(started)
+
+        for key, call in joined.items():
+            values[key] = self._wait(key, call, timeout)
+        return values
+
+    def stats(self) -> Dict[str, int]:
+        """Return the call, collapsed call, error and timeout counters"""
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "collapsed": self.collapsed,
+                "errors": self.errors,
+                "timeouts": self.timeouts,
+            }
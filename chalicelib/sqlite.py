@@ -0,0 +1,517 @@
+#  Copyright (c) 2020 Zero A.E., LLC
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import json
+import sqlite3
+from datetime import datetime, timezone
+from threading import local
+from typing import Iterable, Iterator, List, Optional, Tuple
+from uuid import uuid4
+
+from .config import ZTR_LIMIT
+from .db import BATCH_GET_SIZE, BATCH_WRITE_SIZE, chunks
+from .models import ModuleModel, ModuleName, ModuleSummaryModel
+from .repository import ModuleRepository
+from .search import tokenize
+from .versions import version_key
+
+# The modules table is keyed and indexed like the DynamoDB table: by module name
+# and version, and by module name and sortable version key. The summaries hold
+# the latest version (c.f. `latest_versions`), the change stamp and the summary
+# (c.f. `ModuleSummaryModel`) of every module, and the full-text index the latest
+# version of every module, keyed by the rowid of its summary. The catalog holds
+# the generation of the catalog snapshot, c.f. `chalicelib.catalog`.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS modules (
+    namespace TEXT NOT NULL,
+    name TEXT NOT NULL,
+    provider TEXT NOT NULL,
+    version TEXT NOT NULL,
+    version_key TEXT,
+    getter_url TEXT NOT NULL,
+    verified INTEGER,
+    owner TEXT,
+    description TEXT,
+    source TEXT,
+    published_at TEXT,
+    downloads INTEGER NOT NULL DEFAULT 0,
+    updated_at TEXT,
+    mirror_url TEXT,
+    archive_sha256 TEXT,
+    PRIMARY KEY (namespace, name, provider, version)
+);
+CREATE INDEX IF NOT EXISTS modules_version_key
+    ON modules (namespace, name, provider, version_key);
+
+CREATE TABLE IF NOT EXISTS module_summaries (
+    id INTEGER PRIMARY KEY,
+    module_name TEXT NOT NULL UNIQUE,
+    namespace TEXT NOT NULL,
+    name TEXT NOT NULL,
+    provider TEXT NOT NULL,
+    latest_version TEXT,
+    stamp TEXT,
+    versions TEXT,
+    latest_stable TEXT,
+    downloads INTEGER,
+    published_at TEXT
+);
+CREATE INDEX IF NOT EXISTS module_summaries_namespace
+    ON module_summaries (namespace, module_name);
+CREATE INDEX IF NOT EXISTS module_summaries_namespace_name
+    ON module_summaries (namespace, name, module_name);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS module_search
+    USING fts5(namespace, name, provider, description);
+
+CREATE TABLE IF NOT EXISTS catalog (
+    name TEXT PRIMARY KEY,
+    generation TEXT NOT NULL
+);
+"""
+
+_DROP = """
+DROP TABLE IF EXISTS catalog;
+DROP TABLE IF EXISTS module_search;
+DROP TABLE IF EXISTS module_summaries;
+DROP TABLE IF EXISTS modules;
+"""
+
+_COLUMNS = (
+    "namespace, name, provider, version, version_key, getter_url, verified, "
+    "owner, description, source, published_at, downloads, updated_at, "
+    "mirror_url, archive_sha256"
+)
+
+# The columns added since the first schema, by table, by databases created before
+_ADDED_COLUMNS = {
+    "modules": {"mirror_url": "TEXT", "archive_sha256": "TEXT"},
+    "module_summaries": {
+        "versions": "TEXT",
+        "latest_stable": "TEXT",
+        "downloads": "INTEGER",
+        "published_at": "TEXT",
+    },
+}
+
+_KEY = "namespace = ? AND name = ? AND provider = ?"
+
+# The latest version of each module, with the summaries as `s` and the modules as `m`
+_LATEST = (
+    f"SELECT {', '.join('m.' + c for c in _COLUMNS.split(', '))} "
+    "FROM module_summaries s JOIN modules m ON m.namespace = s.namespace "
+    "AND m.name = s.name AND m.provider = s.provider AND m.version = s.latest_version"
+)
+
+
+def _datetime(value: Optional[datetime]) -> Optional[str]:
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        # PynamoDB's UTCDateTimeAttribute defaults are naive UTC datetimes
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc).isoformat()
+
+
+def _row(module: ModuleModel, updated_at: datetime) -> Tuple:
+    fqmn = module.module_name
+    verified = None if module.verified is None else int(module.verified)
+    return (
+        fqmn.namespace,
+        fqmn.name,
+        fqmn.provider,
+        module.version,
+        version_key(module.version),
+        module.getter_url,
+        verified,
+        module.owner,
+        module.description,
+        module.source,
+        _datetime(module.published_at),
+        module.downloads or 0,
+        _datetime(updated_at),
+        module.mirror_url,
+        module.archive_sha256,
+    )
+
+
+def _module(row: sqlite3.Row) -> ModuleModel:
+    def parse(value: Optional[str]) -> Optional[datetime]:
+        return datetime.fromisoformat(value) if value is not None else None
+
+    verified = row["verified"]
+    return ModuleModel(
+        ModuleName(row["namespace"], row["name"], row["provider"]),
+        row["version"],
+        version_key=row["version_key"],
+        getter_url=row["getter_url"],
+        verified=None if verified is None else bool(verified),
+        owner=row["owner"],
+        description=row["description"],
+        source=row["source"],
+        published_at=parse(row["published_at"]),
+        downloads=row["downloads"],
+        updated_at=parse(row["updated_at"]),
+        mirror_url=row["mirror_url"],
+        archive_sha256=row["archive_sha256"],
+    )
+
+
+def _key(module_name: ModuleName) -> Tuple[str, str, str]:
+    return module_name.namespace, module_name.name, module_name.provider
+
+
+class SQLiteRepository(ModuleRepository):
+    """
+    The module versions in an embedded SQLite database, for local and on-prem
+    deployments that do not want to run DynamoDB
+
+    Every lookup is an indexed, in-process query, and searches are served by an
+    FTS5 full-text index. Each thread has its own connection, the database is in
+    WAL mode so readers do not block the writer.
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: The database file, created if needed
+        """
+        self.path = path
+        self._local = local()
+
+    @property
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode = WAL")
+            self._local.connection = connection
+        return connection
+
+    def init(self) -> None:
+        with self._connection as connection:
+            connection.executescript(SCHEMA)
+            for table, columns in _ADDED_COLUMNS.items():
+                existing = {
+                    row["name"]
+                    for row in connection.execute(f"PRAGMA table_info({table})")
+                }
+                for column, column_type in columns.items():
+                    if column not in existing:
+                        connection.execute(
+                            f"ALTER TABLE {table} ADD COLUMN {column} {column_type}"
+                        )
+
+    def destroy(self) -> None:
+        with self._connection as connection:
+            connection.executescript(_DROP)
+
+    def get(
+        self, module_name: ModuleName, version: str, attributes: List[str] = None
+    ) -> Optional[ModuleModel]:
+        row = self._connection.execute(
+            f"SELECT {_COLUMNS} FROM modules WHERE {_KEY} AND version = ?",
+            (*_key(module_name), version),
+        ).fetchone()
+        return _module(row) if row is not None else None
+
+    def get_many(
+        self, keys: Iterable[Tuple[ModuleName, str]], attributes: List[str] = None
+    ) -> Iterator[ModuleModel]:
+        for batch in chunks(dict.fromkeys(keys), BATCH_GET_SIZE):
+            values = ", ".join(["(?, ?, ?, ?)"] * len(batch))
+            parameters = [p for m, version in batch for p in (*_key(m), version)]
+            rows = self._connection.execute(
+                f"SELECT {_COLUMNS} FROM modules "
+                f"WHERE (namespace, name, provider, version) IN (VALUES {values})",
+                parameters,
+            )
+            yield from (_module(row) for row in rows)
+
+    def module_versions(
+        self, module_name: ModuleName, attributes: List[str] = None
+    ) -> List[ModuleModel]:
+        rows = self._connection.execute(
+            f"SELECT {_COLUMNS} FROM modules WHERE {_KEY} "
+            "ORDER BY COALESCE(version_key, ''), version",
+            _key(module_name),
+        )
+        return [_module(row) for row in rows]
+
+    def latest(
+        self, module_name: ModuleName, attributes: List[str] = None
+    ) -> Optional[ModuleModel]:
+        row = self._connection.execute(
+            f"SELECT {_COLUMNS} FROM modules WHERE {_KEY} "
+            "AND version_key IS NOT NULL ORDER BY version_key DESC LIMIT 1",
+            _key(module_name),
+        ).fetchone()
+        return _module(row) if row is not None else None
+
+    def versions(self, module_name: ModuleName) -> Iterator[str]:
+        rows = self._connection.execute(
+            f"SELECT version FROM modules WHERE {_KEY} "
+            "AND version_key IS NOT NULL ORDER BY version_key",
+            _key(module_name),
+        )
+        return (row["version"] for row in rows)
+
+    def list_latest(
+        self,
+        namespace: str,
+        name: Optional[str] = None,
+        after: Optional[ModuleName] = None,
+        page_size: int = ZTR_LIMIT,
+    ) -> Iterator[ModuleModel]:
+        where, params = ["s.namespace = ?"], [namespace]
+        if name is not None:
+            where.append("s.name = ?")
+            params.append(name)
+        if after is not None:
+            where.append("s.module_name > ?")
+            params.append(str(after))
+        cursor = self._connection.execute(
+            f"{_LATEST} WHERE {' AND '.join(where)} ORDER BY s.module_name", params
+        )
+        while True:
+            rows = cursor.fetchmany(page_size)
+            if not rows:
+                return
+            yield from map(_module, rows)
+
+    def search(
+        self,
+        q: str,
+        offset: int = 0,
+        limit: int = 15,
+        provider: Optional[str] = None,
+        verified: Optional[bool] = None,
+        namespace: Optional[str] = None,
+        after: Optional[str] = None,
+    ) -> Tuple[List[ModuleModel], int]:
+        joins, where, params = "", [], []
+        tokens = tokenize(q if q != "*" else None)
+        if tokens:
+            joins = " JOIN module_search f ON f.rowid = s.id"
+            where.append("module_search MATCH ?")
+            # Every token must match, as a phrase so FTS5 operators are not parsed
+            params.append(" ".join(f'"{token}"' for token in sorted(tokens)))
+        for column, value in (("s.namespace", namespace), ("s.provider", provider)):
+            if value is not None:
+                where.append(f"{column} = ?")
+                params.append(value)
+        if verified is not None:
+            where.append("COALESCE(m.verified, 0) = ?")
+            params.append(int(verified))
+        condition = f" WHERE {' AND '.join(where)}" if where else ""
+
+        total = self._connection.execute(
+            f"SELECT COUNT(*) FROM ({_LATEST}{joins}{condition})", params
+        ).fetchone()[0]
+
+        if after is not None:
+            condition += " AND " if condition else " WHERE "
+            condition += "s.module_name > ?"
+            params.append(after)
+            offset = 0
+        rows = self._connection.execute(
+            f"{_LATEST}{joins}{condition} ORDER BY s.module_name LIMIT ? OFFSET ?",
+            (*params, limit, offset),
+        )
+        return [_module(row) for row in rows], total
+
+    def scan(self, attributes: List[str] = None) -> Iterator[ModuleModel]:
+        rows = self._connection.execute(f"SELECT {_COLUMNS} FROM modules")
+        return map(_module, rows)
+
+    def _refresh_summaries(
+        self, connection: sqlite3.Connection, module_names: Iterable[ModuleName]
+    ) -> None:
+        """Update the summary, and the full-text entry, of modules"""
+        for module_name in set(module_names):
+            modules = [
+                _module(row)
+                for row in connection.execute(
+                    f"SELECT {_COLUMNS} FROM modules WHERE {_KEY} "
+                    "ORDER BY COALESCE(version_key, ''), version",
+                    _key(module_name),
+                )
+            ]
+            latest = modules[-1] if modules else None
+            summary = ModuleSummaryModel.summarize(module_name, modules, uuid4().hex)
+            connection.execute(
+                "INSERT INTO module_summaries "
+                "(module_name, namespace, name, provider, latest_version, stamp, "
+                "versions, latest_stable, downloads, published_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (module_name) "
+                "DO UPDATE SET latest_version = excluded.latest_version, "
+                "stamp = excluded.stamp, versions = excluded.versions, "
+                "latest_stable = excluded.latest_stable, "
+                "downloads = excluded.downloads, published_at = excluded.published_at",
+                (
+                    str(module_name),
+                    *_key(module_name),
+                    latest.version if latest is not None else None,
+                    summary.stamp,
+                    json.dumps(summary.versions),
+                    summary.latest_stable,
+                    summary.downloads,
+                    _datetime(summary.published_at),
+                ),
+            )
+            (summary_id,) = connection.execute(
+                "SELECT id FROM module_summaries WHERE module_name = ?",
+                (str(module_name),),
+            ).fetchone()
+            connection.execute(
+                "DELETE FROM module_search WHERE rowid = ?", (summary_id,)
+            )
+            if latest is not None:
+                connection.execute(
+                    "INSERT INTO module_search "
+                    "(rowid, namespace, name, provider, description) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (summary_id, *_key(module_name), latest.description or ""),
+                )
+
+    def save(self, module: ModuleModel) -> None:
+        self.save_many([module])
+
+    def save_many(self, modules: Iterable[ModuleModel]) -> int:
+        saved = 0
+        for batch in chunks(modules, BATCH_WRITE_SIZE):
+            updated_at = datetime.now(timezone.utc)
+            with self._connection as connection:
+                connection.executemany(
+                    f"INSERT OR REPLACE INTO modules ({_COLUMNS}) "
+                    f"VALUES ({', '.join('?' * len(_COLUMNS.split(', ')))})",
+                    [_row(module, updated_at) for module in batch],
+                )
+                self._refresh_summaries(connection, (m.module_name for m in batch))
+            saved += len(batch)
+        return saved
+
+    def delete(self, module_name: ModuleName, version: str) -> bool:
+        with self._connection as connection:
+            deleted = connection.execute(
+                f"DELETE FROM modules WHERE {_KEY} AND version = ?",
+                (*_key(module_name), version),
+            ).rowcount
+            self._refresh_summaries(connection, [module_name])
+        return deleted > 0
+
+    def add_downloads(self, module_name: ModuleName, version: str, count: int) -> None:
+        with self._connection as connection:
+            updated = connection.execute(
+                f"UPDATE modules SET downloads = downloads + ? "
+                f"WHERE {_KEY} AND version = ?",
+                (count, *_key(module_name), version),
+            ).rowcount
+            if updated:
+                connection.execute(
+                    "UPDATE module_summaries SET downloads = downloads + ?, "
+                    "stamp = ? WHERE module_name = ?",
+                    (count, uuid4().hex, str(module_name)),
+                )
+
+    def rollup_downloads(self, keys: Iterable[Tuple[ModuleName, str]]) -> int:
+        # The counts are stored on the module versions and summaries, with a new
+        # stamp, as they are added: a local database has no hot items to spread
+        # the writes over
+        return sum(
+            self._connection.execute(
+                f"SELECT COUNT(*) FROM modules WHERE {_KEY} AND version = ?",
+                (*_key(module_name), version),
+            ).fetchone()[0]
+            for module_name, version in set(keys)
+        )
+
+    def downloads(self, module_name: ModuleName, version: str) -> int:
+        row = self._connection.execute(
+            f"SELECT downloads FROM modules WHERE {_KEY} AND version = ?",
+            (*_key(module_name), version),
+        ).fetchone()
+        return row["downloads"] if row is not None else 0
+
+    def stamp(self, module_name: ModuleName) -> Optional[str]:
+        row = self._connection.execute(
+            "SELECT stamp FROM module_summaries WHERE module_name = ?",
+            (str(module_name),),
+        ).fetchone()
+        return row["stamp"] if row is not None else None
+
+    def set_stamps(self, stamps: Iterable[Tuple[ModuleName, str]]) -> None:
+        with self._connection as connection:
+            connection.executemany(
+                "INSERT INTO module_summaries "
+                "(module_name, namespace, name, provider, stamp) "
+                "VALUES (?, ?, ?, ?, ?) ON CONFLICT (module_name) "
+                "DO UPDATE SET stamp = excluded.stamp",
+                [(str(m), *_key(m), stamp) for m, stamp in stamps],
+            )
+
+    def summary(self, module_name: ModuleName) -> Optional[ModuleSummaryModel]:
+        row = self._connection.execute(
+            "SELECT stamp, versions, latest_stable, downloads, published_at "
+            "FROM module_summaries WHERE module_name = ?",
+            (str(module_name),),
+        ).fetchone()
+        if row is None:
+            return None
+        published_at = row["published_at"]
+        return ModuleSummaryModel(
+            module_name,
+            stamp=row["stamp"],
+            versions=json.loads(row["versions"]) if row["versions"] else None,
+            latest_stable=row["latest_stable"],
+            downloads=row["downloads"],
+            published_at=(
+                datetime.fromisoformat(published_at) if published_at else None
+            ),
+        )
+
+    def summary_names(self) -> Iterator[ModuleName]:
+        rows = self._connection.execute(
+            "SELECT namespace, name, provider FROM module_summaries"
+        )
+        return (ModuleName(*row) for row in rows)
+
+    def refresh_summaries(self, module_names: Iterable[ModuleName]) -> None:
+        with self._connection as connection:
+            self._refresh_summaries(connection, module_names)
+
+    def catalog_generation(self) -> Optional[str]:
+        row = self._connection.execute(
+            "SELECT generation FROM catalog WHERE name = 'catalog'"
+        ).fetchone()
+        return row["generation"] if row is not None else None
+
+    def set_catalog_generation(
+        self, generation: str, replacing: Optional[str] = None
+    ) -> bool:
+        with self._connection as connection:
+            if replacing is not None:
+                cursor = connection.execute(
+                    "UPDATE catalog SET generation = ? "
+                    "WHERE name = 'catalog' AND generation = ?",
+                    (generation, replacing),
+                )
+                return cursor.rowcount > 0
+            cursor = connection.execute(
+                "INSERT INTO catalog (name, generation) VALUES ('catalog', ?) "
+                "ON CONFLICT (name) DO UPDATE SET generation = excluded.generation "
+                "WHERE excluded.generation > catalog.generation",
+                (generation,),
+            )
+            return cursor.rowcount > 0
@@ -0,0 +1,140 @@
+#  Copyright (c) 2020 Zero A.E., LLC
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import hashlib
+from http import HTTPStatus
+from typing import Dict, Iterable, Optional
+from uuid import uuid4
+
+from chalice import Response
+from chalice.app import Request
+
+from .cache import TTLCache
+from .config import ZTR_CACHE_SIZE, ZTR_HTTP_STAMP_TTL_SECONDS
+from .metrics import metrics
+from .names import ModuleName
+from .repository import get_repository
+
+# Survives across warm invocations, a changed module is served stale for at most
+# ZTR_HTTP_STAMP_TTL_SECONDS
+stamps = TTLCache(
+    maxsize=ZTR_CACHE_SIZE,
+    ttl=ZTR_HTTP_STAMP_TTL_SECONDS,
+    negative_ttl=ZTR_HTTP_STAMP_TTL_SECONDS,
+)
+metrics.register_cache("stamps", stamps)
+
+
+def touch(module_names: Iterable[ModuleName]) -> int:
+    """
+    Give modules a new change stamp, after their versions were written
+
+    A new catalog snapshot is published first, if snapshots are enabled, c.f.
+    `chalicelib.catalog`. Only the versions of the touched modules are read for
+    it, the rest of the catalog is copied from the current snapshot.
+
+    :param module_names: The modules whose versions changed
+    :return: The number of modules touched
+    """
+    from .catalog import catalog
+
+    module_names = set(module_names)
+    if module_names:
+        catalog.publish(module_names)
+    get_repository().set_stamps((m, uuid4().hex) for m in module_names)
+    for module_name in module_names:
+        stamps.invalidate(module_name)
+    return len(module_names)
+
+
+def touch_all() -> int:
+    """
+    Give every module a new change stamp, e.g. after a restore or a migration
+
+    :return: The number of modules touched
+    """
+    from .catalog import catalog
+
+    catalog.publish()
+    scan = get_repository().scan(attributes=["module_name"])
+    module_names = {module.module_name for module in scan}
+    get_repository().set_stamps((m, uuid4().hex) for m in module_names)
+    stamps.clear()
+    return len(module_names)
+
+
+def stamp(module_name: ModuleName) -> Optional[str]:
+    """
+    Return the change stamp of a module, or None if it has none (yet)
+
+    :param module_name: The module name
+    """
+    return stamps.get(module_name, lambda: get_repository().stamp(module_name))
+
+
+def module_etag(module_name: ModuleName, *parts: str) -> Optional[str]:
+    """
+    Return the entity tag of a response about a module, derived from its stamp
+
+    :param module_name: The module name
+    :param parts: What else the response depends on, e.g. the route and version
+    :return: The entity tag, or None if the module has no stamp
+    """
+    module_stamp = stamp(module_name)
+    if module_stamp is None:
+        return None
+    return etag(str(module_name), module_stamp, *parts)
+
+
+def etag(*parts: str) -> str:
+    """Return a strong entity tag derived from parts"""
+    digest = hashlib.sha256("\0".join(parts).encode()).hexdigest()[:32]
+    return f'"{digest}"'
+
+
+def not_modified(request: Request, tag: Optional[str]) -> bool:
+    """
+    Return True if the request's If-None-Match matches the entity tag
+
+    :param request: The request
+    :param tag: The current entity tag, None if the response has none
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if tag is None or if_none_match is None:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = (t.strip() for t in if_none_match.split(","))
+    # If-None-Match uses the weak comparison
+    return tag in (t[2:] if t.startswith("W/") else t for t in candidates)
+
+
+def cache_headers(tag: Optional[str], max_age: int) -> Dict[str, str]:
+    """
+    Return the validator and freshness headers of a response
+
+    :param tag: The entity tag, if the response has one
+    :param max_age: The number of seconds the response may be cached
+    """
+    headers = {"Cache-Control": f"public, max-age={max_age}"}
+    if tag is not None:
+        headers["ETag"] = tag
+    return headers
+
+
+def not_modified_response(tag: str, max_age: int) -> Response:
+    """Return a 304 Not Modified response, with the headers of a full response"""
+    return Response(
+        body="", status_code=HTTPStatus.NOT_MODIFIED, headers=cache_headers(tag, max_age)
+    )
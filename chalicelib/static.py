@@ -0,0 +1,168 @@
+#  Copyright (c) 2020 Zero A.E., LLC
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import hashlib
+import json
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from time import monotonic
+from typing import Dict, List, Tuple
+
+from .blobs import BlobStore
+from .models import ModuleName
+from .modules import DISCOVERY, versions_json
+from .repository import get_repository
+from .versions import version_key
+
+FORMAT = "ztr-static/1"
+MANIFEST_KEY = "static-manifest.json"
+JSON = "application/json"
+
+# The pseudo module of the files that do not belong to any module
+_ROOT = ""
+
+# path -> (content, content type)
+Files = Dict[str, Tuple[bytes, str]]
+
+
+def _location(getter_url: str) -> bytes:
+    # Terraform reads the location from the body of a 200 response, when there is
+    # no X-Terraform-Get header, which static file servers cannot set
+    return json.dumps({"location": getter_url}).encode()
+
+
+def render_module(module_name: ModuleName, versions: Dict[str, str]) -> Files:
+    """
+    Render the static files of a module, as served by the blueprint routes
+
+    :param module_name: The module name
+    :param versions: The download URL of each version
+    """
+    ordered = sorted(
+        (v for v in versions if version_key(v) is not None), key=version_key
+    )
+    prefix = f"modules/{module_name}"
+    files: Files = {
+        f"{prefix}/versions": (
+            "".join(versions_json(module_name, ordered)).encode(),
+            JSON,
+        )
+    }
+    for version, getter_url in versions.items():
+        files[f"{prefix}/{version}/download"] = (_location(getter_url), JSON)
+    if ordered:
+        files[f"{prefix}/download"] = (_location(versions[ordered[-1]]), JSON)
+    return files
+
+
+def render_root() -> Files:
+    """Render the static files that do not belong to any module"""
+    return {".well-known/terraform.json": (DISCOVERY.encode(), JSON)}
+
+
+def content_hash(files: Files) -> str:
+    """Return the hash of a set of files, their paths and contents"""
+    digest = hashlib.sha256()
+    for path in sorted(files):
+        content, content_type = files[path]
+        for part in (path.encode(), content_type.encode(), content):
+            digest.update(len(part).to_bytes(8, "big"))
+            digest.update(part)
+    return digest.hexdigest()
+
+
+@dataclass
+class PublishReport(object):
+    """
+    The outcome of a static publish
+    """
+
+    modules: int = 0
+    changed: int = 0
+    removed: int = 0
+    written: int = 0
+    deleted: int = 0
+    elapsed: float = 0.0
+
+    def __str__(self) -> str:
+        return (
+            f"Published {self.modules} modules in {self.elapsed:.2f}s: "
+            f"{self.changed} changed, {self.removed} removed, "
+            f"{self.written} files written, {self.deleted} files deleted"
+        )
+
+
+def _catalog() -> Dict[str, Dict[str, str]]:
+    """Return the download URL of every version of every module"""
+    catalog: Dict[str, Dict[str, str]] = defaultdict(dict)
+    scan = get_repository().scan(
+        attributes=["module_name", "version", "getter_url", "mirror_url"]
+    )
+    for module in scan:
+        catalog[str(module.module_name)][module.version] = module.download_url
+    return catalog
+
+
+def publish(store: BlobStore, workers: int = 8) -> PublishReport:
+    """
+    Render every registry response of the catalog to a blob store, incrementally
+
+    The store holds a manifest with the content hash and the files of every
+    module. Only the modules whose hash changed since the last publish are
+    written, and the files of removed versions and modules are deleted. The
+    manifest is written last, so an interrupted publish is redone next time.
+
+    :param store: The blob store, e.g. the document root of a web server
+    :param workers: The number of concurrent writes
+    """
+    started = monotonic()
+    report = PublishReport()
+
+    previous = json.loads(store.get(MANIFEST_KEY) or b"{}").get("modules", {})
+    rendered = {_ROOT: render_root()}
+    for fqmn, versions in _catalog().items():
+        rendered[fqmn] = render_module(ModuleName(*fqmn.split("/")), versions)
+    report.modules = len(rendered) - 1
+
+    manifest = {}
+    writes: List[Tuple[str, bytes, str]] = []
+    deletes: List[str] = []
+    for fqmn, files in rendered.items():
+        digest = content_hash(files)
+        manifest[fqmn] = {"sha256": digest, "files": sorted(files)}
+        old = previous.get(fqmn)
+        if old is not None and old["sha256"] == digest:
+            continue
+        report.changed += fqmn != _ROOT
+        writes.extend((path, *files[path]) for path in sorted(files))
+        if old is not None:
+            deletes.extend(sorted(set(old["files"]) - set(files)))
+    for fqmn in sorted(set(previous) - set(rendered)):
+        report.removed += 1
+        deletes.extend(previous[fqmn]["files"])
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(lambda write: store.put(*write), writes))
+        list(executor.map(store.delete, deletes))
+
+    store.put(
+        MANIFEST_KEY,
+        json.dumps({"format": FORMAT, "modules": manifest}, sort_keys=True).encode(),
+        JSON,
+    )
+    report.written = len(writes)
+    report.deleted = len(deletes)
+    report.elapsed = monotonic() - started
+    return report
@@ -0,0 +1,161 @@
+#  Copyright (c) 2020 Zero A.E., LLC
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+from dataclasses import dataclass, replace
+from datetime import datetime, timedelta, timezone
+from random import Random
+from typing import Dict, Iterator, List
+
+from .models import ModuleModel
+from .names import ModuleName
+
+# The prerelease labels of the synthetic versions, e.g. 1.2.0-rc.1
+_PRERELEASE_LABELS = ("alpha", "beta", "rc")
+
+# The words of the synthetic module names and descriptions
+# fmt: off
+_WORDS = (
+    "vpc", "network", "cluster", "database", "cache", "queue", "bucket", "cdn",
+    "dns", "gateway", "firewall", "vault", "registry", "runner", "monitoring",
+    "logging", "backup", "identity", "secrets", "kubernetes", "lambda", "storage",
+    "search", "stream", "balancer", "certificate", "bastion", "mesh", "proxy",
+)
+# fmt: on
+
+_PROVIDERS = ("aws", "azurerm", "google", "kubernetes", "helm", "null", "random")
+
+# The publish time of the first version of every module
+_EPOCH = datetime(2020, 1, 1, tzinfo=timezone.utc)
+
+
+@dataclass(frozen=True)
+class CatalogShape(object):
+    """
+    The shape of a synthetic catalog, c.f. `generate`
+
+    The catalog has `namespaces` * `names` * `providers` modules, each with
+    `versions` versions.
+    """
+
+    namespaces: int = 10
+    # The module names of each namespace
+    names: int = 10
+    # The providers of each module name
+    providers: int = 2
+    # The versions of each module, and the share of them that are prereleases
+    versions: int = 20
+    prereleases: float = 0.2
+    seed: int = 0
+
+    @property
+    def modules(self) -> int:
+        """The number of modules in the catalog"""
+        return self.namespaces * self.names * self.providers
+
+    def scaled(self, **changes) -> "CatalogShape":
+        """Return a copy of the shape with some of its fields changed"""
+        return replace(self, **changes)
+
+
+# The catalog sizes of the benchmarks, c.f. `chalicelib.benchmark`
+SIZES: Dict[str, CatalogShape] = {
+    "small": CatalogShape(namespaces=2, names=5, providers=2, versions=10),
+    "medium": CatalogShape(namespaces=10, names=10, providers=3, versions=20),
+    "large": CatalogShape(namespaces=20, names=25, providers=3, versions=40),
+}
+
+
+def module_names(shape: CatalogShape) -> List[ModuleName]:
+    """
+    Return the names of the modules of a synthetic catalog, in catalog order
+
+    :param shape: The shape of the catalog
+    """
+    words = len(_WORDS)
+    providers = _PROVIDERS[: min(shape.providers, len(_PROVIDERS))]
+    providers += tuple(f"p{i}" for i in range(len(providers), shape.providers))
+    return [
+        ModuleName(
+            f"ns{n:04d}",
+            f"{_WORDS[i % words]}-{i // words}" if i >= words else _WORDS[i],
+            provider,
+        )
+        for n in range(shape.namespaces)
+        for i in range(shape.names)
+        for provider in providers
+    ]
+
+
+def versions(shape: CatalogShape, rng: Random) -> List[str]:
+    """
+    Return the versions of one module, in semantic version order
+
+    Each release bumps the patch, minor or major version, and is preceded by a
+    prerelease with probability `shape.prereleases`, until there are
+    `shape.versions` versions.
+
+    :param shape: The shape of the catalog
+    :param rng: The random number generator of the catalog
+    """
+    major, minor, patch = 0, 1, 0
+    result: List[str] = []
+    while len(result) < shape.versions:
+        bump = rng.random()
+        if bump < 0.05:
+            major, minor, patch = major + 1, 0, 0
+        elif bump < 0.3:
+            minor, patch = minor + 1, 0
+        else:
+            patch += 1
+        release = f"{major}.{minor}.{patch}"
+        if rng.random() < shape.prereleases:
+            label = rng.choice(_PRERELEASE_LABELS)
+            result.append(f"{release}-{label}.{rng.randint(1, 3)}")
+        if len(result) < shape.versions:
+            result.append(release)
+    return result
+
+
+def generate(shape: CatalogShape) -> Iterator[ModuleModel]:
+    """
+    Yield the module versions of a synthetic catalog
+
+    The catalog only depends on the shape, its seed included, so the same shape
+    always generates the same catalog.
+
+    :param shape: The shape of the catalog
+    """
+    rng = Random(shape.seed)
+    for module_name in module_names(shape):
+        words = " ".join(rng.sample(_WORDS, 3))
+        description = f"Terraform module for {words} on {module_name.provider}"
+        published_at = _EPOCH + timedelta(hours=rng.randrange(24 * 365))
+        for version in versions(shape, rng):
+            published_at += timedelta(hours=rng.randrange(1, 24 * 30))
+            yield ModuleModel(
+                module_name,
+                version,
+                getter_url=(
+                    f"git::https://git.example.com/{module_name.namespace}/"
+                    f"terraform-{module_name.provider}-{module_name.name}"
+                    f"?ref={version}"
+                ),
+                verified=True if rng.random() < 0.1 else None,
+                owner=module_name.namespace,
+                description=description,
+                source=f"https://git.example.com/{module_name.namespace}/"
+                f"terraform-{module_name.provider}-{module_name.name}",
+                published_at=published_at,
+                downloads=int(rng.paretovariate(1.2)) - 1,
+            )
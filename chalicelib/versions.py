@@ -0,0 +1,84 @@
+#  Copyright (c) 2020 Zero A.E., LLC
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+from typing import Optional, Tuple
+
+import semver
+
+# Wide enough for date-based versions (e.g. 20200101.0.0)
+_WIDTH = 10
+
+# Prerelease identifiers only use [0-9A-Za-z-], so "," sorts before all of them,
+# and a shorter list of identifiers sorts before a longer one with the same prefix.
+_IDENTIFIER_SEPARATOR = ","
+
+# "-" sorts before "~", so every prerelease sorts before its release
+_PRERELEASE = "-"
+_RELEASE = "~"
+
+
+def _identifier_key(identifier: str) -> str:
+    """
+    Encode a prerelease identifier
+
+    Numeric identifiers are prefixed with "0" and their length, so that they
+    compare numerically and before alphanumeric identifiers, which are prefixed
+    with "1" and compare in ASCII order.
+    """
+    if identifier.isdigit():
+        return f"0{len(identifier):02d}{identifier}"
+    return f"1{identifier}"
+
+
+def version_key(version: str) -> Optional[str]:
+    """
+    Encode a semantic version as a string whose lexicographic order is the
+    semantic version precedence order (build metadata is ignored).
+
+        >>> version_key("1.2.3-rc.1") < version_key("1.2.3") < version_key("1.10.0")
+        True
+
+    :param version: The semantic version
+    :return: The sortable key, or None if version is not a valid semantic version
+    """
+    try:
+        v = semver.VersionInfo.parse(version)
+    except (TypeError, ValueError):
+        return None
+
+    key = f"{v.major:0{_WIDTH}d}.{v.minor:0{_WIDTH}d}.{v.patch:0{_WIDTH}d}"
+    if v.prerelease is None:
+        return key + _RELEASE
+    identifiers = (_identifier_key(i) for i in v.prerelease.split("."))
+    return key + _PRERELEASE + _IDENTIFIER_SEPARATOR.join(identifiers)
+
+
+def is_stable(version: str) -> bool:
+    """
+    Return True if version is a semantic version, and not a prerelease
+
+    :param version: The version
+    """
+    key = version_key(version)
+    return key is not None and key.endswith(_RELEASE)
+
+
+def version_order(version: str) -> Tuple[str, str]:
+    """
+    Return a sort key ordering versions by semantic version precedence, after the
+    invalid versions, which are ordered as strings.
+
+    :param version: The version
+    """
+    return version_key(version) or "", version
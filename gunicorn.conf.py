@@ -0,0 +1,63 @@
+#  Copyright (c) 2020 Zero A.E., LLC
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+The gunicorn configuration of the production serving mode, c.f. wsgi.py
+
+Each worker process imports the app and opens its own backend connections, and
+serves ZTR_SERVER_THREADS requests at a time. Workers are recycled gracefully
+after ZTR_SERVER_MAX_REQUESTS requests, their pending download counts flushed
+and rolled up.
+"""
+import os
+
+from chalicelib.server import apply_chalice_stage
+
+apply_chalice_stage(os.environ.get("ZTR_SERVER_STAGE", "local"))
+
+from chalicelib.config import (  # noqa: E402, reads the configuration applied above
+    ZTR_SERVER_BIND,
+    ZTR_SERVER_GRACEFUL_TIMEOUT,
+    ZTR_SERVER_MAX_REQUESTS,
+    ZTR_SERVER_MAX_REQUESTS_JITTER,
+    ZTR_SERVER_THREADS,
+    ZTR_SERVER_WORKERS,
+)
+
+bind = ZTR_SERVER_BIND
+workers = ZTR_SERVER_WORKERS
+worker_class = "gthread"
+threads = ZTR_SERVER_THREADS
+max_requests = ZTR_SERVER_MAX_REQUESTS
+max_requests_jitter = ZTR_SERVER_MAX_REQUESTS_JITTER
+graceful_timeout = ZTR_SERVER_GRACEFUL_TIMEOUT
+keepalive = 5
+# The workers must not share the connections of a preloaded app
+preload_app = False
+# The heartbeat files of the workers, on disk they stall under Docker
+worker_tmp_dir = "/dev/shm" if os.path.isdir("/dev/shm") else None
+accesslog = "-"
+
+
+def post_worker_init(worker):
+    from chalicelib.server import warm_up
+
+    warm_up()
+
+
+def worker_exit(server, worker):
+    from chalicelib.downloads import get_counter
+
+    get_counter().flush()
+    get_counter().rollup()
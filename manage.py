@@ -15,13 +15,8 @@
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 import json
 import os
-from http import HTTPStatus
-from typing import AnyStr
-from urllib.parse import urljoin
 
 import click
-import dateutil
-import requests
 
 from chalicelib import db
 
@@ -65,15 +60,62 @@ def go(stage) -> None:
 @go.group("db")
 def db_group():
     """
-    Manage the DynamoDB backend (init, destroy, backup, restore).
+    Manage the backend (init, destroy, backup, restore).
     """
     pass
 
 
+def _require_dynamodb():
+    """Fail unless the configured backend is DynamoDB"""
+    from chalicelib.dynamodb import DynamoDBRepository
+    from chalicelib.repository import get_repository
+
+    if not isinstance(get_repository(), DynamoDBRepository):
+        raise click.UsageError("This command requires the dynamodb backend.")
+
+
 @db_group.command(name="init")
 def db_init():
     """Initializes the backend."""
-    return db.db_init()
+    from chalicelib.repository import get_repository
+
+    get_repository().init()
+
+
+@db_group.command(name="migrate")
+def db_migrate():
+    """Creates the missing indexes, and backfills existing records."""
+    _require_dynamodb()
+    created, count, invalid = db.db_migrate()
+    for index_name in created:
+        click.echo(f"Created {index_name}.")
+    for fqvmn in invalid:
+        click.echo(f"{fqvmn}: not a semantic version, no version key", err=True)
+    click.echo(f"Updated {count} records, {len(invalid)} invalid versions.")
+    return 0
+
+
+@db_group.command(name="repair-summaries")
+@click.option(
+    "--workers",
+    help="The number of modules repaired concurrently",
+    type=click.IntRange(min=1),
+    default=8,
+    show_default=True,
+)
+def db_repair_summaries(workers):
+    """
+    Rebuilds the module summaries from the module versions.
+
+    The summaries hold each module's ordered versions, latest stable version,
+    total downloads and last publish time, and are updated with every write of
+    its versions.
+    """
+    from chalicelib.repository import get_repository
+
+    count = get_repository().rebuild_summaries(workers=workers)
+    click.echo(f"Rebuilt {count} module summaries.")
+    return 0
 
 
 @db_group.command(name="destroy")
@@ -83,22 +125,66 @@ def db_destroy():
         "There is no coming back from this... are you sure you want to continue?",
         abort=True,
     )
-    return db.db_destroy()
+    from chalicelib.repository import get_repository
+
+    get_repository().destroy()
 
 
 @db_group.command(name="backup")
 @click.argument("filename", type=click.Path(dir_okay=False, writable=True))
-def db_backup(filename):
-    """Backups the backend content."""
-    db.db_dump(filename)
+@click.option(
+    "--segments",
+    help="The number of parallel scan segments",
+    type=click.IntRange(min=1),
+    default=4,
+    show_default=True,
+)
+def db_backup(filename, segments):
+    """
+    Backups the backend content.
+
+    Every table is backed up as gzip-compressed NDJSON, the modules to FILENAME and
+    the other tables to FILENAME.<model>, along with a .manifest.json holding the
+    item counts and checksums of each file.
+    """
+    _require_dynamodb()
+    manifests = db.db_dump(filename, segments=segments)
+    for model_name, manifest in manifests.items():
+        click.echo(f"Backed up {manifest['items']} {model_name} records.")
     return 0
 
 
 @db_group.command(name="restore")
 @click.argument("filename", type=click.Path(exists=True, dir_okay=False))
-def db_restore(filename):
-    """Restores the backend content."""
-    db.db_load(filename)
+@click.option(
+    "--workers",
+    help="The number of concurrent batch writes",
+    type=click.IntRange(min=1),
+    default=4,
+    show_default=True,
+)
+@click.option(
+    "--max-rate",
+    help="The maximum number of records written per second",
+    type=click.FloatRange(min=1),
+    default=None,
+)
+@click.option(
+    "--resume/--no-resume",
+    help="Resume from the checkpoint of an interrupted restore",
+    default=True,
+    show_default=True,
+)
+def db_restore(filename, workers, max_rate, resume):
+    """
+    Restores the backend content.
+
+    The write rate starts at the table's write capacity, and adapts to throttling.
+    """
+    _require_dynamodb()
+    reports = db.db_load(filename, workers=workers, max_rate=max_rate, resume=resume)
+    for model_name, report in reports.items():
+        click.echo(f"{model_name}: {report}")
     return 0
 
 
@@ -148,23 +234,26 @@ def record_create(fqvmn, getter_url, verified, owner, description, source):
               s3::http://s3.amazonaws.com/bucket/hello.txt
     """
     from chalicelib.models import ModuleModel, ModuleName
+    from chalicelib.repository import get_repository
+    from chalicelib.stamps import touch
 
     namespace, name, provider, version = fqvmn
     module_name = ModuleName(namespace, name, provider)
-    try:
-        ModuleModel.get(module_name, version)  # noqa
+    repository = get_repository()
+    if repository.get(module_name, version, attributes=["version"]) is not None:
         return 1
-    except ModuleModel.DoesNotExist as dne:
-        module = ModuleModel(
-            module_name=ModuleName(namespace, name, provider),
-            version=version,
-            getter_url=getter_url,
-            verified=verified if verified else None,
-            owner=owner,
-            description=description,
-            source=source,
-        )
-        module.save()
+
+    module = ModuleModel(
+        module_name=ModuleName(namespace, name, provider),
+        version=version,
+        getter_url=getter_url,
+        verified=verified if verified else None,
+        owner=owner,
+        description=description,
+        source=source,
+    )
+    repository.save(module)
+    touch([module_name])
 
 
 @record.command("delete")
@@ -175,15 +264,14 @@ def record_delete(fqvmn: str) -> None:
 
     :param fqvmn: The fully qualified version module name
     """
-    from chalicelib.models import ModuleModel, ModuleName
+    from chalicelib.models import ModuleName
+    from chalicelib.repository import get_repository
+    from chalicelib.stamps import touch
 
     namespace, name, provider, version = fqvmn
     module_name = ModuleName(namespace, name, provider)
-    try:
-        module = ModuleModel.get(hash_key=module_name, range_key=version)  # noqa
-        module.delete()
-    except ModuleModel.DoesNotExist:
-        pass
+    if get_repository().delete(module_name, version):
+        touch([module_name])
 
 
 @record.command("list")
@@ -195,38 +283,30 @@ def record_list(show_url: bool):
 
     :param show_url: If the url should be included in the printing of the module list
     """
-    from chalicelib.models import ModuleModel
+    from chalicelib.repository import get_repository
 
     model_attributes = ["module_name", "version"]
     if show_url:
         model_attributes.append("getter_url")
 
-    for module in ModuleModel.scan(attributes_to_get=model_attributes):
+    for module in get_repository().scan(attributes=model_attributes):
         if show_url:
             click.echo(f"{module.module_name}/{module.version} -> {module.getter_url}")
         else:
             click.echo(f"{module.module_name}/{module.version}")
 
 
-def discover_modules_v1(registry: str) -> AnyStr:
-    """
-    Returns the discovery URL for the given registry domain
-
-    :param registry: The registry domain
-    """
-    url = f"https://{registry}/.well-known/terraform.json"
-    r = requests.get(url)
-    return urljoin(url, r.json()["modules.v1"])
-
-
-@record.command("import")
-@fqvmn_argument
-@click.option(
+registry_option = click.option(
     "--registry",
     help="A v1 compatible Terraform registry",
     default="registry.terraform.io",
     show_default=True,
 )
+
+
+@record.command("import")
+@fqvmn_argument
+@registry_option
 def record_import(fqvmn: str, registry: str):
     """
     Import a new Terraform Module from an external registry.
@@ -234,38 +314,385 @@ def record_import(fqvmn: str, registry: str):
     :param fqvmn: The fully qualified version module name
     :param registry: The registry to import the module from, defaults to registry.terraform.io
     """
-    from chalicelib.models import ModuleName, ModuleModel
+    from chalicelib.importer import ImportFailed, RegistryClient
+    from chalicelib.models import ModuleName
+    from chalicelib.repository import get_repository
+    from chalicelib.stamps import touch
 
     namespace, name, provider, version = fqvmn
     module_name = ModuleName(namespace, name, provider)
 
-    registry_url = discover_modules_v1(registry)
+    try:
+        module = RegistryClient(registry).fetch(module_name, version)
+    except ImportFailed as e:
+        click.echo(str(e), err=True)
+        click.get_current_context().exit(e.code)
 
-    metadata_r = requests.get(f"{registry_url}{module_name}")
-    if metadata_r.status_code != HTTPStatus.OK:
-        click.echo(f"{module_name} was not found in {registry}")
-        return 1
-    metadata = metadata_r.json()
+    get_repository().save(module)
+    touch([module_name])
+
+
+@record.command("import-many")
+@click.argument("manifest", type=click.File("r"))
+@registry_option
+@click.option(
+    "--workers",
+    help="The number of concurrent upstream requests",
+    type=click.IntRange(min=1),
+    default=10,
+    show_default=True,
+)
+def record_import_many(manifest, registry: str, workers: int):
+    """
+    Import many Terraform Modules from external registries.
+
+    The MANIFEST (or - for stdin) lists one module version per line, either as
+    <namespace>/<name>/<provider>/<version> to import it from --registry, or as
+    <registry>/<namespace>/<name>/<provider>/<version>.
+
+    :param manifest: The manifest file
+    :param registry: The default registry, defaults to registry.terraform.io
+    :param workers: The number of concurrent upstream requests
+    """
+    from chalicelib.importer import BulkImporter, parse_manifest
+
+    try:
+        imports = parse_manifest(manifest, registry)
+    except ValueError as ve:
+        raise click.BadParameter(str(ve), param_hint="MANIFEST")
+
+    report = BulkImporter(workers=workers).run(imports)
+    for fqvmn, reason in sorted(report.failures.items()):
+        click.echo(f"{fqvmn}: {reason}", err=True)
+    click.echo(str(report))
+
+    if report.failures:
+        click.get_current_context().exit(1)
+
+
+@go.command("publish-static")
+@click.argument("destination")
+@click.option(
+    "--workers",
+    help="The number of concurrent writes",
+    type=click.IntRange(min=1),
+    default=8,
+    show_default=True,
+)
+def publish_static(destination: str, workers: int):
+    """
+    Publish the registry as static files.
+
+    The service discovery, versions and download responses of every module are
+    written to DESTINATION, a local directory or s3://<bucket>/<prefix>. Only the
+    modules that changed since the last publish are written again.
+
+    :param destination: The directory, or S3 URL, to publish to
+    :param workers: The number of concurrent writes
+    """
+    from chalicelib.blobs import open_store
+    from chalicelib.static import publish
+
+    click.echo(str(publish(open_store(destination), workers=workers)))
+
+
+@go.command("publish-catalog")
+def publish_catalog():
+    """
+    Publish a snapshot of the catalog, for the read routes.
 
-    getter_url_r = requests.get(f"{registry_url}{module_name}/download")
-    if (
-            getter_url_r.status_code != HTTPStatus.NO_CONTENT
-            or "X-Terraform-Get" not in getter_url_r.headers
-    ):
-        click.echo(f"{module_name} go-getter-url was not found...")
-        return 2
-    getter_url = getter_url_r.headers["X-Terraform-Get"]
+    The snapshot is stored in ZTR_CATALOG_URL, and the catalog generation bumped
+    for the app to load it. Every write of this CLI publishes one as well, this
+    publishes the first one, or refreshes the download counts of the search results.
+    """
+    from chalicelib.catalog import catalog
 
-    module = ModuleModel(module_name, version, getter_url=getter_url)
-    module.verified = metadata["verified"]
+    if catalog.url is None:
+        raise click.UsageError("ZTR_CATALOG_URL is not set.")
+    generation = catalog.publish()
+    if generation is None:
+        click.echo("A later catalog generation was published meanwhile.")
+    else:
+        click.echo(f"Published catalog generation {generation}.")
 
-    module.owner = metadata["owner"]
-    module.description = metadata["description"]
-    module.source = metadata["source"]
 
-    module.published_at = dateutil.parser.isoparse(metadata["published_at"])
+@go.command("mirror")
+@click.argument("destination")
+@click.option(
+    "--base-url",
+    help="The URL DESTINATION is served from, e.g. by a web server or a CDN.",
+)
+@click.option(
+    "--namespace",
+    "namespaces",
+    multiple=True,
+    help="Only mirror the modules of this namespace, may be repeated.",
+)
+@click.option(
+    "--force",
+    is_flag=True,
+    default=False,
+    help="Mirror the module versions that are already mirrored again.",
+)
+@click.option(
+    "--workers",
+    help="The number of concurrent fetches",
+    type=click.IntRange(min=1),
+    default=4,
+    show_default=True,
+)
+def mirror(destination: str, base_url: str, namespaces, force: bool, workers: int):
+    """
+    Mirror the module sources as content-addressed archives.
+
+    The source of every module version is fetched once, packaged as a deterministic
+    tar.gz archive, and stored in DESTINATION, a local directory or
+    s3://<bucket>/<prefix>, under its SHA-256 digest. The download route then
+    serves the mirror URL, with the digest for Terraform to verify.
+
+    :param destination: The directory, or S3 URL, to store the archives in
+    :param base_url: The URL the archives are served from
+    :param namespaces: Only mirror the modules of these namespaces
+    :param force: Mirror the module versions that are already mirrored again
+    :param workers: The number of concurrent fetches
+    """
+    from chalicelib.blobs import open_store
+    from chalicelib.mirror import Mirror
+    from chalicelib.repository import get_repository
+
+    modules = get_repository().scan()
+    if namespaces:
+        modules = (m for m in modules if m.module_name.namespace in namespaces)
+
+    report = Mirror(open_store(destination), base_url, workers=workers).run(
+        modules, force=force
+    )
+    for name, reason in sorted(report.failures.items()):
+        click.echo(f"{name}: {reason}", err=True)
+    click.echo(str(report))
+
+    if report.failures:
+        click.get_current_context().exit(1)
+
+
+@go.group(name="bench")
+def bench():
+    """Benchmark the registry (micro, seed, load)."""
+
+
+@bench.command("micro")
+@click.option(
+    "--size",
+    "sizes",
+    type=click.Choice(["small", "medium", "large"]),
+    multiple=True,
+    help="A synthetic catalog size, may be repeated.  [default: small, medium]",
+)
+@click.option(
+    "--calls",
+    help="The number of timed calls of each case",
+    type=click.IntRange(min=1),
+    default=200,
+    show_default=True,
+)
+@click.option(
+    "--cache/--no-cache",
+    help="Keep the route caches between calls",
+    default=False,
+    show_default=True,
+)
+@click.option(
+    "--case",
+    "cases",
+    multiple=True,
+    help="Only run the case with this name, may be repeated.",
+)
+@click.option(
+    "--output",
+    help="The JSON results file",
+    type=click.Path(dir_okay=False, writable=True),
+    default="bench-micro.json",
+    show_default=True,
+)
+@click.option(
+    "--baseline",
+    help="The JSON results of an earlier run, to compare with",
+    type=click.Path(exists=True, dir_okay=False),
+)
+def bench_micro(sizes, calls: int, cache: bool, cases, output: str, baseline: str):
+    """
+    Time the routes, the models and the version selection.
+
+    The routes are served in-process from synthetic catalogs of every size, each
+    in a temporary SQLite database, so the benchmarks run offline. The results are
+    saved to OUTPUT, and compared with those of BASELINE, e.g. of another commit.
+    """
+    from tempfile import TemporaryDirectory
+
+    from chalicelib import benchmark
+    from chalicelib.synthetic import SIZES
+
+    baseline_results = None
+    if baseline is not None:
+        try:
+            baseline_results = benchmark.load(baseline)
+        except ValueError as ve:
+            raise click.BadParameter(str(ve), param_hint="--baseline")
+
+    shapes = {size: SIZES[size] for size in sizes or ("small", "medium")}
+    with TemporaryDirectory() as directory:
+        results = benchmark.run(
+            shapes,
+            directory,
+            calls=calls,
+            cache=cache,
+            cases=cases or None,
+            progress=lambda timing: click.echo(str(timing)),
+        )
+    benchmark.save(results, output)
+    click.echo(f"Saved {len(results['timings'])} timings to {output}.")
+
+    if baseline_results is not None:
+        for key, before, after, ratio in benchmark.compare(baseline_results, results):
+            click.echo(f"{key:<42} {before:>10.1f} -> {after:>10.1f} µs {ratio:.2f}x")
+    return 0
 
-    module.save()
+
+@bench.command("seed")
+@click.option(
+    "--size",
+    type=click.Choice(["small", "medium", "large"]),
+    default="medium",
+    show_default=True,
+    help="The synthetic catalog size, c.f. `bench micro`.",
+)
+def bench_seed(size: str):
+    """
+    Write a synthetic catalog to the backend, for `bench load`.
+
+    The catalog is deterministic, its modules are in the ns0000 to ns0019
+    namespaces, and replace the versions already there.
+    """
+    from chalicelib.repository import get_repository
+    from chalicelib.stamps import touch
+    from chalicelib.synthetic import SIZES, generate, module_names
+
+    shape = SIZES[size]
+    count = get_repository().save_many(generate(shape))
+    touch(module_names(shape))
+    click.echo(f"Saved {count} versions of {shape.modules} modules.")
+
+
+@bench.command("load")
+@click.option(
+    "--url",
+    help="The registry, e.g. gunicorn, `chalice local` or the docker-compose proxy",
+    default="http://localhost:8000",
+    show_default=True,
+)
+@click.option(
+    "--concurrency",
+    help="The number of concurrent terraform clients",
+    type=click.IntRange(min=1),
+    default=16,
+    show_default=True,
+)
+@click.option(
+    "--duration",
+    help="The number of seconds new flows are started for",
+    type=click.FloatRange(min=1),
+    default=60,
+    show_default=True,
+)
+@click.option(
+    "--popularity",
+    help="How the requests are spread over the modules",
+    type=click.Choice(["zipf", "uniform"]),
+    default="zipf",
+    show_default=True,
+)
+@click.option(
+    "--zipf-exponent",
+    help="The k-th most popular module is requested 1/k^exponent as often",
+    type=click.FloatRange(min=0),
+    default=1.1,
+    show_default=True,
+)
+@click.option(
+    "--latest-share",
+    help="The share of the flows downloading the latest version via the redirect",
+    type=click.FloatRange(min=0, max=1),
+    default=0.2,
+    show_default=True,
+)
+@click.option(
+    "--max-modules",
+    help="Only request the first modules listed by the registry",
+    type=click.IntRange(min=1),
+    default=None,
+)
+@click.option("--seed", type=click.INT, default=0, show_default=True)
+@click.option(
+    "--output",
+    help="Also save the report as JSON",
+    type=click.Path(dir_okay=False, writable=True),
+)
+def bench_load(
+    url: str,
+    concurrency: int,
+    duration: float,
+    popularity: str,
+    zipf_exponent: float,
+    latest_share: float,
+    max_modules: int,
+    seed: int,
+    output: str,
+):
+    """
+    Replay concurrent `terraform init` runs against a running registry.
+
+    Each flow installs one module, picked by popularity among the modules listed
+    by the registry: it reads the discovery document, lists the versions, and
+    downloads a version, the latest through the redirect of the download route.
+    The throughput, the p50/p95/p99 latency of each route, and the error and
+    throttling (429, 503) rates are reported.
+    """
+    from urllib.parse import urlsplit
+
+    from chalicelib.loadtest import (
+        FlowFailed,
+        HTTPTransport,
+        LoadGenerator,
+        list_modules,
+    )
+
+    transport = HTTPTransport(url)
+    prefix = urlsplit(url).path.rstrip("/")
+    try:
+        modules = list_modules(transport, prefix, limit=max_modules)
+    except FlowFailed as e:
+        raise click.ClickException(f"Cannot list the modules of {url}: {e}")
+    if not modules:
+        raise click.ClickException(f"{url} has no modules, c.f. `bench seed`.")
+
+    click.echo(f"Replaying terraform init of {len(modules)} modules for {duration}s.")
+    report = LoadGenerator(
+        transport,
+        modules,
+        prefix=prefix,
+        concurrency=concurrency,
+        duration=duration,
+        distribution=popularity,
+        exponent=zipf_exponent,
+        latest_share=latest_share,
+        seed=seed,
+    ).run()
+    click.echo(str(report))
+    if output is not None:
+        with open(output, "w") as f:
+            json.dump(report.to_json(), f, indent=2)
+            f.write("\n")
+    return 0
 
 
 if __name__ == "__main__":
@@ -22,3 +22,65 @@ def test_discovery(client: RequestHandler) -> None:
     response = client.get("/.well-known/terraform.json")
     assert response.status_code == HTTPStatus.OK
     assert response.json == {"modules.v1": "/modules/"}
+
+
+def test_discovery_is_cacheable(client: RequestHandler) -> None:
+    response = client.get("/.well-known/terraform.json")
+    assert response.headers["Cache-Control"] == "public, max-age=86400"
+
+    etag = response.headers["ETag"]
+    response = client.get(
+        "/.well-known/terraform.json", headers={"If-None-Match": etag}
+    )
+    assert response.status_code == HTTPStatus.NOT_MODIFIED
+    assert response.headers["ETag"] == etag
+
+
+# The heavy dependencies the routes import on first use, never on a cold start
+LAZY_MODULES = ["botocore", "chalicelib.models", "pynamodb", "semver"]
+
+# The time importing app.py may add to importing chalice, on a cold start
+IMPORT_BUDGET_SECONDS = 0.150
+
+_COLD_START = """
+import atexit, json, sys, time
+started = time.perf_counter()
+import chalice
+imported_chalice = time.perf_counter()
+callbacks = atexit._ncallbacks()
+import app
+print(json.dumps({
+    "seconds": time.perf_counter() - imported_chalice,
+    "modules": sorted(m for m in %r if m in sys.modules),
+    "atexit": atexit._ncallbacks() - callbacks,
+}))
+"""
+
+
+def _cold_start() -> dict:
+    """Import app.py in a new (Lambda like) interpreter"""
+    import json
+    import os
+    import subprocess
+    import sys
+
+    env = dict(os.environ, AWS_LAMBDA_FUNCTION_NAME="cold-start")
+    output = subprocess.check_output(
+        [sys.executable, "-c", _COLD_START % LAZY_MODULES],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        env=env,
+    )
+    return json.loads(output)
+
+
+def test_cold_start_is_lazy() -> None:
+    cold_start = _cold_start()
+
+    assert cold_start["modules"] == []
+    assert cold_start["atexit"] == 0
+
+
+def test_cold_start_import_budget() -> None:
+    seconds = min(_cold_start()["seconds"] for _ in range(5))
+
+    assert seconds < IMPORT_BUDGET_SECONDS
@@ -0,0 +1,147 @@
+#  Copyright (c) 2020 Zero A.E., LLC
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import gzip
+import json
+import os
+
+import pytest
+
+LEGACY_BACKUP = os.path.join(os.path.dirname(__file__), "integration", "local.ddb")
+
+
+@pytest.fixture(name="catalog")
+def fixture_catalog():
+    from chalicelib.db import db_batch_write
+    from chalicelib.models import ModuleModel, ModuleName
+
+    modules = [
+        ModuleModel(ModuleName("backup", f"module-{i}", "aws"), version, getter_url=".")
+        for i in range(20)
+        for version in ["1.0.0", "1.1.0", "1.2.0", "1.3.0", "1.4.0"]
+    ]
+    db_batch_write(ModuleModel, (m.serialize() for m in modules))
+    yield modules
+
+    with ModuleModel.batch_write() as batch:
+        for module in ModuleModel.scan():
+            batch.delete(module)
+
+
+def test_backup(catalog, tmp_path):
+    from chalicelib.backup import backup, manifest_filename
+
+    filename = str(tmp_path / "modules.ndjson.gz")
+    manifest = backup(filename, segments=3)
+
+    assert manifest["items"] == len(catalog)
+    assert len(manifest["segments"]) == 3
+
+    with gzip.open(filename) as f:
+        items = [json.loads(line) for line in f]
+    assert len(items) == len(catalog)
+    assert {i["module_name"]["S"] for i in items} == {
+        str(m.module_name) for m in catalog
+    }
+
+    with open(manifest_filename(filename)) as f:
+        assert json.load(f) == manifest
+
+
+def test_backup_restore_roundtrip(catalog, tmp_path, monkeypatch):
+    from chalicelib import restore
+    from chalicelib.db import db_dump, db_load
+    from chalicelib.models import ModuleModel, ModuleName
+
+    # The test tables only have 1 WCU
+    monkeypatch.setattr(restore, "table_write_rate", lambda model: 10_000.0)
+
+    from chalicelib.models import DownloadCounterModel
+
+    DownloadCounterModel("backup/module-7/aws/1.4.0#0", downloads=42).save()
+
+    filename = str(tmp_path / "modules.ndjson.gz")
+    db_dump(filename, segments=2)
+
+    with ModuleModel.batch_write() as batch:
+        for module in catalog:
+            batch.delete(module)
+    DownloadCounterModel("backup/module-7/aws/1.4.0#0").delete()
+
+    reports = db_load(filename)
+    assert reports["ModuleModel"].restored == len(catalog)
+    assert reports["DownloadCounterModel"].restored == 1
+    latest = ModuleModel.latest(ModuleName("backup", "module-7", "aws"))
+    assert latest.version == "1.4.0"
+    assert DownloadCounterModel.get("backup/module-7/aws/1.4.0#0").downloads == 42
+
+    DownloadCounterModel("backup/module-7/aws/1.4.0#0").delete()
+
+
+def test_backup_fails_when_the_writer_fails(catalog, tmp_path, monkeypatch):
+    from threading import Thread
+
+    from chalicelib import backup
+
+    class FailingFile(object):
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            pass
+
+        def write(self, data):
+            raise OSError("No space left on device")
+
+    # The scanners fill the queue, and block, before the writer fails
+    monkeypatch.setattr(backup, "_QUEUE_PAGES", 1)
+    monkeypatch.setattr(backup.gzip, "open", lambda *args: FailingFile())
+    errors = []
+
+    def run():
+        try:
+            backup.backup(str(tmp_path / "modules.ndjson.gz"), segments=4)
+        except OSError as e:
+            errors.append(e)
+
+    thread = Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(timeout=30)
+
+    assert not thread.is_alive()
+    assert len(errors) == 1
+
+
+def test_restore_rejects_corrupted_backup(catalog, tmp_path):
+    from chalicelib.backup import verify_backup
+    from chalicelib.db import db_dump
+
+    filename = str(tmp_path / "modules.ndjson.gz")
+    db_dump(filename)
+    with open(filename, "ab") as f:
+        f.write(b"garbage")
+
+    with pytest.raises(ValueError):
+        verify_backup(filename)
+
+
+def test_read_legacy_backup():
+    from chalicelib.backup import read_backup
+    from chalicelib.models import ModuleModel
+
+    modules = [ModuleModel.from_raw_data(item) for item in read_backup(LEGACY_BACKUP)]
+
+    assert len(modules) == 8
+    assert str(modules[0].module_name) == "plus3it/file-cache/external"
+    assert modules[0].version == "1.2.0"
@@ -0,0 +1,111 @@
+#  Copyright (c) 2020 Zero A.E., LLC
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import json
+
+import pytest
+
+
+def test_generate_is_deterministic():
+    from chalicelib.synthetic import CatalogShape, generate
+    from chalicelib.versions import is_stable, version_order
+
+    shape = CatalogShape(namespaces=2, names=3, providers=2, versions=5)
+    modules = list(generate(shape))
+    assert len(modules) == shape.modules * 5 == 60
+
+    assert [m.attribute_values for m in generate(shape)] == [
+        m.attribute_values for m in modules
+    ]
+    assert [m.version for m in generate(shape.scaled(seed=1))] != [
+        m.version for m in modules
+    ]
+
+    by_module = {}
+    for module in modules:
+        by_module.setdefault(module.module_name, []).append(module.version)
+    assert len(by_module) == 12
+    for versions in by_module.values():
+        # Generated in semantic version order, without duplicates
+        assert sorted(versions, key=version_order) == versions
+        assert len(set(versions)) == 5
+
+    stable = list(generate(shape.scaled(prereleases=0.0)))
+    assert all(is_stable(m.version) for m in stable)
+    unstable = list(generate(shape.scaled(prereleases=1.0)))
+    assert not all(is_stable(m.version) for m in unstable)
+
+
+def test_run_and_compare(tmp_path):
+    from chalicelib import benchmark
+    from chalicelib.repository import get_repository
+    from chalicelib.synthetic import CatalogShape
+
+    repository = get_repository()
+    shape = CatalogShape(namespaces=1, names=2, providers=2, versions=3)
+    timings = []
+    results = benchmark.run(
+        {"tiny": shape},
+        str(tmp_path),
+        calls=3,
+        progress=timings.append,
+    )
+    # The configured repository is restored afterwards
+    assert type(get_repository()) is type(repository)
+
+    names = {t["name"] for t in results["timings"]}
+    assert {"list_versions", "download_latest", "download", "resolve"} <= names
+    assert {"ModuleNameAttribute.deserialize", "latest_version"} <= names
+    keys = [f"tiny/{t['name']}" for t in results["timings"]]
+    assert [t.key for t in timings] == keys
+    assert all(t["calls"] == 3 for t in results["timings"])
+    assert all(0 < t["min_us"] <= t["median_us"] for t in results["timings"])
+    assert results["sizes"]["tiny"]["versions"] == 3
+
+    filename = str(tmp_path / "results.json")
+    benchmark.save(results, filename)
+    assert benchmark.load(filename) == json.loads(json.dumps(results))
+
+    faster = json.loads(json.dumps(results))
+    for timing in faster["timings"]:
+        timing["median_us"] /= 2
+    changes = benchmark.compare(results, faster)
+    assert len(changes) == len(results["timings"])
+    assert all(ratio == pytest.approx(0.5) for _, _, _, ratio in changes)
+
+
+def test_run_selected_cases(tmp_path):
+    from chalicelib import benchmark
+    from chalicelib.synthetic import CatalogShape
+
+    shape = CatalogShape(namespaces=1, names=1, providers=1, versions=2)
+    results = benchmark.run(
+        {"a": shape, "b": shape.scaled(versions=4)},
+        str(tmp_path),
+        calls=2,
+        cases=["list_versions"],
+    )
+    assert [(t["size"], t["name"]) for t in results["timings"]] == [
+        ("a", "list_versions"),
+        ("b", "list_versions"),
+    ]
+
+
+def test_load_rejects_other_files(tmp_path):
+    from chalicelib import benchmark
+
+    filename = tmp_path / "other.json"
+    filename.write_text(json.dumps({"format": "other"}))
+    with pytest.raises(ValueError):
+        benchmark.load(str(filename))
@@ -0,0 +1,174 @@
+#  Copyright (c) 2020 Zero A.E., LLC
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import pytest
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture(name="clock")
+def fixture_clock() -> FakeClock:
+    return FakeClock()
+
+
+@pytest.fixture(name="cache")
+def fixture_cache(clock):
+    from chalicelib.cache import TTLCache
+
+    return TTLCache(maxsize=2, ttl=60, negative_ttl=5, clock=clock)
+
+
+def test_cache_read_through(cache):
+    loads = []
+
+    def loader():
+        loads.append(1)
+        return "value"
+
+    assert cache.get("key", loader) == "value"
+    assert cache.get("key", loader) == "value"
+
+    assert len(loads) == 1
+    assert cache.stats() == {"hits": 1, "misses": 1, "size": 1}
+
+
+def test_cache_ttl(cache, clock):
+    assert cache.get("key", lambda: "old") == "old"
+
+    clock.now = 59
+    assert cache.get("key", lambda: "new") == "old"
+
+    clock.now = 60
+    assert cache.get("key", lambda: "new") == "new"
+
+
+def test_cache_negative_ttl(cache, clock):
+    assert cache.get("key", lambda: None) is None
+
+    clock.now = 4
+    assert cache.get("key", lambda: "value") is None
+
+    clock.now = 5
+    assert cache.get("key", lambda: "value") == "value"
+
+
+def test_cache_lru_eviction(cache):
+    cache.get("a", lambda: "a")
+    cache.get("b", lambda: "b")
+    cache.get("a", lambda: "not loaded")
+    cache.get("c", lambda: "c")
+
+    assert len(cache) == 2
+    assert cache.get("a", lambda: "reloaded") == "a"
+    assert cache.get("b", lambda: "reloaded") == "reloaded"
+
+
+def test_cache_loader_errors_are_not_cached(cache):
+    def loader():
+        raise RuntimeError()
+
+    with pytest.raises(RuntimeError):
+        cache.get("key", loader)
+
+    assert len(cache) == 0
+
+
+def test_cache_invalidate_and_clear(cache):
+    cache.get("a", lambda: "a")
+    cache.invalidate("a")
+    assert cache.get("a", lambda: "reloaded") == "reloaded"
+
+    cache.clear()
+    assert cache.stats() == {"hits": 0, "misses": 0, "size": 0}
+
+
+def test_cache_get_many(cache, clock):
+    loads = []
+
+    def loader(keys):
+        loads.append(keys)
+        return {k: k.upper() for k in keys if k != "dne"}
+
+    assert cache.get_many(["a", "dne", "a"], loader) == {"a": "A", "dne": None}
+    assert loads == [["a", "dne"]]
+
+    assert cache.get_many(["a", "dne"], loader) == {"a": "A", "dne": None}
+    assert len(loads) == 1
+    assert (cache.hits, cache.misses) == (2, 2)
+
+    clock.now = 10
+    assert cache.get_many(["a", "dne"], loader) == {"a": "A", "dne": None}
+    assert loads[1] == ["dne"]
+
+
+def test_cache_concurrent_misses_load_once(cache):
+    from concurrent.futures import ThreadPoolExecutor
+    from threading import Event
+
+    loading, release = Event(), Event()
+    loads = []
+
+    def loader():
+        loads.append(1)
+        loading.set()
+        release.wait(5)
+        return "value"
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        leader = executor.submit(cache.get, "key", loader)
+        loading.wait(5)
+        followers = [executor.submit(cache.get, "key", loader) for _ in range(3)]
+        while cache.flights.stats()["collapsed"] < 3:
+            pass
+        release.set()
+        assert [f.result() for f in [leader, *followers]] == ["value"] * 4
+
+    assert len(loads) == 1
+    assert cache.get("key", loader) == "value"
+
+
+def test_cache_get_many_joins_loads_in_flight(cache):
+    from concurrent.futures import ThreadPoolExecutor
+    from threading import Event
+
+    loading, release = Event(), Event()
+    loaded = []
+
+    def slow_loader():
+        loading.set()
+        release.wait(5)
+        return "a"
+
+    def loader(keys):
+        loaded.extend(keys)
+        return {key: key.upper() for key in keys}
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        in_flight = executor.submit(cache.get, "a", slow_loader)
+        loading.wait(5)
+        many = executor.submit(cache.get_many, ["a", "b"], loader)
+        while cache.flights.stats()["collapsed"] < 1:
+            pass
+        release.set()
+        assert many.result() == {"a": "a", "b": "B"}
+        assert in_flight.result() == "a"
+
+    # Only the key that was not in flight was loaded by get_many
+    assert loaded == ["b"]
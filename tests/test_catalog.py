@@ -0,0 +1,255 @@
+#  Copyright (c) 2020 Zero A.E., LLC
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+from http import HTTPStatus
+
+import pytest
+
+
+def _module(fqmn: str, version: str, **kwargs):
+    from chalicelib.models import ModuleModel, ModuleName
+
+    kwargs.setdefault("getter_url", f"git::https://example.com/{fqmn}?ref={version}")
+    return ModuleModel(ModuleName(*fqmn.split("/")), version, **kwargs)
+
+
+@pytest.fixture(name="repository")
+def fixture_repository(tmp_path):
+    from chalicelib.repository import set_repository
+    from chalicelib.sqlite import SQLiteRepository
+
+    repository = SQLiteRepository(str(tmp_path / "registry.sqlite3"))
+    repository.init()
+    set_repository(repository)
+    yield repository
+    set_repository(None)
+
+
+def test_snapshot_lookups(tmp_path):
+    from chalicelib.catalog import CatalogSnapshot, render_snapshot
+    from chalicelib.models import ModuleName
+
+    modules = [
+        _module("snapshot/vpc/aws", "1.10.0", description="A VPC"),
+        _module("snapshot/vpc/aws", "1.2.0"),
+        _module("snapshot/vpc/aws", "latest"),
+        _module("snapshot/vpc/aws", "2.0.0-rc.1"),
+        _module("snapshot/eks/aws", "0.1.0", mirror_url="https://mirror/eks.tar.gz"),
+        _module("snapshot/dev/aws", "master"),
+    ]
+    path = tmp_path / "snapshot"
+    path.write_bytes(render_snapshot("g1", modules))
+
+    snapshot = CatalogSnapshot(str(path))
+    assert (snapshot.generation, len(snapshot)) == ("g1", 3)
+
+    vpc = ModuleName("snapshot", "vpc", "aws")
+    assert snapshot.versions(vpc) == ["1.2.0", "1.10.0", "2.0.0-rc.1"]
+    assert snapshot.latest_version(vpc) == "2.0.0-rc.1"
+    assert snapshot.download_url(vpc, "latest").endswith("?ref=latest")
+    assert snapshot.download_url(vpc, "3.0.0") is None
+
+    eks = ModuleName("snapshot", "eks", "aws")
+    assert snapshot.download_url(eks, "0.1.0") == "https://mirror/eks.tar.gz"
+
+    # Modules whose versions are not semantic versions are not listed
+    dev = ModuleName("snapshot", "dev", "aws")
+    assert (snapshot.versions(dev), snapshot.latest_version(dev)) == ([], None)
+    assert snapshot.download_url(dev, "master").endswith("?ref=master")
+
+    for missing in ["snapshot/a/aws", "snapshot/vpc/azurerm", "z/z/z"]:
+        assert snapshot.versions(ModuleName(*missing.split("/"))) == []
+
+    modules, total = snapshot.search("vpc")
+    assert total == 1
+    assert (modules[0].version, modules[0].description) == ("2.0.0-rc.1", None)
+    assert [str(m.module_name) for m in snapshot.search("*")[0]] == [
+        "snapshot/eks/aws",
+        "snapshot/vpc/aws",
+    ]
+
+
+def test_snapshot_rejects_other_files(tmp_path):
+    from chalicelib.catalog import CatalogSnapshot
+
+    path = tmp_path / "snapshot"
+    path.write_bytes(b'{"format": "ztr-static/1"}\n')
+    with pytest.raises(ValueError):
+        CatalogSnapshot(str(path))
+
+
+def test_catalog_reloads_new_generations(repository, tmp_path):
+    from chalicelib.catalog import Catalog
+    from chalicelib.models import ModuleName
+
+    now = [0.0]
+    catalog = Catalog(
+        str(tmp_path / "store"),
+        directory=str(tmp_path / "tmp"),
+        check_seconds=10,
+        clock=lambda: now[0],
+    )
+    # Nothing was published yet
+    assert catalog.current() is None
+
+    repository.save(_module("reload/vpc/aws", "1.0.0"))
+    first = catalog.publish()
+    assert catalog.current() is None
+    now[0] = 10
+    snapshot = catalog.current()
+    assert snapshot.generation == first
+
+    repository.save(_module("reload/vpc/aws", "1.1.0"))
+    second = catalog.publish()
+    assert second > first
+    assert not (tmp_path / "store" / "catalog" / first).exists()
+
+    # The generation is only checked every check_seconds
+    now[0] = 15
+    assert catalog.current() is snapshot
+    now[0] = 20
+    assert catalog.current().generation == second
+    assert catalog.current().latest_version(ModuleName("reload", "vpc", "aws")) == (
+        "1.1.0"
+    )
+    assert not (tmp_path / "tmp" / "ztr-catalog" / first).exists()
+
+    # The previous snapshot stays readable
+    assert snapshot.versions(ModuleName("reload", "vpc", "aws")) == ["1.0.0"]
+
+
+def test_catalog_keeps_snapshot_when_missing(repository, tmp_path):
+    from chalicelib.catalog import Catalog
+
+    now = [0.0]
+    catalog = Catalog(
+        str(tmp_path / "store"), directory=str(tmp_path / "tmp"), clock=lambda: now[0]
+    )
+    repository.save(_module("missing/vpc/aws", "1.0.0"))
+    generation = catalog.publish()
+    assert catalog.current().generation == generation
+
+    repository.set_catalog_generation(f"{generation}-newer")
+    now[0] = 3600
+    assert catalog.current().generation == generation
+
+
+def test_publish_loses_to_later_generation(repository, tmp_path):
+    from chalicelib.blobs import LocalBlobStore
+    from chalicelib.catalog import publish
+
+    repository.set_catalog_generation("99991231T000000.000000Z-later")
+    assert publish(LocalBlobStore(str(tmp_path))) is None
+    assert list((tmp_path / "catalog").iterdir()) == []
+    assert repository.catalog_generation() == "99991231T000000.000000Z-later"
+
+
+def test_routes_served_from_snapshot(client, repository, tmp_path, monkeypatch):
+    from chalicelib import catalog, modules
+    from chalicelib.downloads import get_counter
+    from chalicelib.models import ModuleName
+    from chalicelib.stamps import stamps, touch
+
+    snapshots = catalog.Catalog(
+        str(tmp_path / "store"), directory=str(tmp_path / "tmp"), check_seconds=0
+    )
+    monkeypatch.setattr(catalog, "catalog", snapshots)
+    monkeypatch.setattr(modules, "ZTR_CATALOG_URL", snapshots.url)
+    stamps.clear()
+
+    fqmn = ModuleName("served", "vpc", "aws")
+    for version in ["0.9.0", "0.10.0"]:
+        repository.save(_module(str(fqmn), version))
+    touch([fqmn])
+    # Only visible to the routes once a new snapshot is published
+    repository.save(_module(str(fqmn), "0.11.0"))
+
+    response = client.get("/modules/served/vpc/aws/versions")
+    versions = response.json["modules"][0]["versions"]
+    assert [v["version"] for v in versions] == ["0.9.0", "0.10.0"]
+
+    response = client.get("/modules/served/vpc/aws/download")
+    assert response.status_code == HTTPStatus.FOUND
+    assert response.headers["Location"].endswith("/served/vpc/aws/0.10.0/download")
+
+    response = client.get("/modules/served/vpc/aws/0.9.0/download")
+    assert response.headers["X-Terraform-Get"].endswith("/served/vpc/aws?ref=0.9.0")
+    response = client.get("/modules/served/vpc/aws/0.11.0/download")
+    assert response.status_code == HTTPStatus.NOT_FOUND
+
+    response = client.get("/modules/search?q=vpc")
+    assert [m["id"] for m in response.json["modules"]] == ["served/vpc/aws/0.10.0"]
+
+    # The ETags are derived from the module's block, not the change stamps
+    stamps.clear()
+    tag = client.get("/modules/served/vpc/aws/versions").headers["ETag"]
+    assert stamps.stats()["misses"] == 0
+
+    # Publishing another module does not change them
+    other = ModuleName("served", "eks", "aws")
+    repository.save(_module(str(other), "1.0.0"))
+    touch([other])
+    response = client.get(
+        "/modules/served/vpc/aws/versions", headers={"If-None-Match": tag}
+    )
+    assert response.status_code == HTTPStatus.NOT_MODIFIED
+
+    touch([fqmn])
+    response = client.get("/modules/served/vpc/aws/download")
+    assert response.headers["Location"].endswith("/served/vpc/aws/0.11.0/download")
+    response = client.get(
+        "/modules/served/vpc/aws/versions", headers={"If-None-Match": tag}
+    )
+    assert response.status_code == HTTPStatus.OK
+    assert response.headers["ETag"] != tag
+
+    get_counter().flush()
+    stamps.clear()
+
+
+def test_publish_only_reads_touched_modules(repository, tmp_path, monkeypatch):
+    from chalicelib.catalog import Catalog, publish
+    from chalicelib.models import ModuleName
+
+    catalog = Catalog(
+        str(tmp_path / "store"), directory=str(tmp_path / "tmp"), check_seconds=0
+    )
+    vpc, eks = ModuleName("touched", "vpc", "aws"), ModuleName("touched", "eks", "aws")
+    repository.save(_module(str(vpc), "1.0.0"))
+    repository.save(_module(str(eks), "1.0.0"))
+    first = catalog.publish()
+
+    def failing_scan(*args, **kwargs):
+        raise AssertionError("An incremental publish must not scan the catalog")
+
+    monkeypatch.setattr(repository, "scan", failing_scan)
+    repository.save(_module(str(vpc), "1.1.0"))
+    repository.save(_module(str(eks), "1.1.0"))
+    second = catalog.publish([vpc])
+    assert second > first
+    assert not (tmp_path / "store" / "catalog" / first).exists()
+
+    snapshot = catalog.current()
+    assert snapshot.generation == second
+    assert snapshot.versions(vpc) == ["1.0.0", "1.1.0"]
+    # Copied from the previous snapshot
+    assert snapshot.versions(eks) == ["1.0.0"]
+
+    # A generation published since the base is not replaced, the catalog is
+    # rescanned instead
+    monkeypatch.undo()
+    repository.set_catalog_generation(f"{second}-newer")
+    third = publish(catalog.store, [vpc], snapshot)
+    assert repository.catalog_generation() == third
+    assert catalog.current().versions(eks) == ["1.0.0", "1.1.0"]
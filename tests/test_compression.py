@@ -0,0 +1,163 @@
+#  Copyright (c) 2020 Zero A.E., LLC
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import base64
+import gzip
+import json
+from http import HTTPStatus
+
+import pytest
+from pytest_chalice.handlers import RequestHandler
+
+
+@pytest.fixture(autouse=True)
+def clear_caches() -> None:
+    from chalicelib.compression import compressed_bodies
+    from chalicelib.downloads import get_counter
+    from chalicelib.stamps import stamps
+
+    compressed_bodies.clear()
+    stamps.clear()
+    yield
+    get_counter().flush()
+
+
+@pytest.fixture(name="gzip_only")
+def fixture_gzip_only(monkeypatch):
+    from chalicelib import compression
+
+    monkeypatch.setattr(compression, "_brotli", False)
+
+
+@pytest.mark.parametrize(
+    "accept_encoding, expected",
+    [
+        (None, None),
+        ("", None),
+        ("identity", None),
+        ("gzip", "gzip"),
+        ("deflate, gzip;q=0.5", "gzip"),
+        ("gzip;q=0", None),
+        ("*", "gzip"),
+        ("*, gzip;q=0", None),
+        ("GZIP;Q=0.8, br;q=1", "gzip"),
+    ],
+)
+def test_negotiate(accept_encoding, expected, gzip_only):
+    from chalicelib.compression import negotiate
+
+    assert negotiate(accept_encoding) == expected
+
+
+def test_negotiate_prefers_brotli(monkeypatch):
+    from chalicelib import compression
+
+    monkeypatch.setattr(compression, "_brotli", object())
+
+    assert compression.negotiate("gzip, br") == "br"
+    assert compression.negotiate("gzip, br;q=0.5") == "gzip"
+
+
+def test_compress_gzip_is_deterministic():
+    from chalicelib.compression import compress
+
+    body = b'{"modules": []}' * 100
+    compressed = compress(body, "gzip")
+    assert gzip.decompress(compressed) == body
+    # No timestamp in the header, so the bytes only depend on the body
+    assert compressed[4:8] == b"\0\0\0\0"
+    assert compress(body, "gzip", cached=True) == compress(body, "gzip", cached=True)
+
+
+def test_compress_response_threshold(gzip_only):
+    from chalice import Response
+
+    from chalicelib.compression import compress_response
+
+    small = compress_response(Response(body={"a": 1}), "gzip", min_size=100)
+    assert "Content-Encoding" not in small.headers
+    assert "Vary" not in small.headers
+
+    body = {"modules": ["x" * 10] * 20}
+    identity = compress_response(Response(body=body), None, min_size=100)
+    assert identity.body == body
+    assert identity.headers["Vary"] == "Accept-Encoding"
+
+    response = compress_response(Response(body=body), "gzip", min_size=100)
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert json.loads(gzip.decompress(response.body)) == body
+
+    lambda_response = response.to_dict([])
+    assert lambda_response["isBase64Encoded"]
+    assert base64.b64decode(lambda_response["body"]) == response.body
+
+
+def test_compress_response_caches_tagged_bodies(gzip_only, monkeypatch):
+    from chalice import Response
+
+    from chalicelib import compression
+
+    calls = []
+    compress = compression.compress
+
+    def counted_compress(*args, **kwargs):
+        calls.append(args)
+        return compress(*args, **kwargs)
+
+    monkeypatch.setattr(compression, "compress", counted_compress)
+
+    for _ in range(3):
+        response = compression.compress_response(
+            Response(body="x" * 2_000, headers={"ETag": '"tag"'}), "gzip", min_size=100
+        )
+        assert response.headers["ETag"] == 'W/"tag"'
+        assert gzip.decompress(response.body) == b"x" * 2_000
+
+    assert len(calls) == 1
+    assert compression.compressed_bodies.stats()["hits"] == 2
+
+
+def test_list_versions_is_compressed(app, client: RequestHandler, gzip_only) -> None:
+    from chalice.config import Config
+    from chalice.local import LocalGateway
+
+    from chalicelib.models import ModuleModel, ModuleName
+    from chalicelib.stamps import touch
+
+    fqmn = ModuleName("compression", "name", "provider")
+    versions = [f"1.0.{patch}" for patch in range(100)]
+    for version in versions:
+        ModuleModel(fqmn, version, getter_url="https://example.com").save()
+    touch([fqmn])
+
+    path = f"/modules/{fqmn}/versions"
+    # The test client expects text bodies, the gateway decodes the base64 ones
+    response = LocalGateway(app, Config()).handle_request(
+        method="GET", path=path, headers={"Accept-Encoding": "gzip"}, body=None
+    )
+    assert response["statusCode"] == HTTPStatus.OK
+    assert response["headers"]["Content-Encoding"] == "gzip"
+    assert response["headers"]["Vary"] == "Accept-Encoding"
+    assert response["isBase64Encoded"]
+    listed = json.loads(gzip.decompress(response["body"]))
+    assert len(listed["modules"][0]["versions"]) == 100
+
+    tag = response["headers"]["ETag"]
+    assert tag.startswith("W/")
+    response = client.get(path, headers={"If-None-Match": tag})
+    assert response.status_code == HTTPStatus.NOT_MODIFIED
+
+    response = client.get(path)
+    assert "Content-Encoding" not in response.headers
+    assert len(response.json["modules"][0]["versions"]) == 100
@@ -0,0 +1,68 @@
+#  Copyright (c) 2020 Zero A.E., LLC
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import pytest
+
+VERSIONS = [
+    "1.0.0",
+    "1.2.0",
+    "1.10.1",
+    "2.0.0-rc.1",
+    "3.2.0",
+    "3.2.7",
+    "3.9.0",
+    "4.0.0",
+    "not-semver",
+]
+
+
+@pytest.mark.parametrize(
+    "constraint, expected",
+    [
+        ("", "4.0.0"),
+        ("~> 3.2", "3.9.0"),
+        ("~> 3.2.1", "3.2.7"),
+        ("~> 3", "3.9.0"),
+        (">= 1.0, < 2.0", "1.10.1"),
+        ("1.2", "1.2.0"),
+        ("= 1.2.0", "1.2.0"),
+        ("v1.2.0", "1.2.0"),
+        ("!= 4.0.0", "3.9.0"),
+        ("< 1", None),
+        # Prereleases are only selected by an exact constraint
+        ("2.0.0-rc.1", "2.0.0-rc.1"),
+        ("> 1.10.1, < 3", None),
+        (">= 2.0.0-rc.1, < 3", None),
+    ],
+)
+def test_select(constraint, expected):
+    from chalicelib.constraints import compile_constraint, parse_versions
+
+    selected = compile_constraint(constraint).select(parse_versions(VERSIONS))
+    assert (str(selected) if selected else None) == expected
+
+
+@pytest.mark.parametrize("constraint", [">= 1.0,", "~>", "latest", ">> 1", "1.2.3.4"])
+def test_invalid_constraints(constraint):
+    from chalicelib.constraints import InvalidConstraint, compile_constraint
+
+    with pytest.raises(InvalidConstraint):
+        compile_constraint(constraint)
+
+
+def test_parse_versions():
+    from chalicelib.constraints import parse_versions
+
+    assert [str(v) for v in parse_versions(VERSIONS)[:3]] == ["4.0.0", "3.9.0", "3.2.7"]
+    assert len(parse_versions(VERSIONS)) == len(VERSIONS) - 1
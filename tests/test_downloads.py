@@ -0,0 +1,152 @@
+#  Copyright (c) 2020 Zero A.E., LLC
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import pytest
+
+
+@pytest.fixture(name="fqmn")
+def fixture_fqmn():
+    from chalicelib.models import ModuleName
+
+    return ModuleName("downloads", "name", "provider")
+
+
+@pytest.fixture(name="counter")
+def fixture_counter(monkeypatch):
+    from chalicelib.downloads import DownloadCounter
+
+    counter = DownloadCounter(flush_size=2, flush_seconds=3_600, rollup_seconds=3_600)
+    # Keep the flushes in the foreground, so the tests are deterministic
+    monkeypatch.setattr(counter, "_request_flush", lambda: None)
+    return counter
+
+
+def test_counter_aggregates_in_memory(counter, fqmn, monkeypatch):
+    from chalicelib.models import DownloadCounterModel
+
+    updates = []
+    monkeypatch.setattr(
+        DownloadCounterModel, "update", lambda self, actions: updates.append(self)
+    )
+
+    for _ in range(5):
+        counter.record(fqmn, "1.0.0")
+    counter.record(fqmn, "1.1.0")
+
+    assert updates == []
+    assert counter.pending == 6
+    assert counter.flush() == 6
+    assert len(updates) == 2
+    assert counter.pending == 0
+
+
+def test_counter_sums_shards(counter, fqmn):
+    for _ in range(20):
+        counter.record(fqmn, "2.0.0")
+        counter.flush()
+
+    assert counter.count(fqmn, "2.0.0") == 20
+    assert counter.count(fqmn, "0.0.0") == 0
+
+
+def test_counter_keeps_failed_increments(counter, fqmn, monkeypatch):
+    from pynamodb.exceptions import UpdateError
+
+    from chalicelib.models import DownloadCounterModel
+
+    def failing_update(self, actions):
+        raise UpdateError()
+
+    counter.record(fqmn, "3.0.0", count=3)
+    monkeypatch.setattr(DownloadCounterModel, "update", failing_update)
+
+    assert counter.flush() == 0
+    assert counter.pending == 3
+
+
+def test_counter_survives_connection_errors(counter, fqmn, monkeypatch):
+    from botocore.exceptions import EndpointConnectionError
+
+    from chalicelib.models import DownloadCounterModel
+
+    def failing_update(self, actions):
+        raise EndpointConnectionError(endpoint_url="http://localhost")
+
+    counter.record(fqmn, "3.1.0", count=2)
+    monkeypatch.setattr(DownloadCounterModel, "update", failing_update)
+
+    assert counter.flush() == 0
+    assert counter.pending == 2
+
+
+def test_counter_rolls_up_into_the_module(counter, fqmn):
+    from chalicelib.models import ModuleModel
+
+    module = ModuleModel(fqmn, "5.0.0", getter_url="./name")
+    module.save()
+
+    counter.record(fqmn, "5.0.0", count=3)
+    counter.flush()
+    counter.record(fqmn, "5.0.0", count=2)
+    counter.flush()
+    # Deleted module versions are not re-created
+    counter.record(fqmn, "5.1.0")
+    counter.flush()
+
+    # Only rolled up every rollup_seconds
+    assert ModuleModel.get(fqmn, "5.0.0").downloads == 0
+    assert counter.rollup() == 1
+
+    assert ModuleModel.get(fqmn, "5.0.0").downloads == 5
+    assert ModuleModel.count(fqmn, ModuleModel.version == "5.1.0") == 0
+
+    module.delete()
+
+
+def test_counter_rolls_up_on_its_schedule(fqmn, monkeypatch):
+    from chalicelib.downloads import DownloadCounter
+    from chalicelib.models import ModuleModel
+
+    now = [0.0]
+    counter = DownloadCounter(
+        flush_size=100, flush_seconds=3_600, rollup_seconds=60, clock=lambda: now[0]
+    )
+    calls = []
+    monkeypatch.setattr(
+        ModuleModel, "update", lambda self, **kwargs: calls.append(self)
+    )
+
+    for second in range(0, 120, 10):
+        now[0] = second
+        counter.record(fqmn, "6.0.0")
+        counter.flush()
+
+    # One roll-up of the version, not one per flush
+    assert len(calls) == 1
+
+
+def test_counter_flushes_in_the_background(fqmn):
+    from time import sleep
+
+    from chalicelib.downloads import DownloadCounter
+
+    counter = DownloadCounter(flush_size=1, flush_seconds=3_600)
+    counter.record(fqmn, "4.0.0")
+
+    for _ in range(50):
+        if counter.pending == 0:
+            break
+        sleep(0.1)
+
+    assert counter.count(fqmn, "4.0.0") == 1
@@ -0,0 +1,175 @@
+#  Copyright (c) 2020 Zero A.E., LLC
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import json
+from collections import Counter
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+
+import pytest
+
+UPSTREAM_VERSIONS = [f"upstream/module-{i}/aws/1.{i % 3}.0" for i in range(60)]
+MALFORMED_VERSION = "upstream/malformed/aws/1.0.0"
+
+
+class UpstreamRegistryHandler(BaseHTTPRequestHandler):
+    """A stand-in for the modules.v1 API of an upstream registry"""
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def _send(self, status: int, body=None, headers=None) -> None:
+        self.send_response(status)
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        payload = json.dumps(body).encode() if body is not None else b""
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self) -> None:
+        self.server.requests[self.path.split("/")[1]] += 1
+        if self.path == "/.well-known/terraform.json":
+            return self._send(HTTPStatus.OK, {"modules.v1": "/v1/modules/"})
+
+        fqvmn = self.path[len("/v1/modules/") :]
+        if fqvmn == MALFORMED_VERSION:
+            self.send_response(HTTPStatus.OK)
+            self.send_header("Content-Length", "9")
+            self.end_headers()
+            return self.wfile.write(b"<html/>\r\n")
+        if fqvmn.endswith("/download"):
+            fqvmn = fqvmn[: -len("/download")]
+            if fqvmn in UPSTREAM_VERSIONS:
+                return self._send(
+                    HTTPStatus.NO_CONTENT, headers={"X-Terraform-Get": f"./{fqvmn}"}
+                )
+        elif fqvmn in UPSTREAM_VERSIONS:
+            namespace, name, provider, version = fqvmn.split("/")
+            return self._send(
+                HTTPStatus.OK,
+                {
+                    "id": fqvmn,
+                    "owner": "owner",
+                    "namespace": namespace,
+                    "name": name,
+                    "version": version,
+                    "provider": provider,
+                    "description": f"The {name} module",
+                    "source": f"https://github.com/{namespace}/{name}",
+                    "published_at": "2020-03-01T12:00:00.000000Z",
+                    "downloads": 0,
+                    "verified": True,
+                },
+            )
+        self._send(HTTPStatus.NOT_FOUND, {"errors": ["Not Found"]})
+
+
+@pytest.fixture(name="upstream")
+def fixture_upstream() -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("localhost", 0), UpstreamRegistryHandler)
+    server.requests = Counter()
+    thread = Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(name="upstream_url")
+def fixture_upstream_url(upstream: ThreadingHTTPServer) -> str:
+    host, port = upstream.server_address[:2]
+    return f"http://{host}:{port}"
+
+
+def test_parse_manifest():
+    from chalicelib.importer import parse_manifest
+
+    manifest = parse_manifest(
+        [
+            "# comment",
+            "",
+            "ns/name/aws/1.0.0",
+            "http://localhost:8000/ns/name/aws/1.1.0",
+        ],
+        "registry.terraform.io",
+    )
+
+    assert manifest == [
+        ("registry.terraform.io", "ns", "name", "aws", "1.0.0"),
+        ("http://localhost:8000", "ns", "name", "aws", "1.1.0"),
+    ]
+
+    with pytest.raises(ValueError):
+        parse_manifest(["ns/name/1.0.0"], "registry.terraform.io")
+
+
+def test_registry_client_fetch(upstream_url: str):
+    from chalicelib.importer import ModuleNotFound, RegistryClient
+    from chalicelib.models import ModuleName
+
+    client = RegistryClient(upstream_url)
+    module = client.fetch(ModuleName("upstream", "module-1", "aws"), "1.1.0")
+
+    assert module.getter_url == "./upstream/module-1/aws/1.1.0"
+    assert module.description == "The module-1 module"
+    assert module.verified is True
+    assert module.published_at.year == 2020
+
+    with pytest.raises(ModuleNotFound):
+        client.fetch(ModuleName("upstream", "module-1", "aws"), "9.9.9")
+
+
+def test_bulk_import(upstream, upstream_url: str):
+    from chalicelib.importer import BulkImporter
+    from chalicelib.models import ModuleModel, ModuleName
+
+    manifest = [
+        (upstream_url, *fqvmn.split("/")) for fqvmn in UPSTREAM_VERSIONS
+    ] + [(upstream_url, "upstream", "missing", "aws", "1.0.0")]
+
+    report = BulkImporter(workers=8).run(manifest)
+
+    assert report.requested == len(UPSTREAM_VERSIONS) + 1
+    assert report.imported == len(UPSTREAM_VERSIONS)
+    assert list(report.failures) == [f"{upstream_url}/upstream/missing/aws/1.0.0"]
+    assert upstream.requests[".well-known"] == 1
+    assert "Imported 60 of 61" in str(report)
+
+    module = ModuleModel.get(ModuleName("upstream", "module-59", "aws"), "1.2.0")
+    assert module.getter_url == "./upstream/module-59/aws/1.2.0"
+
+
+def test_bulk_import_reports_every_failure(upstream_url: str):
+    from chalicelib.importer import BulkImporter
+
+    module = "upstream/module-0/aws/1.0.0"
+    manifest = [
+        (upstream_url, *module.split("/")),
+        (upstream_url, *MALFORMED_VERSION.split("/")),
+        (upstream_url, *module.split("/")),
+        ("registry.terraform.io", *module.split("/")),
+    ]
+
+    report = BulkImporter(workers=2).run(manifest)
+
+    assert report.imported == 1
+    assert len(report.failures) == 3
+    assert "JSONDecodeError" in report.failures[f"{upstream_url}/{MALFORMED_VERSION}"]
+    for duplicate in [
+        f"{upstream_url}/{module} (entry 3)",
+        f"registry.terraform.io/{module} (entry 4)",
+    ]:
+        assert report.failures[duplicate] == f"duplicate of {upstream_url}/{module}"
@@ -0,0 +1,122 @@
+#  Copyright (c) 2020 Zero A.E., LLC
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import pytest
+from chalice import Chalice
+
+
+@pytest.fixture(name="transport")
+def fixture_transport(app: Chalice):
+    from chalice.config import Config
+    from chalice.local import LocalGateway
+
+    from chalicelib.downloads import get_counter
+
+    # The app in-process, instead of over HTTP
+    gateway = LocalGateway(app, Config())
+
+    def transport(method, path):
+        response = gateway.handle_request(method, path, {"host": "localhost"}, b"")
+        headers = {k.lower(): v for k, v in response["headers"].items()}
+        return response["statusCode"], headers, response["body"]
+
+    yield transport
+    get_counter().flush()
+
+
+@pytest.fixture(name="catalog")
+def fixture_catalog():
+    from chalicelib.repository import get_repository
+    from chalicelib.stamps import touch
+    from chalicelib.synthetic import CatalogShape, generate, module_names
+
+    shape = CatalogShape(namespaces=1, names=3, providers=1, versions=4)
+    get_repository().save_many(generate(shape))
+    touch(module_names(shape))
+    yield [str(m) for m in module_names(shape)]
+
+    for module in generate(shape):
+        get_repository().delete(module.module_name, module.version)
+
+
+def test_popularity():
+    from chalicelib.loadtest import popularity
+
+    zipf = popularity(3, "zipf", exponent=1.0)
+    assert zipf == pytest.approx([1, 1.5, 1.5 + 1 / 3])
+    assert popularity(3, "uniform") == [1, 2, 3]
+    with pytest.raises(ValueError):
+        popularity(3, "pareto")
+
+
+def test_percentile():
+    from chalicelib.loadtest import RouteStats
+
+    stats = RouteStats(latencies=[float(i) for i in range(100, 0, -1)])
+    assert [stats.percentile(p) for p in (50, 95, 99, 100)] == [50, 95, 99, 100]
+    assert RouteStats().percentile(50) is None
+
+
+def test_list_modules(transport, catalog):
+    from chalicelib.loadtest import list_modules
+
+    assert sorted(list_modules(transport)) == sorted(catalog)
+    assert len(list_modules(transport, limit=2)) == 2
+
+
+def test_load_generator(transport, catalog):
+    from chalicelib.loadtest import ROUTES, LoadGenerator
+
+    report = LoadGenerator(
+        transport, catalog, concurrency=2, duration=0.5, latest_share=0.5
+    ).run()
+
+    assert report.flows > 0
+    assert report.failed_flows == 0
+    assert report.routes["discovery"].requests == report.flows
+    assert report.routes["download"].requests == report.flows
+    assert 0 < report.routes["download_latest"].requests < report.flows
+    assert report.throughput > 0
+
+    summary = report.to_json()
+    assert set(summary["routes"]) == set(ROUTES)
+    versions = summary["routes"]["list_versions"]
+    assert versions["errors"] == versions["throttled"] == 0
+    assert 0 < versions["p50_ms"] <= versions["p95_ms"] <= versions["p99_ms"]
+    assert "list_versions" in str(report)
+
+
+def test_errors_and_throttles(transport, catalog):
+    from chalicelib.loadtest import LoadGenerator
+
+    def throttling(method, path):
+        if path.endswith("/versions"):
+            return 429, {}, b""
+        return transport(method, path)
+
+    generator = LoadGenerator(throttling, catalog, concurrency=1, duration=0.1)
+    report = generator.run()
+    assert report.flows == 0
+    assert report.failed_flows == report.routes["list_versions"].throttled > 0
+    assert report.routes["download"].requests == 0
+
+    def resetting(method, path):
+        if path.endswith("/download"):
+            raise ConnectionResetError()
+        return transport(method, path)
+
+    generator = LoadGenerator(resetting, catalog, concurrency=1, duration=0.1)
+    report = generator.run()
+    errors = [report.routes[r].errors for r in ("download_latest", "download")]
+    assert report.failed_flows == sum(errors) > 0
@@ -0,0 +1,157 @@
+#  Copyright (c) 2020 Zero A.E., LLC
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import json
+from http import HTTPStatus
+
+import pytest
+from pytest_chalice.handlers import RequestHandler
+
+
+@pytest.fixture(name="metrics")
+def fixture_metrics():
+    from chalicelib.metrics import metrics
+
+    metrics.reset()
+    yield metrics
+    metrics.reset()
+
+
+def test_histogram_buckets():
+    from chalicelib.metrics import Histogram
+
+    histogram = Histogram(buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 2.0):
+        histogram.observe(value)
+
+    assert list(histogram.cumulative()) == [("0.1", 2), ("1.0", 3), ("+Inf", 4)]
+    assert histogram.count == 4
+    assert histogram.sum == pytest.approx(2.65)
+
+
+def test_consumed_capacity():
+    from chalicelib.metrics import consumed_capacity
+
+    assert consumed_capacity(None) == {}
+    assert consumed_capacity({}) == {}
+    assert consumed_capacity(
+        {"ConsumedCapacity": {"TableName": "t", "CapacityUnits": 0.5}}
+    ) == {"t": 0.5}
+    assert consumed_capacity(
+        {
+            "ConsumedCapacity": [
+                {"TableName": "t", "CapacityUnits": 1.0},
+                {"TableName": "u", "CapacityUnits": 2.0},
+                {"TableName": "t", "CapacityUnits": 0.5},
+            ]
+        }
+    ) == {"t": 1.5, "u": 2.0}
+
+
+def test_backend_calls_are_attributed_to_the_request():
+    from chalicelib.cache import TTLCache
+    from chalicelib.metrics import Metrics
+
+    lines = []
+    metrics = Metrics(emf=True, namespace="Test", write=lines.append)
+    cache = TTLCache(maxsize=1, ttl=60, negative_ttl=60)
+    metrics.register_cache("cache", cache)
+    cache.get("key", lambda: "value")
+    cache.get("key", lambda: "value")
+
+    with metrics.request("route"):
+        metrics.backend_call("Query", 0.01, {"table": 0.5})
+        metrics.backend_call("GetItem", 0.02, {"table": 1.0})
+    metrics.backend_call("UpdateItem", 0.01, {"table": 1.0})
+
+    assert metrics.backend_calls == {
+        ("route", "Query"): 1,
+        ("route", "GetItem"): 1,
+        ("background", "UpdateItem"): 1,
+    }
+    assert metrics.capacity == {("route", "table"): 1.5, ("background", "table"): 1.0}
+    assert metrics.latencies["route"].count == 1
+
+    (line,) = lines
+    emf = json.loads(line)
+    directives = emf["_aws"]["CloudWatchMetrics"]
+    assert directives[0]["Namespace"] == "Test"
+    assert directives[0]["Dimensions"] == [["Route"]]
+    assert {m["Name"] for m in directives[0]["Metrics"]} == {
+        "Latency",
+        "BackendLatency",
+        "BackendCalls",
+        "ConsumedCapacity",
+    }
+    assert emf["Route"] == "route"
+    assert emf["BackendCalls"] == 2
+    assert emf["ConsumedCapacity"] == 1.5
+    assert emf["cache.HitRate"] == 50.0
+
+
+def test_prometheus():
+    from chalicelib.metrics import Metrics
+
+    metrics = Metrics(emf=False)
+    with metrics.request("route"):
+        metrics.backend_call("Query", 0.01, {"table": 0.5})
+
+    text = metrics.prometheus()
+    assert "# TYPE ztr_route_latency_seconds histogram" in text
+    assert 'ztr_route_latency_seconds_bucket{route="route",le="+Inf"} 1' in text
+    assert 'ztr_route_latency_seconds_count{route="route"} 1' in text
+    assert 'ztr_backend_calls_total{route="route",operation="Query"} 1' in text
+    assert 'ztr_consumed_capacity_units_total{route="route",table="table"} 0.5' in text
+
+
+def test_prometheus_singleflight():
+    from chalicelib.cache import TTLCache
+    from chalicelib.metrics import Metrics
+    from chalicelib.singleflight import SingleFlight
+
+    metrics = Metrics(emf=False)
+    flights = SingleFlight()
+    metrics.register_flights("lookups", flights)
+    metrics.register_cache("cache", TTLCache(maxsize=1, ttl=60, negative_ttl=60))
+    flights.do("key", lambda: "value")
+
+    text = metrics.prometheus()
+    assert "# TYPE ztr_singleflight_collapsed_total counter" in text
+    assert 'ztr_singleflight_calls_total{group="lookups"} 1' in text
+    assert 'ztr_singleflight_collapsed_total{group="lookups"} 0' in text
+    assert 'ztr_singleflight_calls_total{group="cache"} 0' in text
+
+
+def test_routes_record_dynamodb_calls(client: RequestHandler, metrics, monkeypatch):
+    from chalicelib.modules import getter_urls
+    from chalicelib.repository import get_repository
+    from chalicelib.stamps import stamps
+
+    get_repository()
+    getter_urls.clear()
+    stamps.clear()
+    response = client.get("/modules/metrics/name/provider/1.0.0/download")
+    assert response.status_code == HTTPStatus.NOT_FOUND
+
+    assert metrics.latencies["download"].count == 1
+    assert metrics.backend_calls[("download", "GetItem")] >= 1
+    assert sum(metrics.capacity.values()) > 0
+
+    monkeypatch.delenv("AWS_LAMBDA_FUNCTION_NAME", raising=False)
+    response = client.get("/metrics")
+    assert response.status_code == HTTPStatus.OK
+    assert 'route="download"' in response.body
+
+    monkeypatch.setenv("AWS_LAMBDA_FUNCTION_NAME", "terraform-registry-dev")
+    assert client.get("/metrics").status_code == HTTPStatus.NOT_FOUND
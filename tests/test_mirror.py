@@ -0,0 +1,191 @@
+#  Copyright (c) 2020 Zero A.E., LLC
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import gzip
+import io
+import os
+import shutil
+import subprocess
+import tarfile
+from http import HTTPStatus
+
+import pytest
+from pytest_chalice.handlers import RequestHandler
+
+
+def write_tree(root, mtime: int = 0) -> None:
+    os.makedirs(root / "modules" / "vpc", exist_ok=True)
+    (root / "main.tf").write_text('module "vpc" { source = "./modules/vpc" }\n')
+    (root / "modules" / "vpc" / "main.tf").write_text("# vpc\n")
+    (root / "run.sh").write_text("#!/bin/sh\n")
+    os.chmod(root / "run.sh", 0o775)
+    for path in ("main.tf", "run.sh", "modules/vpc/main.tf"):
+        os.utime(root / path, (mtime, mtime))
+
+
+@pytest.mark.parametrize(
+    "getter_url, expected",
+    [
+        ("github.com/org/repo?ref=v1", ("github.com/org/repo?ref=v1", "")),
+        (
+            "git::https://example.com/repo.git//modules/vpc?ref=v1",
+            ("git::https://example.com/repo.git?ref=v1", "modules/vpc"),
+        ),
+        ("https://example.com/m.tgz//sub", ("https://example.com/m.tgz", "sub")),
+    ],
+)
+def test_split_subdir(getter_url, expected):
+    from chalicelib.mirror import split_subdir
+
+    assert split_subdir(getter_url) == expected
+
+
+def test_build_archive_is_deterministic(tmp_path):
+    from chalicelib.mirror import build_archive
+
+    write_tree(tmp_path / "a", mtime=1_000)
+    write_tree(tmp_path / "b", mtime=2_000)
+    os.makedirs(tmp_path / "b" / ".git")
+    (tmp_path / "b" / ".git" / "HEAD").write_text("ref: refs/heads/main\n")
+
+    archive = build_archive(str(tmp_path / "a"))
+    assert archive == build_archive(str(tmp_path / "b"))
+
+    with tarfile.open(fileobj=io.BytesIO(gzip.decompress(archive))) as tar:
+        members = {m.name: m for m in tar.getmembers()}
+    assert set(members) == {
+        "main.tf",
+        "modules",
+        "modules/vpc",
+        "modules/vpc/main.tf",
+        "run.sh",
+    }
+    assert members["run.sh"].mode == 0o755
+    assert members["main.tf"].mode == 0o644
+    assert {m.mtime for m in members.values()} == {0}
+
+
+def test_fetch_source_rejects_unsupported_getters(tmp_path):
+    from chalicelib.mirror import UnsupportedSource, fetch_source
+
+    with pytest.raises(UnsupportedSource):
+        fetch_source("hg::https://example.com/repo", str(tmp_path))
+    with pytest.raises(UnsupportedSource):
+        fetch_source("https://example.com/not-an-archive", str(tmp_path))
+
+
+@pytest.fixture(name="mirrored")
+def fixture_mirrored():
+    from chalicelib.models import ModuleModel, ModuleName
+    from chalicelib.repository import get_repository
+
+    fqmn = ModuleName("mirror", "name", "provider")
+    modules = [
+        ModuleModel(
+            fqmn, version, getter_url=f"git::https://example.com/repo?ref={ref}"
+        )
+        for version, ref in (("1.0.0", "v1"), ("1.0.1", "v1-retag"), ("2.0.0", "v2"))
+    ]
+    yield modules
+
+    for module in modules:
+        get_repository().delete(module.module_name, module.version)
+
+
+def test_mirror(mirrored, tmp_path, client: RequestHandler):
+    from chalicelib.blobs import LocalBlobStore
+    from chalicelib.downloads import get_counter
+    from chalicelib.mirror import Mirror, archive_key
+    from chalicelib.modules import getter_urls
+    from chalicelib.repository import get_repository
+
+    fetched = []
+
+    def fetch(url, destination):
+        fetched.append(url)
+        source = tmp_path / "sources" / url.rpartition("=")[2]
+        write_tree(source)
+        # v1 and v1-retag have the same content, v2 has another one
+        if url.endswith("v2"):
+            (source / "outputs.tf").write_text("\n")
+        # The destination exists, copytree only takes dirs_exist_ok as of 3.8
+        for entry in source.iterdir():
+            target = os.path.join(destination, entry.name)
+            if entry.is_dir():
+                shutil.copytree(str(entry), target)
+            else:
+                shutil.copy2(str(entry), target)
+
+    store = LocalBlobStore(str(tmp_path / "store"))
+    mirror = Mirror(store, base_url="https://mirror.example.com/", fetch=fetch)
+    report = mirror.run(mirrored)
+    assert (report.mirrored, report.stored, report.deduplicated) == (3, 2, 1)
+    assert len(fetched) == 3
+
+    fqmn = mirrored[0].module_name
+    modules = {m.version: m for m in get_repository().module_versions(fqmn)}
+    assert modules["1.0.0"].archive_sha256 == modules["1.0.1"].archive_sha256
+    assert modules["1.0.0"].archive_sha256 != modules["2.0.0"].archive_sha256
+    digest = modules["2.0.0"].archive_sha256
+    assert store.exists(archive_key(digest))
+
+    getter_urls.clear()
+    response = client.get("/modules/mirror/name/provider/2.0.0/download")
+    assert response.status_code == HTTPStatus.NO_CONTENT
+    assert response.headers["X-Terraform-Get"] == (
+        f"https://mirror.example.com/{archive_key(digest)}"
+        f"?archive=tar.gz&checksum=sha256:{digest}"
+    )
+
+    get_counter().flush()
+
+    report = mirror.run(get_repository().module_versions(fqmn))
+    assert (report.mirrored, report.skipped) == (0, 3)
+
+
+def test_mirror_replaces_corrupted_archives(tmp_path):
+    from chalicelib.blobs import LocalBlobStore
+    from chalicelib.mirror import Mirror, archive_key
+
+    store = LocalBlobStore(str(tmp_path))
+    mirror = Mirror(store)
+    digest, written = mirror.store_archive(b"archive")
+    assert written
+    assert mirror.store_archive(b"archive") == (digest, False)
+
+    store.put(archive_key(digest), b"corrupted")
+    assert mirror.store_archive(b"archive") == (digest, True)
+    assert store.get(archive_key(digest)) == b"archive"
+
+
+@pytest.mark.skipif(shutil.which("git") is None, reason="git is not installed")
+def test_fetch_git(tmp_path):
+    from chalicelib.mirror import fetch_source
+
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    write_tree(repo)
+
+    def git(*args):
+        subprocess.run(["git", *args], cwd=repo, check=True, capture_output=True)
+
+    git("init", "--quiet")
+    git("add", ".")
+    git("-c", "user.name=t", "-c", "user.email=t@example.com", "commit", "-qm", "v1")
+    git("tag", "v1.0.0")
+
+    destination = tmp_path / "checkout"
+    destination.mkdir()
+    fetch_source(f"git::file://{repo}?ref=v1.0.0", str(destination))
+    assert (destination / "modules" / "vpc" / "main.tf").read_text() == "# vpc\n"
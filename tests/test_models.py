@@ -48,3 +48,81 @@ def test_module_name_attribute_deserialize():
 
     fqmn: ModuleName = mn_attr.deserialize("namespace/name/provider")
     assert fqmn == ModuleName("namespace", "name", "provider")
+
+
+def test_module_model_serialize_version_key():
+    from chalicelib.models import ModuleModel, ModuleName
+    from chalicelib.versions import version_key
+
+    module = ModuleModel(
+        ModuleName("namespace", "name", "provider"), "1.0.0-rc.1", getter_url="."
+    )
+
+    assert module.serialize()["version_key"] == {"S": version_key("1.0.0-rc.1")}
+
+
+def test_module_model_latest():
+    from chalicelib.models import ModuleModel, ModuleName
+
+    fqmn = ModuleName("namespace", "latest", "provider")
+    for version in ["1.10.0", "1.9.0", "2.0.0-beta"]:
+        ModuleModel(fqmn, version, getter_url="./latest").save()
+
+    assert ModuleModel.latest(fqmn).version == "2.0.0-beta"
+    assert ModuleModel.latest(ModuleName("namespace", "dne", "provider")) is None
+
+
+def test_module_model_serialize_updated_at():
+    from chalicelib.models import ModuleModel, ModuleName
+
+    module = ModuleModel(ModuleName("namespace", "name", "provider"), "1.0.0")
+    module.getter_url = "."
+    item = module.serialize()
+
+    assert module.updated_at is not None
+    assert item["updated_day"] == {"S": module.updated_at.strftime("%Y-%m-%d")}
+
+
+def test_db_create_missing_indexes():
+    from chalicelib.db import db_create_missing_indexes
+    from chalicelib.models import ModuleModel
+
+    connection = ModuleModel._get_connection()
+    for index_name in ["updated_day-index", "namespace-index"]:
+        connection.connection.client.update_table(
+            TableName=ModuleModel.Meta.table_name,
+            GlobalSecondaryIndexUpdates=[{"Delete": {"IndexName": index_name}}],
+        )
+
+    assert sorted(db_create_missing_indexes(ModuleModel)) == [
+        "namespace-index",
+        "updated_day-index",
+    ]
+    assert db_create_missing_indexes(ModuleModel) == []
+
+
+def test_db_backfill():
+    from chalicelib.db import db_backfill
+    from chalicelib.models import ModuleModel, ModuleName
+
+    fqmn = ModuleName("namespace", "backfill", "provider")
+    for version in ["1.0.0", "latest"]:
+        module = ModuleModel(fqmn, version, getter_url="./backfill")
+        module.save()
+        # As written by an older deployment
+        module.update(
+            actions=[
+                ModuleModel.version_key.remove(),
+                ModuleModel.namespace.remove(),
+                ModuleModel.namespace_name.remove(),
+            ]
+        )
+
+    invalid = ["namespace/backfill/provider/latest"]
+    assert db_backfill() == (2, invalid)
+    assert ModuleModel.latest(fqmn).version == "1.0.0"
+    assert ModuleModel.namespace_name_index.count("namespace/backfill") == 2
+    assert db_backfill() == (0, invalid)
+
+    for version in ["1.0.0", "latest"]:
+        ModuleModel(fqmn, version).delete()
@@ -12,12 +12,26 @@
 #
 #  You should have received a copy of the GNU Affero General Public License
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import json
 from http import HTTPStatus
 
 import pytest
 from pytest_chalice.handlers import RequestHandler
 
 
+@pytest.fixture(autouse=True)
+def clear_caches() -> None:
+    from chalicelib.downloads import get_counter
+    from chalicelib.modules import getter_urls, module_versions
+    from chalicelib.stamps import stamps
+
+    getter_urls.clear()
+    module_versions.clear()
+    stamps.clear()
+    yield
+    get_counter().flush()
+
+
 @pytest.fixture(name="modules_api")
 def fixture_modules_api(client: RequestHandler) -> str:
     response = client.get("/.well-known/terraform.json")
@@ -46,54 +60,245 @@ def test_list_versions_response_schema(
     assert type(first_module["versions"]) == list
 
 
-def test_list_versions(modules_api: str, client: RequestHandler, monkeypatch) -> None:
+def test_list_versions(
+    modules_api: str, client: RequestHandler, saved_versions, monkeypatch
+) -> None:
+    from chalicelib import dynamodb
     from chalicelib.models import ModuleModel
 
-    fqmn = "namespace/name/provider"
-    versions = ["0.1.0", "0.2.0", "0.3.0"]
+    fqmn, versions = saved_versions
+    queries = []
+    query = ModuleModel.version_index.query
 
-    def mock_query(hash_key, **kwargs):
-        return [ModuleModel(hash_key, version=version) for version in versions]
+    def spy_query(hash_key, **kwargs):
+        queries.append(kwargs)
+        return query(hash_key, **kwargs)
 
-    monkeypatch.setattr(ModuleModel, "query", mock_query)
+    monkeypatch.setattr(ModuleModel.version_index, "query", spy_query)
+    monkeypatch.setattr(dynamodb, "ZTR_LIMIT", 4)
 
     response = client.get(f"{modules_api}/{fqmn}/versions")
     response_versions = [v["version"] for v in response.json["modules"][0]["versions"]]
 
+    # In semantic version order, not in the (string) order of the range key
     assert response_versions == versions
+    assert len(queries) == 2
+    assert all(q["attributes_to_get"] == ["version"] for q in queries)
+
+
+@pytest.fixture(name="saved_versions")
+def fixture_saved_versions():
+    from random import shuffle
+
+    from chalicelib.downloads import get_counter
+    from chalicelib.models import (
+        DownloadCounterModel,
+        ModuleModel,
+        ModuleName,
+        ModuleSummaryModel,
+    )
+    from chalicelib.stamps import touch
+
+    fqmn = ModuleName("saved", "name", "provider")
+    versions = ["0.0.0", "0.9.0", "0.10.0-rc.1", "0.10.0-rc.2", "0.10.0", "0.11.0-rc.1"]
+
+    shuffled = list(versions)
+    shuffle(shuffled)
+    for version in shuffled:
+        ModuleModel(fqmn, version, getter_url=f"./name?ref={version}").save()
+    touch([fqmn])
+
+    yield str(fqmn), versions
+
+    for version in versions:
+        ModuleModel(fqmn, version).delete()
+    ModuleSummaryModel(fqmn).delete()
+    # The downloads recorded by the test are flushed before their shards go
+    get_counter().flush()
+    for counter in DownloadCounterModel.scan(
+        DownloadCounterModel.counter_id.startswith(f"{fqmn}/")
+    ):
+        counter.delete()
+
+
+def test_download_latest(
+    modules_api: str, client: RequestHandler, saved_versions
+) -> None:
+    fqmn, versions = saved_versions
+    fqvmn = f"{fqmn}/{versions[-1]}"
 
+    response = client.get(f"{modules_api}/{fqmn}/download")
 
-def test_download_latest(modules_api: str, client: RequestHandler, monkeypatch) -> None:
+    assert response.status_code == HTTPStatus.FOUND
+    assert "Location" in response.headers
+    assert response.headers["Location"] == f"{modules_api}/{fqvmn}/download"
+
+
+def test_versions_from_summary(
+    modules_api: str, client: RequestHandler, saved_versions, monkeypatch
+) -> None:
     from chalicelib.models import ModuleModel
+    from chalicelib.repository import get_repository
 
-    fqmn = "namespace/name/provider"
-    versions = ["0.0.0", "0.9.0", "0.10.0"]
-    fqvmn = f"{fqmn}/{versions[-1]}"
+    fqmn, versions = saved_versions
+    # The fixture writes the versions around the repository, as older deployments
+    # did, so they are only listed from the version index
+    module_name = ModuleModel.module_name.deserialize(fqmn)
+    assert get_repository().summary(module_name).versions is None
+    get_repository().rebuild_summaries([module_name])
 
-    def mock_query(hash_key, **kwargs):
-        from random import shuffle
+    def failing_query(*args, **kwargs):
+        raise AssertionError("The versions are read from the summary")
 
-        shuffle(versions)
-        return [ModuleModel(hash_key, version=version) for version in versions]
+    monkeypatch.setattr(ModuleModel.version_index, "query", failing_query)
+    response = client.get(f"{modules_api}/{fqmn}/versions")
+    response_versions = [v["version"] for v in response.json["modules"][0]["versions"]]
+    assert response_versions == versions
 
-    monkeypatch.setattr(ModuleModel, "query", mock_query)
+    response = client.get(f"{modules_api}/{fqmn}/download")
+    assert response.status_code == HTTPStatus.FOUND
+    latest = f"{modules_api}/{fqmn}/{versions[-1]}/download"
+    assert response.headers["Location"] == latest
+
+
+def test_download_latest_dne(modules_api: str, client: RequestHandler) -> None:
+    fqmn = "namespace/name/provider"
 
     response = client.get(f"{modules_api}/{fqmn}/download")
 
-    assert response.status_code == HTTPStatus.FOUND
-    assert "Location" in response.headers
-    assert response.headers["Location"] == f"{modules_api}/{fqvmn}/download"
+    assert response.status_code == HTTPStatus.NOT_FOUND
 
 
-def test_download_latest_dne(
-    modules_api: str, client: RequestHandler, monkeypatch
+def test_list_latest(modules_api: str, client: RequestHandler, saved_versions) -> None:
+    fqmn, versions = saved_versions
+
+    response = client.get(f"{modules_api}/{fqmn}")
+
+    assert response.status_code == HTTPStatus.OK
+    assert response.json["id"] == f"{fqmn}/{versions[-1]}"
+    assert response.json["version"] == versions[-1]
+
+
+def test_get_module(
+    modules_api: str, client: RequestHandler, saved_versions, monkeypatch
 ) -> None:
     from chalicelib.models import ModuleModel
 
-    fqmn = "namespace/name/provider"
+    fqmn, versions = saved_versions
+    queries = []
+    query = ModuleModel.query
 
-    monkeypatch.setattr(ModuleModel, "query", lambda *args, **kwargs: [])
-    response = client.get(f"{modules_api}/{fqmn}/download")
+    def spy_query(hash_key, **kwargs):
+        queries.append(kwargs)
+        return query(hash_key, **kwargs)
+
+    monkeypatch.setattr(ModuleModel, "query", spy_query)
+
+    response = client.get(f"{modules_api}/{fqmn}/0.10.0-rc.1")
+
+    assert response.status_code == HTTPStatus.OK
+    assert response.json["id"] == f"{fqmn}/0.10.0-rc.1"
+    assert response.json["version"] == "0.10.0-rc.1"
+    assert response.json["versions"] == versions
+    assert response.json["root"]["path"] == ""
+    assert response.json["submodules"] == []
+    assert "ETag" in response.headers
+
+    # One query, that does not read the getter URLs
+    assert len(queries) == 1
+    assert "getter_url" not in queries[0]["attributes_to_get"]
+
+
+def test_get_module_dne(
+    modules_api: str, client: RequestHandler, saved_versions
+) -> None:
+    fqmn, versions = saved_versions
+
+    response = client.get(f"{modules_api}/{fqmn}/9.9.9")
+    assert response.status_code == HTTPStatus.NOT_FOUND
+
+    response = client.get(f"{modules_api}/namespace/dne/provider/1.0.0")
+    assert response.status_code == HTTPStatus.NOT_FOUND
+
+
+def test_resolve(
+    modules_api: str, client: RequestHandler, saved_versions, monkeypatch
+) -> None:
+    from chalicelib.repository import get_repository
+
+    fqmn, versions = saved_versions
+    requests = [
+        {"source": fqmn, "version": "~> 0.9"},
+        {"source": fqmn, "version": ">= 0.9, < 0.10"},
+        {"source": fqmn, "version": "0.10.0-rc.1"},
+        {"source": fqmn},
+        {"source": fqmn, "version": "> 1.0"},
+        {"source": fqmn, "version": "latest"},
+        {"source": "namespace/dne/provider", "version": "1.0.0"},
+    ]
+
+    batches = []
+    repository = get_repository()
+    get_many = repository.get_many
+
+    def spy(keys, **kwargs):
+        batches.append(keys)
+        return get_many(keys, **kwargs)
+
+    monkeypatch.setattr(repository, "get_many", spy)
+
+    for _ in range(2):
+        response = client.post(
+            f"{modules_api}/resolve",
+            headers={"Content-Type": "application/json"},
+            body=json.dumps({"modules": requests}),
+        )
+        assert response.status_code == HTTPStatus.OK
+        results = response.json["modules"]
+        assert [r.get("resolved") for r in results] == [
+            "0.10.0",
+            "0.9.0",
+            "0.10.0-rc.1",
+            "0.10.0",
+            None,
+            None,
+            None,
+        ]
+        assert results[0] == {
+            "source": fqmn,
+            "version": "~> 0.9",
+            "resolved": "0.10.0",
+            "download_url": "./name?ref=0.10.0",
+        }
+        assert all("error" in r for r in results[4:])
+
+    # One batch of the 3 distinct resolved versions, then served from the cache
+    assert len(batches) == 1
+    assert sorted(v for _, v in batches[0]) == ["0.10.0", "0.10.0-rc.1", "0.9.0"]
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        "not json",
+        "[]",
+        '{"modules": {}}',
+        '{"modules": [{"version": "1.0.0"}]}',
+        '{"modules": [{"source": "a/b", "version": "1.0.0"}]}',
+        '{"modules": [{"source": "a/b/c", "version": 1}]}',
+    ],
+)
+def test_resolve_bad_request(modules_api: str, client: RequestHandler, body) -> None:
+    response = client.post(
+        f"{modules_api}/resolve",
+        headers={"Content-Type": "application/json"},
+        body=body,
+    )
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+
+
+def test_list_latest_dne(modules_api: str, client: RequestHandler) -> None:
+    response = client.get(f"{modules_api}/namespace/name/provider")
 
     assert response.status_code == HTTPStatus.NOT_FOUND
 
@@ -122,9 +327,335 @@ def test_download_success(
     assert response.headers["X-Terraform-Get"] == "./name"
 
 
+def test_download_is_cached(
+    modules_api: str, client: RequestHandler, monkeypatch
+) -> None:
+    from chalicelib.models import ModuleModel
+    from chalicelib.modules import getter_urls
+
+    fqvmn = "namespace/name/provider/0.2.0"
+    calls = []
+
+    def mock_get(hash_key, **kwargs):
+        calls.append(kwargs["range_key"])
+        if kwargs["range_key"] != "0.2.0":
+            raise ModuleModel.DoesNotExist()
+        return ModuleModel(hash_key, version=kwargs["range_key"], getter_url="./name")
+
+    monkeypatch.setattr(ModuleModel, "get", mock_get)
+
+    for _ in range(3):
+        response = client.get(f"{modules_api}/{fqvmn}/download")
+        assert response.status_code == HTTPStatus.NO_CONTENT
+        assert response.headers["X-Terraform-Get"] == "./name"
+
+        response = client.get(f"{modules_api}/namespace/name/provider/9.9.9/download")
+        assert response.status_code == HTTPStatus.NOT_FOUND
+
+    assert calls == ["0.2.0", "9.9.9"]
+    assert getter_urls.stats() == {"hits": 4, "misses": 2, "size": 2}
+
+
 def test_download_failure(modules_api: str, client: RequestHandler) -> None:
     fqvmn = "namespace/name/provider/0.0.0"
     response = client.get(f"{modules_api}/{fqvmn}/download")
 
     assert response.status_code == HTTPStatus.NOT_FOUND
     assert type(response.json["errors"]) == list
+
+
+@pytest.fixture(name="search_catalog")
+def fixture_search_catalog(monkeypatch):
+    from chalicelib import search
+    from chalicelib.models import ModuleModel, ModuleName
+
+    catalog = [
+        ModuleModel(ModuleName("hashicorp", "consul", "aws"), "0.1.0", verified=True),
+        ModuleModel(ModuleName("hashicorp", "vault", "aws"), "0.1.0"),
+        ModuleModel(ModuleName("plus3it", "file-cache", "external"), "1.2.0"),
+    ]
+    monkeypatch.setattr(
+        search, "index", search.SearchIndex(loader=lambda since=None: catalog)
+    )
+    return catalog
+
+
+def test_search(modules_api: str, client: RequestHandler, search_catalog) -> None:
+    response = client.get(f"{modules_api}/search?q=consul")
+
+    assert response.status_code == HTTPStatus.OK
+    assert [m["id"] for m in response.json["modules"]] == [
+        "hashicorp/consul/aws/0.1.0"
+    ]
+    assert response.json["meta"] == {"limit": 1_000, "current_offset": 0}
+
+
+def test_search_requires_q(modules_api: str, client: RequestHandler) -> None:
+    response = client.get(f"{modules_api}/search")
+
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+    assert type(response.json["errors"]) == list
+
+
+def test_search_paging(
+    modules_api: str, client: RequestHandler, search_catalog
+) -> None:
+    response = client.get(f"{modules_api}/search?q=*&limit=1&offset=1")
+
+    assert response.status_code == HTTPStatus.OK
+    assert [m["id"] for m in response.json["modules"]] == ["hashicorp/vault/aws/0.1.0"]
+
+    meta = response.json["meta"]
+    assert meta["prev_offset"] == 0
+    assert meta["next_offset"] == 2
+    assert "cursor=" in meta["next_url"]
+
+
+def _follow(client: RequestHandler, url: str):
+    """Yield the pages of a listing, following meta.next_url"""
+    while url:
+        response = client.get(url)
+        assert response.status_code == HTTPStatus.OK
+        yield response.json
+        url = response.json["meta"].get("next_url")
+
+
+def test_search_cursors(
+    modules_api: str, client: RequestHandler, search_catalog
+) -> None:
+    pages = list(_follow(client, f"{modules_api}/search?q=*&limit=2"))
+
+    assert [[m["id"] for m in page["modules"]] for page in pages] == [
+        ["hashicorp/consul/aws/0.1.0", "hashicorp/vault/aws/0.1.0"],
+        ["plus3it/file-cache/external/1.2.0"],
+    ]
+    assert [page["meta"]["current_offset"] for page in pages] == [0, 2]
+
+
+def test_search_rejects_invalid_cursors(
+    modules_api: str, client: RequestHandler, search_catalog
+) -> None:
+    response = client.get(f"{modules_api}/search?q=*&limit=1")
+    next_url = response.json["meta"]["next_url"]
+
+    tampered = next_url.replace("cursor=", "cursor=x")
+    assert client.get(tampered).status_code == HTTPStatus.BAD_REQUEST
+
+    # A cursor only selects pages of the query it was issued for
+    other_query = next_url.replace("q=%2A", "q=consul")
+    assert client.get(other_query).status_code == HTTPStatus.BAD_REQUEST
+
+
+def test_search_rejects_empty_pages(
+    modules_api: str, client: RequestHandler, search_catalog
+) -> None:
+    response = client.get(f"{modules_api}/search?q=*&limit=0")
+
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+    assert type(response.json["errors"]) == list
+
+
+def test_list_all(modules_api: str, client: RequestHandler, search_catalog) -> None:
+    response = client.get(f"{modules_api}/?verified=true")
+
+    assert response.status_code == HTTPStatus.OK
+    assert [m["id"] for m in response.json["modules"]] == [
+        "hashicorp/consul/aws/0.1.0"
+    ]
+
+
+@pytest.fixture(name="namespace_catalog")
+def fixture_namespace_catalog():
+    from chalicelib.models import ModuleModel, ModuleName
+
+    catalog = [
+        ModuleModel(ModuleName("listed", "consul", "aws"), "0.1.0", verified=True),
+        ModuleModel(ModuleName("listed", "consul", "aws"), "0.10.0"),
+        ModuleModel(ModuleName("listed", "consul", "azurerm"), "0.2.0"),
+        ModuleModel(ModuleName("listed", "vault", "aws"), "1.0.0", verified=True),
+        ModuleModel(ModuleName("unlisted", "consul", "aws"), "2.0.0"),
+    ]
+    for module in catalog:
+        module.getter_url = "./module"
+        module.save()
+
+    yield catalog
+
+    for module in catalog:
+        module.delete()
+
+
+def test_list_namespace(
+    modules_api: str, client: RequestHandler, namespace_catalog, monkeypatch
+) -> None:
+    from chalicelib.models import ModuleModel
+
+    queries = []
+    query = ModuleModel.namespace_index.query
+
+    def spy_query(hash_key, **kwargs):
+        queries.append(hash_key)
+        return query(hash_key, **kwargs)
+
+    monkeypatch.setattr(ModuleModel.namespace_index, "query", spy_query)
+
+    response = client.get(f"{modules_api}/listed")
+
+    assert response.status_code == HTTPStatus.OK
+    assert [m["id"] for m in response.json["modules"]] == [
+        "listed/consul/aws/0.10.0",
+        "listed/consul/azurerm/0.2.0",
+        "listed/vault/aws/1.0.0",
+    ]
+    assert queries == ["listed"]
+
+    response = client.get(f"{modules_api}/listed?provider=aws&verified=true")
+    assert [m["id"] for m in response.json["modules"]] == ["listed/vault/aws/1.0.0"]
+
+    response = client.get(f"{modules_api}/listed?limit=1&offset=1")
+    assert [m["id"] for m in response.json["modules"]] == [
+        "listed/consul/azurerm/0.2.0"
+    ]
+    assert response.json["meta"]["next_offset"] == 2
+
+
+def test_list_namespace_cursors(
+    modules_api: str, client: RequestHandler, namespace_catalog, monkeypatch
+) -> None:
+    from chalicelib.models import ModuleModel
+
+    queries = []
+    query = ModuleModel.namespace_index.query
+
+    def spy_query(hash_key, **kwargs):
+        queries.append(kwargs["range_key_condition"])
+        return query(hash_key, **kwargs)
+
+    monkeypatch.setattr(ModuleModel.namespace_index, "query", spy_query)
+
+    pages = list(_follow(client, f"{modules_api}/listed?limit=2"))
+
+    assert [[m["id"] for m in page["modules"]] for page in pages] == [
+        ["listed/consul/aws/0.10.0", "listed/consul/azurerm/0.2.0"],
+        ["listed/vault/aws/1.0.0"],
+    ]
+    # The second page starts after the last module of the first one
+    assert queries[0] is None
+    assert queries[1] is not None
+
+
+def test_list_latest_all_providers(
+    modules_api: str, client: RequestHandler, namespace_catalog
+) -> None:
+    response = client.get(f"{modules_api}/listed/consul")
+
+    assert response.status_code == HTTPStatus.OK
+    assert [m["id"] for m in response.json["modules"]] == [
+        "listed/consul/aws/0.10.0",
+        "listed/consul/azurerm/0.2.0",
+    ]
+
+    response = client.get(f"{modules_api}/listed/dne")
+    assert response.json["modules"] == []
+
+
+def test_list_versions_is_cacheable(
+    modules_api: str, client: RequestHandler, saved_versions, monkeypatch
+) -> None:
+    from chalicelib.models import ModuleModel
+    from chalicelib.stamps import touch
+
+    fqmn, versions = saved_versions
+    url = f"{modules_api}/{fqmn}/versions"
+    response = client.get(url)
+    etag = response.headers["ETag"]
+    assert response.headers["Cache-Control"] == "public, max-age=60"
+
+    def failing_query(*args, **kwargs):
+        raise AssertionError("A 304 must not read the versions")
+
+    monkeypatch.setattr(ModuleModel.version_index, "query", failing_query)
+    response = client.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == HTTPStatus.NOT_MODIFIED
+    monkeypatch.undo()
+
+    # A new stamp, e.g. after a version was published, changes the ETag
+    touch([ModuleModel.module_name.deserialize(fqmn)])
+    response = client.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == HTTPStatus.OK
+    assert response.headers["ETag"] != etag
+
+
+def test_download_is_cacheable(
+    modules_api: str, client: RequestHandler, saved_versions
+) -> None:
+    fqmn, versions = saved_versions
+    url = f"{modules_api}/{fqmn}/0.9.0/download"
+
+    response = client.get(url)
+    assert response.status_code == HTTPStatus.NO_CONTENT
+    etag = response.headers["ETag"]
+
+    response = client.get(url, headers={"If-None-Match": f'W/{etag}, "other"'})
+    assert response.status_code == HTTPStatus.NOT_MODIFIED
+
+    other_version = client.get(f"{modules_api}/{fqmn}/0.10.0/download")
+    assert other_version.headers["ETag"] != etag
+
+
+def test_download_etag_follows_the_served_url(
+    modules_api: str, client: RequestHandler, saved_versions
+) -> None:
+    from chalicelib.models import ModuleModel
+    from chalicelib.modules import getter_urls
+    from chalicelib.stamps import touch
+
+    fqmn, versions = saved_versions
+    module_name = ModuleModel.module_name.deserialize(fqmn)
+    url = f"{modules_api}/{fqmn}/0.9.0/download"
+    response = client.get(url)
+    etag = response.headers["ETag"]
+
+    module = ModuleModel.get(module_name, "0.9.0")
+    module.mirror_url = "https://mirror.example.com/saved.tar.gz"
+    module.save()
+    touch([module_name])
+
+    # The cached URL is still served, under the same ETag
+    response = client.get(url)
+    assert response.headers["X-Terraform-Get"] == "./name?ref=0.9.0"
+    assert response.headers["ETag"] == etag
+
+    getter_urls.clear()
+    response = client.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == HTTPStatus.NO_CONTENT
+    assert response.headers["X-Terraform-Get"] == module.mirror_url
+    assert response.headers["ETag"] != etag
+
+
+def test_get_module_etag_covers_downloads(
+    modules_api: str, client: RequestHandler, saved_versions
+) -> None:
+    from chalicelib.downloads import DownloadCounter
+    from chalicelib.models import ModuleModel
+
+    fqmn, versions = saved_versions
+    url = f"{modules_api}/{fqmn}/0.9.0"
+    response = client.get(url)
+    etag = response.headers["ETag"]
+
+    response = client.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == HTTPStatus.NOT_MODIFIED
+
+    # Flushed downloads only change the document once they are rolled up
+    counter = DownloadCounter(rollup_seconds=3_600)
+    counter.record(ModuleModel.module_name.deserialize(fqmn), "0.9.0", count=3)
+    counter.flush()
+    response = client.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == HTTPStatus.NOT_MODIFIED
+
+    counter.rollup()
+    response = client.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == HTTPStatus.OK
+    assert response.json["downloads"] == 3
+    assert response.headers["ETag"] != etag
@@ -0,0 +1,481 @@
+#  Copyright (c) 2020 Zero A.E., LLC
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+# The conformance suite of `chalicelib.repository.ModuleRepository`, every test
+# runs against every backend.
+
+
+@pytest.fixture(name="repository", params=["dynamodb", "sqlite"])
+def fixture_repository(request, tmp_path, monkeypatch):
+    from chalicelib import search
+    from chalicelib.dynamodb import DynamoDBRepository
+    from chalicelib.sqlite import SQLiteRepository
+
+    if request.param == "dynamodb":
+        # A new search index, built from the modules saved by the test
+        monkeypatch.setattr(search, "index", search.SearchIndex())
+        repository = DynamoDBRepository(shards=4)
+    else:
+        repository = SQLiteRepository(str(tmp_path / "registry.sqlite3"))
+        repository.init()
+
+    yield repository
+
+    for module in list(repository.scan(attributes=["module_name", "version"])):
+        repository.delete(module.module_name, module.version)
+
+
+def _module(fqmn: str, version: str, **kwargs):
+    from chalicelib.models import ModuleModel, ModuleName
+
+    kwargs.setdefault("getter_url", f"./{fqmn}?ref={version}")
+    return ModuleModel(ModuleName(*fqmn.split("/")), version, **kwargs)
+
+
+def test_get(repository):
+    from chalicelib.models import ModuleName
+
+    published_at = datetime(2020, 5, 1, 12, 30, tzinfo=timezone.utc)
+    repository.save(
+        _module(
+            "conformance/get/aws",
+            "1.0.0",
+            verified=True,
+            owner="owner",
+            description="A module",
+            source="https://example.com/get",
+            published_at=published_at,
+        )
+    )
+    fqmn = ModuleName("conformance", "get", "aws")
+
+    module = repository.get(fqmn, "1.0.0")
+    assert module.module_name == fqmn
+    assert module.version == "1.0.0"
+    assert module.getter_url == "./conformance/get/aws?ref=1.0.0"
+    assert module.verified is True
+    assert (module.owner, module.description) == ("owner", "A module")
+    assert module.source == "https://example.com/get"
+    assert module.published_at == published_at
+    assert module.downloads == 0
+
+    assert repository.get(fqmn, "1.0.1") is None
+    assert repository.get(ModuleName("conformance", "dne", "aws"), "1.0.0") is None
+
+
+def test_versions_and_latest(repository):
+    from chalicelib.models import ModuleName
+
+    for version in ["1.10.0", "1.2.0", "2.0.0-rc.1", "not-semver", "2.0.0-beta"]:
+        repository.save(_module("conformance/versions/aws", version))
+    fqmn = ModuleName("conformance", "versions", "aws")
+
+    # Versions that are not semantic versions are left out
+    assert list(repository.versions(fqmn)) == [
+        "1.2.0",
+        "1.10.0",
+        "2.0.0-beta",
+        "2.0.0-rc.1",
+    ]
+    assert repository.latest(fqmn).version == "2.0.0-rc.1"
+    assert repository.latest(fqmn, attributes=["version"]).version == "2.0.0-rc.1"
+
+    dne = ModuleName("conformance", "dne", "aws")
+    assert list(repository.versions(dne)) == []
+    assert repository.latest(dne) is None
+
+
+def test_get_many(repository):
+    from chalicelib.db import BATCH_GET_SIZE
+    from chalicelib.models import ModuleName
+
+    fqmn = ModuleName("conformance", "many", "aws")
+    versions = [f"1.0.{patch}" for patch in range(BATCH_GET_SIZE + 5)]
+    repository.save_many(_module(str(fqmn), version) for version in versions)
+
+    keys = [(fqmn, v) for v in [*versions, "9.9.9", versions[0]]]
+    modules = list(repository.get_many(keys, attributes=["getter_url"]))
+    assert sorted(m.version for m in modules) == sorted(versions)
+    assert {m.getter_url for m in modules} == {
+        f"./{fqmn}?ref={version}" for version in versions
+    }
+    assert list(repository.get_many([])) == []
+
+
+def test_module_versions(repository):
+    from chalicelib.models import ModuleName
+
+    for version in ["1.10.0", "1.2.0", "not-semver", "2.0.0-beta"]:
+        repository.save(_module("conformance/all/aws", version, owner="owner"))
+    fqmn = ModuleName("conformance", "all", "aws")
+
+    modules = repository.module_versions(fqmn, attributes=["owner"])
+    assert [m.version for m in modules] == [
+        "not-semver",
+        "1.2.0",
+        "1.10.0",
+        "2.0.0-beta",
+    ]
+    assert all(m.module_name == fqmn and m.owner == "owner" for m in modules)
+    assert [m.version_key is None for m in modules] == [True, False, False, False]
+
+    assert repository.module_versions(ModuleName("conformance", "dne", "aws")) == []
+
+
+@pytest.fixture(name="catalog")
+def fixture_catalog(repository):
+    catalog = [
+        _module("conformance/consul/aws", "0.1.0", verified=True),
+        _module("conformance/consul/aws", "0.10.0", description="Consul cluster"),
+        _module("conformance/consul/azurerm", "0.2.0", description="Consul on Azure"),
+        _module("conformance/consul-ha/aws", "1.0.0"),
+        _module("conformance/vault/aws", "1.0.0", verified=True),
+        _module("other/consul/aws", "2.0.0"),
+    ]
+    assert repository.save_many(catalog) == len(catalog)
+    return catalog
+
+
+def test_list_latest(repository, catalog):
+    from chalicelib.models import ModuleName
+
+    def ids(modules):
+        return [f"{m.module_name}/{m.version}" for m in modules]
+
+    # In module name order, i.e. the order of the FQMN strings
+    assert ids(repository.list_latest("conformance")) == [
+        "conformance/consul-ha/aws/1.0.0",
+        "conformance/consul/aws/0.10.0",
+        "conformance/consul/azurerm/0.2.0",
+        "conformance/vault/aws/1.0.0",
+    ]
+    assert ids(repository.list_latest("conformance", "consul")) == [
+        "conformance/consul/aws/0.10.0",
+        "conformance/consul/azurerm/0.2.0",
+    ]
+    after = ModuleName("conformance", "consul", "aws")
+    assert ids(repository.list_latest("conformance", after=after, page_size=1)) == [
+        "conformance/consul/azurerm/0.2.0",
+        "conformance/vault/aws/1.0.0",
+    ]
+    assert list(repository.list_latest("dne")) == []
+
+
+def test_search(repository, catalog):
+    def ids(result):
+        modules, total = result
+        return [f"{m.module_name}/{m.version}" for m in modules], total
+
+    assert ids(repository.search("consul", namespace="conformance")) == (
+        [
+            "conformance/consul-ha/aws/1.0.0",
+            "conformance/consul/aws/0.10.0",
+            "conformance/consul/azurerm/0.2.0",
+        ],
+        3,
+    )
+    assert ids(repository.search("CONSUL azure")) == (
+        ["conformance/consul/azurerm/0.2.0"],
+        1,
+    )
+    assert ids(repository.search("consul", provider="azurerm")) == (
+        ["conformance/consul/azurerm/0.2.0"],
+        1,
+    )
+    # The verified status is the one of the latest version
+    assert ids(repository.search("*", namespace="conformance", verified=True)) == (
+        ["conformance/vault/aws/1.0.0"],
+        1,
+    )
+    assert ids(repository.search("consul", namespace="conformance", verified=False))[
+        1
+    ] == 3
+    assert ids(repository.search("*", namespace="conformance", offset=1, limit=2)) == (
+        ["conformance/consul/aws/0.10.0", "conformance/consul/azurerm/0.2.0"],
+        4,
+    )
+    assert ids(
+        repository.search(
+            "*", namespace="conformance", limit=2, after="conformance/consul/aws"
+        )
+    ) == (["conformance/consul/azurerm/0.2.0", "conformance/vault/aws/1.0.0"], 4)
+    assert ids(repository.search("nomad")) == ([], 0)
+
+
+def test_delete(repository, catalog):
+    from chalicelib.models import ModuleName
+
+    fqmn = ModuleName("conformance", "consul", "azurerm")
+    assert repository.delete(fqmn, "0.2.0")
+    assert not repository.delete(fqmn, "0.2.0")
+
+    assert repository.get(fqmn, "0.2.0") is None
+    assert repository.latest(fqmn) is None
+    assert [m.module_name for m in repository.list_latest("conformance", "consul")] == [
+        ModuleName("conformance", "consul", "aws")
+    ]
+
+
+def test_save_replaces(repository):
+    from chalicelib.models import ModuleName
+
+    repository.save(_module("conformance/replaced/aws", "1.0.0"))
+    repository.save(_module("conformance/replaced/aws", "1.0.0", getter_url="./new"))
+
+    fqmn = ModuleName("conformance", "replaced", "aws")
+    assert repository.get(fqmn, "1.0.0").getter_url == "./new"
+    assert len([m for m in repository.scan() if m.module_name == fqmn]) == 1
+
+    mirrored = repository.get(fqmn, "1.0.0")
+    mirrored.mirror_url = "https://mirror.example.com/archive.tar.gz"
+    mirrored.archive_sha256 = "0" * 64
+    repository.save(mirrored)
+    module = repository.get(fqmn, "1.0.0")
+    assert module.download_url == "https://mirror.example.com/archive.tar.gz"
+    assert module.archive_sha256 == "0" * 64
+
+
+def test_sqlite_adds_new_columns(tmp_path):
+    import sqlite3
+
+    from chalicelib.sqlite import SCHEMA, SQLiteRepository
+
+    from chalicelib.models import ModuleName
+
+    # A database created before the mirror and summary columns
+    old_schema = SCHEMA.replace("    mirror_url TEXT,\n    archive_sha256 TEXT,\n", "")
+    old_schema = old_schema.replace(
+        "    stamp TEXT,\n    versions TEXT,\n    latest_stable TEXT,\n"
+        "    downloads INTEGER,\n    published_at TEXT\n",
+        "    stamp TEXT\n",
+    )
+    assert old_schema.count("TEXT") == SCHEMA.count("TEXT") - 5
+    path = str(tmp_path / "registry.sqlite3")
+    with sqlite3.connect(path) as connection:
+        connection.executescript(old_schema)
+
+    repository = SQLiteRepository(path)
+    repository.init()
+    repository.save(_module("conformance/migrated/aws", "1.0.0", mirror_url="./m"))
+    fqmn = ModuleName("conformance", "migrated", "aws")
+    assert repository.get(fqmn, "1.0.0").mirror_url == "./m"
+    assert repository.summary(fqmn).versions == ["1.0.0"]
+
+
+def test_save_many(repository):
+    modules = [
+        _module(f"conformance/many-{i}/aws", version)
+        for i in range(20)
+        for version in ["1.0.0", "1.1.0", "1.2.0"]
+    ]
+    assert repository.save_many(iter(modules)) == 60
+
+    scanned = {(str(m.module_name), m.version) for m in repository.scan()}
+    assert {(str(m.module_name), m.version) for m in modules} <= scanned
+
+
+def test_downloads(repository):
+    from chalicelib.models import ModuleName
+
+    repository.save(_module("conformance/downloads/aws", "1.0.0"))
+    fqmn = ModuleName("conformance", "downloads", "aws")
+
+    repository.add_downloads(fqmn, "1.0.0", 3)
+    repository.add_downloads(fqmn, "1.0.0", 2)
+    assert repository.downloads(fqmn, "1.0.0") == 5
+    assert repository.rollup_downloads([(fqmn, "1.0.0")]) == 1
+    assert repository.get(fqmn, "1.0.0").downloads == 5
+
+    # Module versions are not created by their downloads
+    repository.add_downloads(fqmn, "1.1.0", 1)
+    assert repository.rollup_downloads([(fqmn, "1.1.0")]) == 0
+    assert repository.get(fqmn, "1.1.0") is None
+
+
+def test_search_downloads(repository, monkeypatch):
+    from chalicelib import search
+    from chalicelib.models import ModuleName
+
+    monkeypatch.setattr(search, "ZTR_SEARCH_REFRESH_SECONDS", 0)
+    monkeypatch.setattr(search, "_INDEX_LAG", timedelta(0))
+    repository.save(_module("conformance/popular/aws", "1.0.0"))
+    fqmn = ModuleName("conformance", "popular", "aws")
+    assert repository.search("popular")[0][0].downloads in (None, 0)
+
+    # The rolled up counts are picked up by the next (incremental) refresh
+    repository.add_downloads(fqmn, "1.0.0", 5)
+    repository.rollup_downloads([(fqmn, "1.0.0")])
+    assert repository.search("popular")[0][0].downloads == 5
+
+
+def test_stamps(repository):
+    from chalicelib.models import ModuleName
+
+    fqmn = ModuleName("conformance", "stamps", "aws")
+    assert repository.stamp(fqmn) is None
+
+    repository.set_stamps([(fqmn, "a")])
+    assert repository.stamp(fqmn) == "a"
+    repository.set_stamps([(fqmn, "b")])
+    assert repository.stamp(fqmn) == "b"
+
+    # A stamp is not a module version
+    assert repository.latest(fqmn) is None
+    assert list(repository.list_latest("conformance")) == []
+
+
+def test_summary(repository):
+    from chalicelib.models import ModuleName
+
+    fqmn = ModuleName("conformance", "summary", "aws")
+    assert repository.summary(fqmn) is None
+
+    first = datetime(2020, 5, 1, tzinfo=timezone.utc)
+    last = datetime(2020, 6, 1, tzinfo=timezone.utc)
+    repository.save(_module(str(fqmn), "1.10.0", published_at=first))
+    repository.save_many(
+        [
+            _module(str(fqmn), "2.0.0-rc.1", published_at=last),
+            _module(str(fqmn), "1.2.0", published_at=first),
+            _module(str(fqmn), "latest", published_at=first),
+        ]
+    )
+
+    summary = repository.summary(fqmn)
+    # Ordered by semantic version, without the versions that are not semantic
+    assert summary.versions == ["1.2.0", "1.10.0", "2.0.0-rc.1"]
+    assert summary.latest_stable == "1.10.0"
+    assert summary.downloads == 0
+    assert summary.published_at == last
+
+    repository.add_downloads(fqmn, "1.10.0", 2)
+    repository.add_downloads(fqmn, "1.2.0", 3)
+    repository.add_downloads(fqmn, "0.1.0", 4)
+    repository.rollup_downloads(
+        [(fqmn, "1.10.0"), (fqmn, "1.2.0"), (fqmn, "0.1.0")]
+    )
+    assert repository.summary(fqmn).downloads == 5
+
+    stamp = repository.stamp(fqmn)
+    assert repository.delete(fqmn, "1.10.0")
+    assert not repository.delete(fqmn, "1.10.0")
+    summary = repository.summary(fqmn)
+    assert summary.versions == ["1.2.0", "2.0.0-rc.1"]
+    assert summary.latest_stable == "1.2.0"
+    assert summary.downloads == 3
+    # Every write gives the module a new stamp
+    assert summary.stamp != stamp
+
+    # The change stamps keep the summary
+    repository.set_stamps([(fqmn, "a")])
+    assert repository.summary(fqmn).versions == ["1.2.0", "2.0.0-rc.1"]
+
+
+def test_concurrent_writes_keep_the_summary(repository):
+    from concurrent.futures import ThreadPoolExecutor
+
+    from chalicelib.models import ModuleName
+
+    fqmn = ModuleName("conformance", "concurrent", "aws")
+    versions = [f"1.{i}.0" for i in range(8)]
+    with ThreadPoolExecutor(max_workers=len(versions)) as executor:
+        for _ in executor.map(
+            lambda v: repository.save(_module(str(fqmn), v)), versions
+        ):
+            pass
+
+    assert repository.summary(fqmn).versions == versions
+
+
+def test_rebuild_summaries(repository):
+    from chalicelib.models import ModuleName
+
+    fqmn = ModuleName("conformance", "rebuilt", "aws")
+    repository.save_many([_module(str(fqmn), "1.0.0"), _module(str(fqmn), "1.1.0")])
+    # A summary written before they held the versions, and one of a module whose
+    # versions are gone
+    stale = ModuleName("conformance", "rebuilt-stale", "aws")
+    repository.set_stamps([(stale, "a")])
+    assert repository.summary(stale).versions is None
+
+    assert repository.rebuild_summaries([fqmn], workers=2) == 1
+    assert repository.summary(fqmn).versions == ["1.0.0", "1.1.0"]
+
+    assert repository.rebuild_summaries(workers=2) >= 2
+    assert repository.summary(stale).versions == []
+    assert repository.summary(stale).latest_stable is None
+
+
+def test_catalog_generation(repository):
+    assert repository.catalog_generation() is None
+
+    assert repository.set_catalog_generation("20200101T000000.000000Z-a")
+    assert repository.catalog_generation() == "20200101T000000.000000Z-a"
+    assert repository.set_catalog_generation("20200102T000000.000000Z-b")
+
+    # An older generation does not replace a newer one
+    assert not repository.set_catalog_generation("20200101T000000.000000Z-c")
+    assert repository.catalog_generation() == "20200102T000000.000000Z-b"
+
+    # Only the expected generation is replaced
+    assert not repository.set_catalog_generation(
+        "20200103T000000.000000Z-d", replacing="20200101T000000.000000Z-a"
+    )
+    assert repository.set_catalog_generation(
+        "20200103T000000.000000Z-d", replacing="20200102T000000.000000Z-b"
+    )
+    assert repository.catalog_generation() == "20200103T000000.000000Z-d"
+
+
+def test_routes_on_sqlite(client, tmp_path):
+    from http import HTTPStatus
+
+    from chalicelib.downloads import get_counter
+    from chalicelib.models import ModuleName
+    from chalicelib.repository import set_repository
+    from chalicelib.sqlite import SQLiteRepository
+    from chalicelib.stamps import stamps, touch
+
+    repository = SQLiteRepository(str(tmp_path / "registry.sqlite3"))
+    repository.init()
+    set_repository(repository)
+    stamps.clear()
+    try:
+        for version in ["0.9.0", "0.10.0"]:
+            repository.save(_module("sqlite/vpc/aws", version))
+        touch([ModuleName("sqlite", "vpc", "aws")])
+
+        response = client.get("/modules/sqlite/vpc/aws/versions")
+        versions = response.json["modules"][0]["versions"]
+        assert [v["version"] for v in versions] == ["0.9.0", "0.10.0"]
+
+        response = client.get("/modules/sqlite/vpc/aws/download")
+        assert response.status_code == HTTPStatus.FOUND
+        assert response.headers["Location"].endswith("/sqlite/vpc/aws/0.10.0/download")
+
+        response = client.get("/modules/sqlite/vpc/aws/0.9.0/download")
+        assert response.headers["X-Terraform-Get"] == "./sqlite/vpc/aws?ref=0.9.0"
+
+        response = client.get("/modules/search?q=vpc")
+        assert [m["id"] for m in response.json["modules"]] == ["sqlite/vpc/aws/0.10.0"]
+
+        get_counter().flush()
+        assert repository.downloads(ModuleName("sqlite", "vpc", "aws"), "0.9.0") == 1
+    finally:
+        set_repository(None)
+        stamps.clear()
@@ -0,0 +1,188 @@
+#  Copyright (c) 2020 Zero A.E., LLC
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import json
+import os
+from threading import Lock
+
+import pytest
+
+
+class FakeTime(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def clock(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.now += seconds
+
+
+@pytest.fixture(name="backup_file")
+def fixture_backup_file(tmp_path, monkeypatch):
+    from chalicelib import restore
+    from chalicelib.db import db_batch_write, db_dump
+    from chalicelib.models import ModuleModel, ModuleName
+
+    modules = [
+        ModuleModel(ModuleName("restore", f"module-{i}", "aws"), "1.0.0", getter_url=".")
+        for i in range(120)
+    ]
+    db_batch_write(ModuleModel, (m.serialize() for m in modules))
+
+    filename = str(tmp_path / "modules.ndjson.gz")
+    db_dump(filename)
+
+    with ModuleModel.batch_write() as batch:
+        for module in modules:
+            batch.delete(module)
+
+    # The test tables only have 1 WCU
+    monkeypatch.setattr(restore, "table_write_rate", lambda model: 10_000.0)
+    yield filename
+
+    with ModuleModel.batch_write() as batch:
+        for module in ModuleModel.scan():
+            batch.delete(module)
+
+
+def test_rate_limiter_paces_requests():
+    from chalicelib.restore import AdaptiveRateLimiter
+
+    time = FakeTime()
+    limiter = AdaptiveRateLimiter(10, clock=time.clock, sleep_=time.sleep)
+
+    for _ in range(30):
+        limiter.acquire()
+
+    # The first 10 tokens are in the bucket, the next 20 take 2 seconds
+    assert time.now == pytest.approx(2.0)
+
+
+def test_rate_limiter_adapts_to_throttling():
+    from chalicelib.restore import AdaptiveRateLimiter
+
+    limiter = AdaptiveRateLimiter(100, max_rate=150, min_rate=10, increase=10)
+
+    limiter.throttled()
+    assert limiter.rate == 50
+    limiter.succeeded()
+    assert limiter.rate == 60
+
+    for _ in range(10):
+        limiter.throttled()
+    assert limiter.rate == 10
+
+    for _ in range(100):
+        limiter.succeeded()
+    assert limiter.rate == 150
+
+
+def test_restore(backup_file):
+    from chalicelib.models import ModuleModel
+    from chalicelib.restore import checkpoint_filename, restore
+
+    report = restore(backup_file, workers=4)
+
+    assert report.restored == 120
+    assert ModuleModel.count() == 120
+    assert not os.path.exists(checkpoint_filename(backup_file))
+
+
+def test_restore_redrives_unprocessed_items(backup_file, monkeypatch):
+    from chalicelib.models import ModuleModel
+    from chalicelib.restore import restore
+
+    connection = ModuleModel._get_connection()
+    batch_write_item = connection.batch_write_item
+    lock = Lock()
+    calls = []
+
+    def throttling_batch_write_item(put_items, **kwargs):
+        with lock:
+            calls.append(len(put_items))
+            throttle = len(calls) % 2 == 1
+        if throttle:
+            # Process only the first item, like a throttled table would
+            batch_write_item(put_items=put_items[:1], **kwargs)
+            unprocessed = [{"PutRequest": {"Item": item}} for item in put_items[1:]]
+            return {"UnprocessedItems": {ModuleModel.Meta.table_name: unprocessed}}
+        return batch_write_item(put_items=put_items, **kwargs)
+
+    monkeypatch.setattr(connection, "batch_write_item", throttling_batch_write_item)
+
+    report = restore(backup_file, workers=2)
+
+    assert report.restored == 120
+    assert report.final_rate < 10_000
+    assert ModuleModel.count() == 120
+
+
+def test_restore_resumes_from_checkpoint(backup_file):
+    from chalicelib.backup import sha256
+    from chalicelib.models import ModuleModel
+    from chalicelib.restore import checkpoint_filename, restore
+
+    with open(checkpoint_filename(backup_file), "w") as f:
+        checkpoint = {"backup_sha256": sha256(backup_file), "batches": 4}
+        json.dump(dict(checkpoint, batch_size=25), f)
+
+    report = restore(backup_file)
+
+    # The last batch is partial, only the backed up records are counted
+    assert report.skipped == 100
+    assert report.restored == 20
+    assert ModuleModel.count() == 20
+
+
+def test_restore_ignores_checkpoint_of_another_backup(backup_file):
+    from chalicelib.models import ModuleModel
+    from chalicelib.restore import checkpoint_filename, restore
+
+    with open(checkpoint_filename(backup_file), "w") as f:
+        json.dump({"backup_sha256": "0" * 64, "batches": 2, "batch_size": 25}, f)
+
+    report = restore(backup_file)
+
+    assert report.skipped == 0
+    assert report.restored == 120
+    assert ModuleModel.count() == 120
+
+
+def test_restore_saves_checkpoint_on_failure(backup_file, monkeypatch):
+    from pynamodb.exceptions import PutError
+
+    from chalicelib.models import ModuleModel
+    from chalicelib.restore import checkpoint_filename, restore
+
+    connection = ModuleModel._get_connection()
+    batch_write_item = connection.batch_write_item
+    calls = []
+
+    def failing_batch_write_item(put_items, **kwargs):
+        calls.append(1)
+        if len(calls) > 2:
+            raise PutError("Access Denied")
+        return batch_write_item(put_items=put_items, **kwargs)
+
+    monkeypatch.setattr(connection, "batch_write_item", failing_batch_write_item)
+
+    with pytest.raises(PutError):
+        restore(backup_file, workers=1)
+    # Let the fixture clean up the table
+    monkeypatch.setattr(connection, "batch_write_item", batch_write_item)
+
+    with open(checkpoint_filename(backup_file)) as f:
+        assert json.load(f)["batches"] == 2
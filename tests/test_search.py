@@ -0,0 +1,186 @@
+#  Copyright (c) 2020 Zero A.E., LLC
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+
+def _module(fqvmn: str, description: str = None, verified: bool = None, age: int = 0):
+    from chalicelib.models import ModuleModel, ModuleName
+
+    namespace, name, provider, version = fqvmn.split("/")
+    written_at = datetime(2020, 1, 1, tzinfo=timezone.utc) + timedelta(days=age)
+    return ModuleModel(
+        ModuleName(namespace, name, provider),
+        version,
+        getter_url=f"./{name}",
+        description=description,
+        verified=verified,
+        published_at=written_at,
+        updated_at=written_at,
+    )
+
+
+@pytest.fixture(name="catalog")
+def fixture_catalog():
+    return [
+        _module("hashicorp/consul/aws/0.1.0", "Consul cluster on AWS", verified=True),
+        _module("hashicorp/consul/aws/0.2.0", "Consul cluster on AWS", verified=True),
+        _module("hashicorp/vault/azurerm/1.0.0", "Vault on Azure", age=1),
+        _module("plus3it/file-cache/external/1.2.0", "Retrieve and cache files"),
+        _module("terraform-aws-modules/vpc/aws/2.0.0", "Terraform VPC module"),
+    ]
+
+
+@pytest.fixture(name="index")
+def fixture_index(catalog):
+    from chalicelib.search import SearchIndex
+
+    index = SearchIndex(loader=lambda since=None: catalog)
+    index.build()
+    return index
+
+
+def test_tokenize():
+    from chalicelib.search import tokenize
+
+    assert tokenize("terraform-aws-modules") == {"terraform", "aws", "modules"}
+    assert tokenize("Retrieve and CACHE files") == {"retrieve", "and", "cache", "files"}
+    assert tokenize(None) == set()
+
+
+def test_search_does_not_import_the_models():
+    import os
+    import subprocess
+    import sys
+
+    # The SQLite backend only needs the tokenizer, not pynamodb
+    code = "import sys, chalicelib.search; print('pynamodb' in sys.modules)"
+    output = subprocess.check_output(
+        [sys.executable, "-c", code],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    )
+    assert output.strip() == b"False"
+
+
+def test_search_all(index):
+    modules, total = index.search("*")
+
+    assert total == 4
+    assert [str(m.module_name) for m in modules] == sorted(
+        str(m.module_name) for m in modules
+    )
+
+
+def test_search_keeps_latest_version(index):
+    modules, total = index.search("consul")
+
+    assert total == 1
+    assert modules[0].version == "0.2.0"
+
+
+def test_search_tokens_are_anded(index):
+    assert index.search("consul aws")[1] == 1
+    assert index.search("consul azurerm")[1] == 0
+    assert index.search("CACHE")[1] == 1
+
+
+def test_search_filters(index):
+    assert index.search("*", provider="aws")[1] == 2
+    assert index.search("*", namespace="hashicorp")[1] == 2
+    assert index.search("*", namespace="hashicorp", provider="azurerm")[1] == 1
+    assert index.search("*", verified=True)[1] == 1
+    assert index.search("*", verified=False)[1] == 3
+
+
+def test_search_paging(index):
+    everything, total = index.search("*")
+
+    page, page_total = index.search("*", offset=1, limit=2)
+    assert page_total == total
+    assert page == everything[1:3]
+
+    page, _ = index.search("aws", offset=1, limit=10)
+    assert page == index.search("aws")[0][1:]
+
+
+def test_search_after(index):
+    everything, _ = index.search("*")
+
+    page, total = index.search("*", limit=2, after="hashicorp/vault/azurerm")
+    assert total == 4
+    assert page == everything[2:]
+
+    page, _ = index.search("aws", limit=1, after="hashicorp/consul/aws")
+    assert [str(m.module_name) for m in page] == ["terraform-aws-modules/vpc/aws"]
+
+
+def test_search_refresh_is_incremental(catalog):
+    from chalicelib.search import SearchIndex
+
+    calls = []
+
+    def loader(since=None):
+        calls.append(since)
+        if since is None:
+            return catalog
+        return [_module("hashicorp/consul/aws/0.3.0", "Consul cluster on AWS", age=7)]
+
+    index = SearchIndex(loader=loader)
+    index.build()
+    index.refresh()
+
+    assert calls == [None, datetime(2020, 1, 2, tzinfo=timezone.utc)]
+    modules, _ = index.search("consul")
+    assert modules[0].version == "0.3.0"
+    assert index.search("*", verified=True)[1] == 0
+
+
+def test_search_remove(index):
+    index.remove("hashicorp/consul/aws")
+
+    assert index.search("consul")[1] == 0
+    assert index.search("*")[1] == 3
+
+
+def test_search_refresh_picks_up_imported_versions():
+    from chalicelib.search import SearchIndex
+
+    index = SearchIndex()
+    index.build()
+
+    # Imported versions keep their (old) upstream publication date
+    imported = _module("imported/consul/aws/0.1.0", "Imported from upstream", age=-90)
+    imported.save()
+    index.refresh()
+
+    modules, total = index.search("imported")
+    assert total == 1
+    assert modules[0].version == "0.1.0"
+
+    imported.delete()
+
+
+def test_search_ensure_fresh_does_not_wait_for_refresh(index, monkeypatch):
+    from chalicelib import search
+
+    monkeypatch.setattr(search, "ZTR_SEARCH_REFRESH_SECONDS", 0)
+    index._update_lock.acquire()
+    try:
+        # Another thread is refreshing, the current index is served
+        index.ensure_fresh()
+        assert index.search("consul")[1] == 1
+    finally:
+        index._update_lock.release()
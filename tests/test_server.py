@@ -0,0 +1,156 @@
+#  Copyright (c) 2020 Zero A.E., LLC
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import gzip
+import io
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from threading import Barrier
+from wsgiref.util import setup_testing_defaults
+
+import pytest
+
+
+@pytest.fixture(name="wsgi")
+def fixture_wsgi(app):
+    from chalicelib.server import WSGIApplication
+
+    application = WSGIApplication(app)
+
+    def request(path, method="GET", query="", headers=None, body=b""):
+        environ = {
+            "REQUEST_METHOD": method,
+            "PATH_INFO": path,
+            "QUERY_STRING": query,
+            "wsgi.input": io.BytesIO(body),
+            "CONTENT_LENGTH": str(len(body)),
+        }
+        for name, value in (headers or {}).items():
+            if name.lower() == "content-type":
+                environ["CONTENT_TYPE"] = value
+            else:
+                environ[f"HTTP_{name.upper().replace('-', '_')}"] = value
+        setup_testing_defaults(environ)
+
+        started = {}
+
+        def start_response(status, response_headers):
+            started["status"] = status
+            started["headers"] = dict(response_headers)
+
+        body = b"".join(application(environ, start_response))
+        return started["status"], started["headers"], body
+
+    return request
+
+
+def test_wsgi_get(wsgi):
+    status, headers, body = wsgi("/.well-known/terraform.json")
+    assert status == "200 OK"
+    assert headers["Content-Type"] == "application/json"
+    assert json.loads(body) == {"modules.v1": "/modules/"}
+
+    status, _, body = wsgi("/modules/search")
+    assert status == "400 Bad Request"
+
+    status, _, _ = wsgi("/modules/namespace/name/provider/versions/dne")
+    assert status == "403 Forbidden"
+
+
+def test_wsgi_query_and_body(wsgi):
+    status, _, body = wsgi("/modules/search", query="q=dne")
+    assert status == "200 OK"
+    assert json.loads(body)["modules"] == []
+
+    request = {"modules": [{"source": "namespace/dne/provider", "version": "1.0"}]}
+    status, _, body = wsgi(
+        "/modules/resolve",
+        method="POST",
+        headers={"Content-Type": "application/json"},
+        body=json.dumps(request).encode(),
+    )
+    assert status == "200 OK"
+    assert "error" in json.loads(body)["modules"][0]
+
+
+def test_wsgi_decodes_compressed_bodies(wsgi, monkeypatch):
+    from chalicelib import compression
+
+    monkeypatch.setattr(compression, "ZTR_HTTP_COMPRESS_MIN_SIZE", 0)
+    monkeypatch.setattr(compression, "_brotli", False)
+    status, headers, body = wsgi(
+        "/modules/search", query="q=dne", headers={"Accept-Encoding": "gzip"}
+    )
+    assert status == "200 OK"
+    assert headers["Content-Encoding"] == "gzip"
+    assert json.loads(gzip.decompress(body))["modules"] == []
+
+
+def test_current_request_is_thread_local():
+    from chalicelib.server import ThreadLocalChalice
+
+    app = ThreadLocalChalice(app_name="test")
+    barrier = Barrier(2)
+
+    def serve(request):
+        app.current_request = request
+        barrier.wait()
+        return app.current_request
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        assert list(executor.map(serve, ["a", "b"])) == ["a", "b"]
+    assert app.current_request is None
+
+
+def test_apply_chalice_stage(tmp_path, monkeypatch):
+    from chalicelib.server import apply_chalice_stage
+
+    (tmp_path / ".chalice").mkdir()
+    (tmp_path / ".chalice" / "config.json").write_text(
+        json.dumps(
+            {
+                "environment_variables": {"ZTR_TEST_GLOBAL": "global"},
+                "stages": {
+                    "prod": {
+                        "environment_variables": {
+                            "ZTR_TEST_STAGE": "prod",
+                            "ZTR_TEST_SET": "prod",
+                        }
+                    }
+                },
+            }
+        )
+    )
+    for name in ("ZTR_TEST_GLOBAL", "ZTR_TEST_STAGE"):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setenv("ZTR_TEST_SET", "environment")
+
+    apply_chalice_stage("prod", str(tmp_path))
+
+    assert os.environ["ZTR_TEST_GLOBAL"] == "global"
+    assert os.environ["ZTR_TEST_STAGE"] == "prod"
+    assert os.environ["ZTR_TEST_SET"] == "environment"
+    for name in ("ZTR_TEST_GLOBAL", "ZTR_TEST_STAGE"):
+        monkeypatch.delenv(name)
+
+
+def test_warm_up():
+    from chalicelib.models import ModuleModel
+    from chalicelib.server import warm_up
+
+    connection = ModuleModel._get_connection()
+    warm_up([ModuleModel])
+    assert ModuleModel._get_connection() is not connection
+    assert ModuleModel._get_connection().connection._client is not None
@@ -0,0 +1,129 @@
+#  Copyright (c) 2020 Zero A.E., LLC
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event
+
+import pytest
+
+
+def _wait_collapsed(flights, count: int) -> None:
+    while flights.stats()["collapsed"] < count:
+        pass
+
+
+def test_concurrent_calls_share_one_call():
+    from chalicelib.singleflight import SingleFlight
+
+    flights = SingleFlight()
+    release = Event()
+    calls = []
+
+    def call():
+        calls.append(1)
+        release.wait(5)
+        return ["1.0.0"]
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        futures = [executor.submit(flights.do, "key", call) for _ in range(8)]
+        _wait_collapsed(flights, 7)
+        release.set()
+        results = [f.result() for f in futures]
+
+    assert len(calls) == 1
+    assert all(result is results[0] for result in results)
+    assert flights.stats() == {"calls": 1, "collapsed": 7, "errors": 0, "timeouts": 0}
+
+
+def test_calls_are_not_shared_once_done():
+    from chalicelib.singleflight import SingleFlight
+
+    flights = SingleFlight()
+    assert flights.do("key", lambda: 1) == 1
+    assert flights.do("key", lambda: 2) == 2
+    assert flights.do("other", lambda: 3) == 3
+    assert flights.stats()["calls"] == 3
+
+
+def test_errors_are_propagated_to_the_waiters():
+    from chalicelib.singleflight import SingleFlight
+
+    flights = SingleFlight()
+    release = Event()
+
+    def call():
+        release.wait(5)
+        raise ValueError("throttled")
+
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        futures = [executor.submit(flights.do, "key", call) for _ in range(3)]
+        _wait_collapsed(flights, 2)
+        release.set()
+        for future in futures:
+            with pytest.raises(ValueError, match="throttled"):
+                future.result()
+
+    assert flights.stats()["errors"] == 1
+    # A failed call is not remembered
+    assert flights.do("key", lambda: "value") == "value"
+
+
+def test_waiters_time_out():
+    from chalicelib.singleflight import FlightTimeout, SingleFlight
+
+    flights = SingleFlight(timeout=5)
+    started, release = Event(), Event()
+
+    def call():
+        started.set()
+        release.wait(5)
+        return "value"
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        leader = executor.submit(flights.do, "key", call)
+        started.wait(5)
+        with pytest.raises(FlightTimeout):
+            flights.do("key", call, timeout=0.01)
+        release.set()
+        assert leader.result() == "value"
+
+    assert flights.stats()["timeouts"] == 1
+
+
+def test_do_many():
+    from chalicelib.singleflight import SingleFlight
+
+    flights = SingleFlight()
+    started, release = Event(), Event()
+    loaded = []
+
+    def call():
+        started.set()
+        release.wait(5)
+        return "A"
+
+    def load(keys):
+        loaded.extend(keys)
+        return {key: key.upper() for key in keys if key != "c"}
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        in_flight = executor.submit(flights.do, "a", call)
+        started.wait(5)
+        many = executor.submit(flights.do_many, ["a", "b", "c", "b"], load)
+        _wait_collapsed(flights, 1)
+        release.set()
+        assert many.result() == {"a": "A", "b": "B", "c": None}
+        assert in_flight.result() == "A"
+
+    assert loaded == ["b", "c"]
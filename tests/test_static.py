@@ -0,0 +1,146 @@
+#  Copyright (c) 2020 Zero A.E., LLC
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import io
+import json
+
+import pytest
+
+
+@pytest.fixture(name="catalog")
+def fixture_catalog():
+    from chalicelib.db import db_batch_write
+    from chalicelib.models import ModuleModel, ModuleName
+
+    modules = [
+        ModuleModel(
+            ModuleName("static", f"module-{i}", "aws"),
+            version,
+            getter_url=f"git::https://example.com/module-{i}?ref={version}",
+        )
+        for i in range(3)
+        for version in ["1.10.0", "1.2.0", "2.0.0-rc.1"]
+    ]
+    db_batch_write(ModuleModel, (m.serialize() for m in modules))
+    yield modules
+
+    with ModuleModel.batch_write() as batch:
+        for module in ModuleModel.scan():
+            batch.delete(module)
+
+
+def test_publish(catalog, tmp_path):
+    from chalicelib.blobs import LocalBlobStore
+    from chalicelib.static import publish
+
+    report = publish(LocalBlobStore(str(tmp_path)))
+    assert (report.modules, report.changed, report.removed) == (3, 3, 0)
+
+    discovery = json.loads((tmp_path / ".well-known" / "terraform.json").read_text())
+    assert discovery == {"modules.v1": "/modules/"}
+
+    module = tmp_path / "modules" / "static" / "module-1" / "aws"
+    versions = json.loads((module / "versions").read_text())
+    assert [v["version"] for v in versions["modules"][0]["versions"]] == [
+        "1.2.0",
+        "1.10.0",
+        "2.0.0-rc.1",
+    ]
+    assert json.loads((module / "1.2.0" / "download").read_text()) == {
+        "location": "git::https://example.com/module-1?ref=1.2.0"
+    }
+    assert json.loads((module / "download").read_text()) == {
+        "location": "git::https://example.com/module-1?ref=2.0.0-rc.1"
+    }
+
+
+def test_publish_is_incremental(catalog, tmp_path):
+    from chalicelib.blobs import LocalBlobStore
+    from chalicelib.models import ModuleModel, ModuleName
+    from chalicelib.static import publish
+
+    store = LocalBlobStore(str(tmp_path))
+    publish(store)
+
+    report = publish(store)
+    assert (report.changed, report.removed, report.written) == (0, 0, 0)
+
+    ModuleModel.get(ModuleName("static", "module-0", "aws"), "1.2.0").delete()
+    ModuleModel.get(ModuleName("static", "module-2", "aws"), "1.2.0").delete()
+    ModuleModel.get(ModuleName("static", "module-2", "aws"), "1.10.0").delete()
+    ModuleModel.get(ModuleName("static", "module-2", "aws"), "2.0.0-rc.1").delete()
+    ModuleModel(
+        ModuleName("static", "module-1", "aws"), "3.0.0", getter_url="./v3"
+    ).save()
+
+    report = publish(store)
+    assert (report.modules, report.changed, report.removed) == (2, 2, 1)
+
+    modules = tmp_path / "modules" / "static"
+    assert not (modules / "module-0" / "aws" / "1.2.0" / "download").exists()
+    assert not (modules / "module-2" / "aws" / "versions").exists()
+    assert json.loads((modules / "module-1" / "aws" / "download").read_text()) == {
+        "location": "./v3"
+    }
+
+
+class FakeS3Client(object):
+    """An in-memory stand-in of the S3 client methods used by S3BlobStore"""
+
+    class exceptions(object):
+        class NoSuchKey(Exception):
+            pass
+
+    class meta(object):
+        endpoint_url = "http://s3.localhost"
+
+    def __init__(self):
+        self.objects = {}
+
+    def put_object(self, Bucket, Key, Body, ContentType=None):
+        self.objects[(Bucket, Key)] = (Body, ContentType)
+
+    def get_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise self.exceptions.NoSuchKey(Key)
+        return {"Body": io.BytesIO(self.objects[(Bucket, Key)][0])}
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop((Bucket, Key), None)
+
+
+def test_publish_to_s3(catalog):
+    from chalicelib.blobs import S3BlobStore
+    from chalicelib.static import MANIFEST_KEY, publish
+
+    client = FakeS3Client()
+    store = S3BlobStore("registry", "/public/", client=client)
+    publish(store)
+
+    body, content_type = client.objects[
+        ("registry", "public/modules/static/module-0/aws/versions")
+    ]
+    assert content_type == "application/json"
+    assert json.loads(body)["modules"][0]["source"] == "static/module-0/aws"
+    assert store.exists(MANIFEST_KEY)
+    assert store.url("x/y") == "s3::http://s3.localhost/registry/public/x/y"
+
+    assert publish(store).written == 0
+
+
+def test_local_blob_store_rejects_escaping_keys(tmp_path):
+    from chalicelib.blobs import LocalBlobStore
+
+    with pytest.raises(ValueError):
+        LocalBlobStore(str(tmp_path / "root")).put("../outside", b"")
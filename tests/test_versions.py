@@ -0,0 +1,62 @@
+#  Copyright (c) 2020 Zero A.E., LLC
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+from functools import cmp_to_key
+from random import shuffle
+
+import semver
+
+
+def test_version_key_order():
+    from chalicelib.versions import version_key
+
+    # Ordered by semantic version precedence, c.f. https://semver.org/#spec-item-11
+    versions = [
+        "0.0.0",
+        "0.9.0",
+        "0.10.0",
+        "1.0.0-0.3.7",
+        "1.0.0-alpha",
+        "1.0.0-alpha.1",
+        "1.0.0-alpha.beta",
+        "1.0.0-alpha-1",
+        "1.0.0-beta",
+        "1.0.0-beta.2",
+        "1.0.0-beta.11",
+        "1.0.0-rc.1",
+        "1.0.0",
+        "1.0.1",
+        "1.2.0",
+        "1.10.0",
+        "10.0.0",
+        "20200101.0.0",
+    ]
+    shuffled = list(versions)
+    shuffle(shuffled)
+
+    assert sorted(shuffled, key=version_key) == versions
+    assert sorted(shuffled, key=cmp_to_key(semver.compare)) == versions
+
+
+def test_version_key_ignores_build_metadata():
+    from chalicelib.versions import version_key
+
+    assert version_key("1.0.0+build.1") == version_key("1.0.0")
+
+
+def test_version_key_invalid():
+    from chalicelib.versions import version_key
+
+    assert version_key("latest") is None
+    assert version_key(None) is None
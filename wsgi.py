@@ -0,0 +1,32 @@
+#  Copyright (c) 2020 Zero A.E., LLC
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+The production serving mode outside Lambda, for any WSGI server
+
+    gunicorn --config gunicorn.conf.py wsgi:application
+
+The environment variables of the ZTR_SERVER_STAGE Chalice stage are applied
+first, as `chalice local --stage` does.
+"""
+import os
+
+from chalicelib.server import WSGIApplication, apply_chalice_stage
+
+apply_chalice_stage(os.environ.get("ZTR_SERVER_STAGE", "local"))
+
+from app import app  # noqa: E402, reads the configuration applied above
+from chalicelib.config import ZTR_SERVER_STAGE  # noqa: E402
+
+application = WSGIApplication(app, stage=ZTR_SERVER_STAGE)